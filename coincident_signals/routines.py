@@ -1,6 +1,12 @@
+import os
+import cPickle
 from todloop.base import Routine
-from todloop.utils.cuts import remove_overlap_tod, trim_edge_cuts, merge_cuts, common_cuts
-from todloop.utils.pixels import PixelReader
+from todloop.routines import OutputRoutine
+from todloop.index import get_ctime
+from todloop.utils.cuts import remove_overlap_tod, trim_edge_cuts, find_coincidences, get_peak_pixels, \
+    get_event_ids
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import save_snippets
 import numpy as np
 
 
@@ -48,7 +54,8 @@ class FindCosigs(Routine):
 
     #def __init__(self, season="2017", array="AR5", input_key="cuts", output_key="cosig", strict=True, polarized=False):
 
-    def __init__(self, season="2016", input_key="cuts", output_key="cosig", strict=True, polarized=False):
+    def __init__(self, season="2016", input_key="cuts", output_key="cosig", strict=True, polarized=False,
+                 all_modes=False):
 
         """
         :param input_key: string
@@ -59,6 +66,9 @@ class FindCosigs(Routine):
         :param polarized: boolean - True means that we are looking for potentially
                         polarized signals. False means that we only look for
                         un-polarized signals.
+        :param all_modes: boolean - find the cosigs of the four combinations of
+                        strict and polarized at once, saved under the keys given
+                        by get_mode_keys such as cosig_strict_unpolarized
         """
         Routine.__init__(self)
         self._input_key = input_key
@@ -67,108 +77,80 @@ class FindCosigs(Routine):
         self._strict = strict
         self._polarized = polarized
         self._season = season
+        self._all_modes = all_modes
+        self._pixel_dets = {}  # {array: (pixels, detectors of each pixel)}
 
     def initialize(self):
-        if (not self._strict) and (not self._polarized):  # give a warning
+        if (not self._all_modes) and (not self._strict) and (not self._polarized):  # give a warning
             print '[WARNING] Using loose mode for unpolarized signals may not be accurate'
 
+    def get_pixel_dets(self, array):
+        """Return the pixels with at least one TES detector in each
+        frequency and their detectors for f1 and f2 (see
+        find_coincidences). Computed once per array.
+        :param array: string - name of the array
+        :return: pixels: [int], pixel_dets: int array (npix, 2, 2),
+                 strict: bool array - pixels with 4 TES detectors"""
+        if array not in self._pixel_dets:
+            self._pr = get_pixel_reader(season=self._season, array=array)
+            pixels, pixel_dets, pixel_ndets = self._pr.get_pixel_table()
+            supported = np.all((pixel_ndets == 1) | (pixel_ndets == 2), axis=1)
+            pixel_dets = pixel_dets[supported]
+            strict = np.all(pixel_dets >= 0, axis=(1, 2))
+            self._pixel_dets[array] = ([int(p) for p in pixels[supported]], pixel_dets, strict)
+        return self._pixel_dets[array]
+
+    def get_mode_keys(self):
+        """Return the output key of each mode with all_modes
+        :return: {(strict, polarized): key}"""
+        keys = {}
+        for strict in [True, False]:
+            for polarized in [True, False]:
+                keys[(strict, polarized)] = "%s_%s_%s" % (self._output_key, "strict" if strict else "loose",
+                                                          "polarized" if polarized else "unpolarized")
+        return keys
+
+    def get_keys(self):
+        reads, writes = Routine.get_keys(self)
+        if self._all_modes:
+            writes = set(self.get_mode_keys().values())
+        writes.add("nsamps")
+        return reads, writes
+
     def execute(self):
         # retrieve all cuts
-        self._pr = PixelReader(season=self._season, array=self.get_context().get_array())
         cuts_data = self.get_store().get(self._input_key)  # get saved cut data
         cuts = cuts_data['cuts']
         nsamps = cuts_data['nsamps']
 
-        # get all pixels
-        pixels = self._pr.get_pixels()
-
-        # initialize dictionary to store coincident signals
-        cosig = {}
-
-        # loop through pixels and find cosig for each pixel
-        for p in pixels:
-            dets_f1 = self._pr.get_f1(p)
-            dets_f2 = self._pr.get_f2(p)
-
-            if self._strict:  # strict mode, 4 TES have to be present
-                if len(dets_f1) == 2 and len(dets_f2) == 2:
-                    cuts_f1_A = cuts.cuts[dets_f1[0]]  # low freq, polarization A
-                    cuts_f1_B = cuts.cuts[dets_f1[1]]  # low freq, polarization B
-
-                    cuts_f2_A = cuts.cuts[dets_f2[0]]  # high freq, polarization A
-                    cuts_f2_B = cuts.cuts[dets_f2[1]]  # high freq, polarization B
-
-                    if self._polarized:  # if looking for polarized, glitch may occur in either polarization
-                        cuts_f1 = merge_cuts(cuts_f1_A, cuts_f1_B)  # polarized spikes may appear at either pol
-                        cuts_f2 = merge_cuts(cuts_f2_A, cuts_f2_B)
-
-                    else:  # if looking for unpolarized, glitch must occur in both polarizations
-                        cuts_f1 = common_cuts(cuts_f1_A, cuts_f1_B)  # unpolarized spikes appear in both pols
-                        cuts_f2 = common_cuts(cuts_f2_A, cuts_f2_B)
-
-                    cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
-
-            else:  # loose mode, at least one TES has to be present each freq
-                if len(dets_f1) == 2 and len(dets_f2) == 2:
-                    cuts_f1_A = cuts.cuts[dets_f1[0]]  # low freq, polarization A
-                    cuts_f1_B = cuts.cuts[dets_f1[1]]  # low freq, polarization B
-
-                    cuts_f2_A = cuts.cuts[dets_f2[0]]  # high freq, polarization A
-                    cuts_f2_B = cuts.cuts[dets_f2[1]]  # high freq, polarization B
-
-                    if self._polarized:  # if looking for polarized, glitch may occur in either polarization
-                        cuts_f1 = merge_cuts(cuts_f1_A, cuts_f1_B)  # polarized spikes may appear at either pol
-                        cuts_f2 = merge_cuts(cuts_f2_A, cuts_f2_B)
-
-                    else:  # if looking for unpolarized, glitch must occur in both polarizations
-                        cuts_f1 = common_cuts(cuts_f1_A, cuts_f1_B)  # unpolarized spikes appear in both pols
-                        cuts_f2 = common_cuts(cuts_f2_A, cuts_f2_B)
-
-                    cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
-
-                elif len(dets_f1) == 1 and len(dets_f2) == 2:
-                    cuts_f1 = cuts.cuts[dets_f1[0]]  # low freq, polarization A
-
-                    cuts_f2_A = cuts.cuts[dets_f2[0]]  # high freq, polarization A
-                    cuts_f2_B = cuts.cuts[dets_f2[1]]  # high freq, polarization B
-
-                    if self._polarized:  # if looking for polarized, glitch may occur in either polarization
-                        cuts_f2 = merge_cuts(cuts_f2_A, cuts_f2_B)
-
-                    else:  # if looking for unpolarized, glitch must occur in both polarizations
-                        cuts_f2 = common_cuts(cuts_f2_A, cuts_f2_B)
-
-                    cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
-
-                elif len(dets_f1) == 2 and len(dets_f2) == 1:
-                    cuts_f1_A = cuts.cuts[dets_f1[0]]  # low freq, polarization A
-                    cuts_f1_B = cuts.cuts[dets_f1[1]]  # low freq, polarization B
-
-                    cuts_f2 = cuts.cuts[dets_f2[0]]  # high freq, polarization A
-
-                    if self._polarized:  # if looking for polarized, glitch may occur in either polarization
-                        cuts_f1 = merge_cuts(cuts_f1_A, cuts_f1_B)
-
-                    else:  # if looking for unpolarized, glitch must occur in both polarizations
-                        cuts_f1 = common_cuts(cuts_f1_A, cuts_f1_B)
-
-                    cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
-
-                elif len(dets_f1) == 1 and len(dets_f2) == 1:
-                    cuts_f1 = cuts.cuts[dets_f1[0]]  # low freq, polarization A
-                    cuts_f2 = cuts.cuts[dets_f2[0]]  # high freq, polarization A
-
-                    cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
-
-        # cosig may contain empty cut vectors because we didn't enforce it, filter them out now
-        cosig_filtered = {}
-        for pixel in cosig:
-            cuts = cosig[pixel]
-            if len(cuts) != 0:
-                cosig_filtered[pixel] = cuts
-
-        # save cosig for further processing
-        self.get_store().set(self._output_key, cosig_filtered)  # save the coincident signals under the output_key
+        pixels, pixel_dets, strict = self.get_pixel_dets(self.get_context().get_array())
+        if self._all_modes:
+            modes = self.get_mode_keys()
+        else:
+            modes = {(self._strict, self._polarized): self._output_key}
+        if all(mode[0] for mode in modes):  # only strict mode, 4 TES have to be present
+            pixels = [p for p, s in zip(pixels, strict) if s]
+            pixel_dets, strict = pixel_dets[strict], strict[strict]
+
+        # find the coincident signals of all pixels at once: polarized spikes
+        # may appear at either pol, unpolarized spikes appear in both pols.
+        # The cosigs of the strict mode are those of the loose mode for the
+        # pixels with 4 TES
+        polarized = sorted(set(mode[1] for mode in modes))
+        coincidences = dict(zip(polarized, find_coincidences(cuts, pixel_dets, polarized)))
+
+        for mode, key in modes.items():
+            # store coincident signals by pixel id, leaving out empty cut vectors
+            packed = coincidences[mode[1]]
+            cosig = {}
+            for i, p in enumerate(pixels):
+                if mode[0] and not strict[i]:
+                    continue
+                if packed.det_offsets[i+1] > packed.det_offsets[i]:
+                    cosig[str(p)] = packed[i]
+
+            # save cosig for further processing
+            self.get_store().set(key, cosig)  # save the coincident signals under the output_key
         self.get_store().set("nsamps", nsamps)  # save the number of sampling points, not graceful
 
 
@@ -176,55 +158,357 @@ class FindEvents(Routine):
     """A routine to find events that cause multiple cosigs
     dependency: FindCosigs"""
     def __init__(self, input_key="cosig", output_key="events"):
+        """
+        :param input_key: string or [string] - key of the cosigs, or a list
+                          of keys such as the outputs of FindCosigs with
+                          all_modes
+        :param output_key: string or [string] - one output key per input key
+        """
         Routine.__init__(self)
         self._input_key = input_key
         self._output_key = output_key
         self._cosig = None
         self._nsamps = None
 
-    def find_peaks(self, hist):
-        """Find peaks in the histogram corresponding to physical events
-        :param hist: histogram of coincident signals
-        :return: list: [start_time, end_time, duration, n_pixels_affected]
+    def get_keys(self):
+        reads, writes = Routine.get_keys(self)
+        reads.add("nsamps")  # written by FindCosigs
+        return reads, writes
+
+    def find_peaks(self):
+        """Find peaks in the number of pixels with a coincident signal at
+        each sample, corresponding to physical events. The peaks are found
+        by sweeping over the sorted starts and ends of the cosigs of all
+        pixels, instead of going through every sample.
+        :return: peaks: list: [start_time, end_time, duration, n_pixels_affected]
+                 peak_pixels: dict: {start_time: [pixels affected]}
         """
-        last = 0
-        peaks = []
-        for i in range(self._nsamps):
-            if hist[i] > 0 and last == 0:
-                peak_start = i
-            if hist[i] == 0 and last > 0:
-                peak_end = i
-                peak_amp = max(hist[peak_start:peak_end])
-                peak_duration = peak_end - peak_start
-                peaks.append([peak_start, peak_end, peak_duration, peak_amp])
-            last = hist[i]
-        return peaks
+        pixels, intervals = [], []
+        for pixel in self._cosig:
+            cuts = np.clip(np.asarray(self._cosig[pixel]).reshape(-1, 2), 0, self._nsamps)
+            intervals.append(cuts)
+            pixels.extend([pixel] * len(cuts))
+        if len(pixels) == 0:
+            return [], {}
+        intervals = np.vstack(intervals)
+        pixels = np.array(pixels)
+
+        # number of pixels between each boundary and the next one
+        positions, inverse = np.unique(intervals, return_inverse=True)
+        steps = np.tile([1, -1], len(intervals))
+        counts = np.cumsum(np.bincount(inverse.ravel(), weights=steps, minlength=len(positions))).astype(int)
+
+        # a peak is a run of consecutive segments with a non-zero count
+        active = counts > 0
+        before = np.append(False, active[:-1])
+        first = np.nonzero(active & ~before)[0]  # first segment of each peak
+        last = np.nonzero(~active & before)[0]  # segment after each peak
+        amplitudes = np.maximum.reduceat(counts, first) if len(first) > 0 else []
+
+        # pixels affected by each peak, grouped by peak
+        nonempty = intervals[:, 1] > intervals[:, 0]
+        peak_index = np.searchsorted(positions[first], intervals[nonempty, 0], side='right') - 1
+        order = np.argsort(peak_index, kind='mergesort')
+        groups = np.split(pixels[nonempty][order], np.searchsorted(peak_index[order], np.arange(1, len(first))))
+
+        peaks, peak_pixels = [], {}
+        for i in range(len(first)):
+            peak_start, peak_end = int(positions[first[i]]), int(positions[last[i]])
+            if peak_end >= self._nsamps:
+                continue  # a peak lasting until the end of the TOD was never closed
+            peaks.append([peak_start, peak_end, peak_end - peak_start, int(amplitudes[i])])
+            peak_pixels[peak_start] = sorted(set(int(p) for p in groups[i]))
+        return peaks, peak_pixels
 
     def execute(self):
-        self._cosig = self.get_store().get(self._input_key)
+        if isinstance(self._input_key, (list, tuple)):
+            keys = zip(self._input_key, self._output_key)
+        else:
+            keys = [(self._input_key, self._output_key)]
         self._nsamps = self.get_store().get("nsamps")  # get nsamps from FindCosigs, not graceful
 
-        # generate a histogram of cosigs
-        cosig_hist = np.zeros(self._nsamps)
+        for input_key, output_key in keys:
+            self._cosig = self.get_store().get(input_key)
+            cosig_peaks, peak_pixels = self.find_peaks()
+
+            # export the coincident signals and the peaks found in a combined dictionary
+            cosig_combined = {
+                'coincident_signals': self._cosig,
+                'peaks': cosig_peaks,
+                'peak_pixels': peak_pixels
+            }
+            self.get_store().set(output_key, cosig_combined)
+
+
+class FindClusters(Routine):
+    """A routine to find events like FindEvents, but splitting the cosigs
+    that overlap in time into clusters of adjacent pixels, so that
+    unrelated glitches in different parts of the array at the same time
+    are separate events. Each peak is [start_time, end_time, duration,
+    n_pixels_affected, pixels affected].
+    dependency: FindCosigs"""
+    def __init__(self, season="2016", input_key="cosig", output_key="events"):
+        """
+        :param season: string - season of the array, for PixelReader
+        :param input_key: string - key of the cosigs
+        :param output_key: string
+        """
+        Routine.__init__(self)
+        self._season = season
+        self._input_key = input_key
+        self._output_key = output_key
+        self._adjacency = {}  # {array: {pixel: [adjacent pixels]}}
+
+    def get_keys(self):
+        reads, writes = Routine.get_keys(self)
+        reads.add("nsamps")  # written by FindCosigs
+        return reads, writes
+
+    def get_adjacency(self, array):
+        """Return the adjacent pixels of each pixel, computed once per array"""
+        if array not in self._adjacency:
+            pr = get_pixel_reader(season=self._season, array=array)
+            self._adjacency[array] = dict((p, pr.get_adjacent_pixels(p)) for p in pr.get_pixels())
+        return self._adjacency[array]
 
-        for pixel in self._cosig:  # loop through key and value pair in cosig dict
-            cuts = self._cosig[pixel]
-            mask = cuts.get_mask(nsamps=self._nsamps)
-            cosig_hist += mask
+    def execute(self):
+        cosig = self.get_store().get(self._input_key)
+        nsamps = self.get_store().get("nsamps")  # get nsamps from FindCosigs, not graceful
+        adjacency = self.get_adjacency(self.get_context().get_array())
 
-        cosig_peaks = self.find_peaks(cosig_hist)
+        peaks = [peak for peak in find_clusters(cosig, adjacency)
+                 if peak[1] < nsamps]  # like FindEvents, leave out the peaks lasting until the end
+        print '[INFO] Found %d clusters' % len(peaks)
 
         # export the coincident signals and the peaks found in a combined dictionary
         cosig_combined = {
-            'coincident_signals': self._cosig,
-            'peaks': cosig_peaks
+            'coincident_signals': cosig,
+            'peaks': peaks
         }
         self.get_store().set(self._output_key, cosig_combined)
 
 
+def find_clusters(cosig, adjacency):
+    """Group the coincident signals of the pixels into clusters of cosigs
+    that overlap (or touch) in time on adjacent pixels. The cosigs are
+    swept by start time, and each one is joined with a union-find to the
+    latest cosig of each adjacent pixel if they overlap, which is the only
+    one that can since the cosigs of a pixel don't overlap.
+    :param cosig: {pixel: CutVector}
+    :param adjacency: {pixel: [adjacent pixels]}
+    :return: [[start_time, end_time, duration, n_pixels_affected, pixels]]
+             where n_pixels_affected is the largest number of pixels of the
+             cluster with a cosig at the same time"""
+    pixels, cuts = [], [np.zeros((0, 2), dtype=int)]
+    for p in cosig:
+        cv = np.asarray(cosig[p]).reshape(-1, 2)
+        pixels.extend([int(p)] * len(cv))
+        cuts.append(cv)
+    cuts = np.concatenate(cuts)
+    order = np.argsort(cuts[:, 0], kind='mergesort')
+    starts, ends = cuts[order, 0], cuts[order, 1]
+    pixels = np.array(pixels, dtype=int)[order]
+    if len(pixels) == 0:
+        return []
+
+    parents = range(len(pixels))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]  # path halving
+            i = parents[i]
+        return i
+
+    latest = {}  # {pixel: index of its latest cosig}
+    for i in range(len(pixels)):
+        p = int(pixels[i])
+        for q in adjacency.get(p, []):
+            j = latest.get(q)
+            if j is not None and ends[j] >= starts[i]:
+                parents[find(i)] = find(j)
+        latest[p] = i
+    clusters = np.array([find(i) for i in range(len(pixels))])
+
+    # the largest number of simultaneous pixels of each cluster, from a
+    # sweep of the boundaries of each cluster (ends before starts), each
+    # cluster going back to 0 before the next one
+    positions = np.concatenate([starts, ends])
+    steps = np.concatenate([np.ones(len(starts), dtype=int), -np.ones(len(ends), dtype=int)])
+    groups = np.concatenate([clusters, clusters])
+    sweep = np.lexsort((steps, positions, groups))
+    counts = np.cumsum(steps[sweep])
+    group_first = np.append(0, np.nonzero(np.diff(groups[sweep]))[0] + 1)
+    amplitudes = np.maximum.reduceat(counts, group_first)
+
+    # extent and pixels of each cluster, in the same order of clusters
+    by_cluster = np.argsort(clusters, kind='mergesort')
+    cluster_first = np.append(0, np.nonzero(np.diff(clusters[by_cluster]))[0] + 1)
+    cluster_starts = np.minimum.reduceat(starts[by_cluster], cluster_first)
+    cluster_ends = np.maximum.reduceat(ends[by_cluster], cluster_first)
+    cluster_pixels = np.split(pixels[by_cluster], cluster_first[1:])
+
+    peaks = []
+    for i in range(len(cluster_first)):
+        peak_start, peak_end = int(cluster_starts[i]), int(cluster_ends[i])
+        peaks.append([peak_start, peak_end, peak_end - peak_start, int(amplitudes[i]),
+                      sorted(set(int(p) for p in cluster_pixels[i]))])
+    peaks.sort(key=lambda peak: (peak[0], peak[1]))
+    return peaks
+
+
+class SaveSnippets(OutputRoutine):
+    """A routine that saves the calibrated timeseries of the pixels of
+    every event, with a buffer around it, in <tod_id>.npz in the output
+    folder. Loading them back with SnippetLoader in place of the TOD lets
+    the correlation, energy and plotting routines run again without
+    loading the TODs, the most expensive step.
+    dependency: FindEvents or FindClusters, TODLoader, FixOpticalSign,
+                CalibrateTOD"""
+    def __init__(self, season="2016", cosig_key="events", tod_key="tod_data", output_dir="outputs/snippets/",
+                 buffer=20):
+        """
+        :param season: string - season of the array, for PixelReader
+        :param cosig_key: string - key of the events, either a dict with
+                          peaks (and coincident_signals if the peaks don't
+                          list their pixels) or a list of event dicts
+        :param tod_key: string - key of the calibrated tod_data
+        :param output_dir: string
+        :param buffer: int - samples kept on both sides of each event
+        """
+        OutputRoutine.__init__(self, output_dir)
+        self._season = season
+        self._cosig_key = cosig_key
+        self._tod_key = tod_key
+        self._buffer = buffer
+
+    def get_events(self):
+        """Return the events as [(event_id, start, end, pixels)], with
+        the event_id of the event dicts (see get_event_ids)"""
+        data = self.get_store().get(self._cosig_key)
+        tod_id = self.get_context().get_id()
+        if isinstance(data, dict):
+            return [(event_id, peak[0], peak[1], get_peak_pixels(data, peak, self.get_store()))
+                    for event_id, peak in zip(get_event_ids(tod_id, data['peaks']), data['peaks'])]
+        return [(event['id'], event['start'], event['end'], event['pixels_affected']) for event in data]
 
+    def execute(self):
+        tod_data = self.get_store().get(self._tod_key)
+        pr = get_pixel_reader(season=self._season, array=self.get_context().get_array())
+        events = self.get_events()
+        filepath = self._output_dir + str(self.get_context().get_id()) + ".npz"
+        save_snippets(filepath, tod_data, pr, events, self._buffer)
+
+
+class FindArrayCoincidences(OutputRoutine):
+    """A routine that relates the events seen by different arrays
+    observing at the same time, such as PA4, PA5 and PA6 in 2017. It runs
+    over a list containing the TODs of all arrays, collects the peaks of
+    each TOD with their ctimes, and in finalize joins them across arrays
+    with a sort-merge on ctime. The coincident events are saved in
+    array_coincidences.pickle in the output folder.
+    dependency: FindEvents"""
+    _state_keys = ['_events']
+
+    def __init__(self, input_key="events", output_dir="outputs/array_coincidences/", tolerance=1.0,
+                 min_arrays=2, sampling_rate=399.3, tod_key=None):
+        """
+        :param input_key: string - key of the output of FindEvents
+        :param output_dir: string
+        :param tolerance: float - seconds between the events of different
+                          arrays to still be coincident. The ctime of a TOD
+                          name is rounded to the second, but the TODs of the
+                          arrays start together, so this mostly covers the
+                          duration of the events
+        :param min_arrays: int - number of arrays that must see an event
+        :param sampling_rate: float - Hz, to convert samples to ctime
+        :param tod_key: string - if given, the ctimes are taken from the
+                        tod_data under this key instead
+        """
+        OutputRoutine.__init__(self, output_dir)
+        self._input_key = input_key
+        self._tolerance = tolerance
+        self._min_arrays = min_arrays
+        self._sampling_rate = sampling_rate
+        self._tod_key = tod_key
+        self._events = []  # [(ctime_start, ctime_end, array, tod_id, peak)]
 
-
-
-
-
+    def execute(self):
+        data = self.get_store().get(self._input_key)
+        tod_id = self.get_context().get_id()
+        array = self.get_context().get_array()
+        if self._tod_key:
+            ctimes = self.get_store().get(self._tod_key).ctime
+        else:
+            ctime = get_ctime(os.path.basename(self.get_context().get_name()))
+        for peak in data['peaks']:
+            if self._tod_key:
+                start, end = ctimes[peak[0]], ctimes[min(peak[1], len(ctimes)-1)]
+            else:
+                start = ctime + float(peak[0]) / self._sampling_rate
+                end = ctime + float(peak[1]) / self._sampling_rate
+            self._events.append((start, end, array, tod_id, peak))
+
+    def finalize(self):
+        coincidences = join_events(self._events, self._tolerance, self._min_arrays)
+        print '[INFO] Events: %d, coincident in %d arrays or more: %d' % (len(self._events), self._min_arrays,
+                                                                         len(coincidences))
+        filepath = self._output_dir + "array_coincidences.pickle"
+        with open(filepath + ".tmp", "w") as f:
+            cPickle.dump(coincidences, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(filepath + ".tmp", filepath)
+        print '[INFO] Data saved: %s' % filepath
+        OutputRoutine.finalize(self)
+
+
+def join_events(events, tolerance, min_arrays=2):
+    """Join the events of different arrays that are within a tolerance of
+    each other: an event of one array and an event of another are
+    coincident if one starts at most tolerance after the other ends.
+    Events of the same array are never joined, so a dense stream of
+    events in one array does not grow into a long group. The events are
+    sorted by ctime and swept once, each one being compared to the
+    events of the other arrays that end at most tolerance before it
+    starts. The coincident events are grouped in cliques: groups with
+    one event per array, all coincident with each other, that no event
+    of another array can be added to.
+    :param events: [(ctime_start, ctime_end, array, tod_id, peak)]
+    :param tolerance: float - seconds
+    :param min_arrays: int - number of different arrays in a group to keep it
+    :return: [{'ctime_start', 'ctime_end', 'arrays', 'events'}]"""
+    events = sorted(events, key=lambda e: (e[0], e[1]))
+    partners = [set() for _ in events]  # coincident events of other arrays
+    active = []  # events that can still be coincident with the next ones
+    for i, event in enumerate(events):
+        active = [j for j in active if events[j][1] + tolerance >= event[0]]
+        for j in active:
+            if events[j][2] != event[2]:
+                partners[i].add(j)
+                partners[j].add(i)
+        active.append(i)
+
+    def extend(clique, candidates):
+        """Yield the maximal cliques containing clique, from candidates"""
+        arrays = set(events[k][2] for k in clique)
+        candidates = [k for k in candidates if events[k][2] not in arrays]
+        if not candidates:
+            yield clique
+        for k in candidates:
+            for found in extend(clique + [k], [c for c in candidates if c > k and c in partners[k]]):
+                yield found
+
+    coincidences = []
+    for i in range(len(events)):
+        for clique in extend([i], sorted(k for k in partners[i] if k > i)):
+            group = [events[k] for k in clique]
+            common = set.intersection(*[partners[k] for k in clique])
+            if any(events[k][2] not in set(e[2] for e in group) for k in common):
+                continue  # not maximal, found with the event that can be added
+            arrays = sorted(set(e[2] for e in group))
+            if len(arrays) >= min_arrays:
+                coincidences.append({
+                    'ctime_start': group[0][0],
+                    'ctime_end': max(e[1] for e in group),
+                    'arrays': arrays,
+                    'events': [{'array': e[2], 'tod_id': e[3], 'peak': e[4]} for e in group]
+                })
+    return coincidences
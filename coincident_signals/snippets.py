@@ -0,0 +1,22 @@
+from todloop.base import TODLoop
+from todloop.routines import DataLoader
+from todloop.tod import TODLoader
+from calibration.routines import FixOpticalSign, CalibrateTOD
+from routines import SaveSnippets
+
+"""
+SAVE THE TIMESERIES OF ALL EVENTS ONCE
+Load the TODs a last time and keep only the pixels of the events. Add
+loop.add_routine(SnippetLoader(input_dir="../outputs/s16_pa3_list/snippets/", output_key="tod_data"))
+in place of TODLoader, FixOpticalSign and CalibrateTOD in the other
+analyses to run them without loading the TODs
+"""
+loop = TODLoop()
+loop.add_tod_list("../data/s16_pa3_list.txt")
+loop.add_routine(DataLoader(input_dir="../outputs/s16_pa3_list/cosig/", output_key="cuts"))
+loop.add_routine(TODLoader(output_key="tod_data"))
+loop.add_routine(FixOpticalSign(input_key="tod_data", output_key="tod_data"))
+loop.add_routine(CalibrateTOD(input_key="tod_data", output_key="tod_data"))
+loop.add_routine(SaveSnippets(cosig_key="cuts", tod_key="tod_data", output_dir="../outputs/s16_pa3_list/snippets/",
+                              buffer=20))
+loop.run(0, 1000)
@@ -1,13 +1,21 @@
 import moby2
 from todloop.routines import OutputRoutine
+from todloop.utils.cuts import PackedCuts
 
 
 class CompileCuts(OutputRoutine):
     """A routine that compile cuts"""
-    def __init__(self, input_key, glitchp, output_dir):
+    def __init__(self, input_key, glitchp, output_dir, packed=False):
+        """
+        :param input_key: string - key of the tod_data
+        :param glitchp: dict - parameters of the glitch finder
+        :param output_dir: string
+        :param packed: bool - save the cuts as PackedCuts instead of TODCuts
+        """
         OutputRoutine.__init__(self, output_dir)
         self._input_key = input_key
         self._glitchp = glitchp
+        self._packed = packed
 
     def execute(self):
         print '[INFO] Finding glitches'
@@ -15,6 +23,9 @@ class CompileCuts(OutputRoutine):
         glitch_cuts = moby2.tod.get_glitch_cuts(tod=tod_data, params=self._glitchp)
         mce_cuts = moby2.tod.get_mce_cuts(tod=tod_data)  # get mce cuts
         print "[INFO] Finding glitches complete"
+        if self._packed:  # smaller and faster to pickle and load
+            glitch_cuts = PackedCuts.from_tod_cuts(glitch_cuts)
+            mce_cuts = PackedCuts.from_tod_cuts(mce_cuts)
 
         # Save into pickle file
         cut_data = {
@@ -1,4 +1,4 @@
-from todloop.routines import Logger, DataLoader
+from todloop.routines import Logger, DataLoader, SnippetLoader
 from todloop.tod import TODLoader, TODInfoLoader
 from todloop.base import TODLoop
 from routines import CRCorrelationFilter, FRBCorrelationFilter, SlowCorrelationFilter, DurationFilter, PixelFilter,ScatterPlot,EdgeFilter
@@ -30,6 +30,7 @@ LOAD TOD DATA
 """
 
 loop.add_routine(TODLoader(output_key="tod_data"))
+#loop.add_routine(SnippetLoader(input_dir="../outputs/s16_pa3_list/snippets/", output_key="tod_data"))  # instead of the 3 TOD routines, see coincident_signals/snippets.py
 #loop.add_routine(Deconvolution(output_key="tod_data")) #load deconv data
 loop.add_routine(FixOpticalSign(input_key="tod_data", output_key="tod_data"))
 loop.add_routine(CalibrateTOD(input_key="tod_data",output_key="tod_data"))
@@ -3,10 +3,11 @@ matplotlib.use("TKAgg")
 import numpy as np
 import matplotlib.pyplot as plt
 from todloop.routines import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
 from todloop.utils.cuts import pixels_affected_in_event
 from todloop.utils.hist import Hist1D
-from todloop.utils.pixels import PixelReader
+from todloop.utils.snippets import get_timeseries
+from todloop.utils.pixels import get_pixel_reader
 
 
 class PlotHistogram(Routine):
@@ -31,6 +32,7 @@ class PlotHistogram(Routine):
 
 
 class CreateHistogram(Routine):
+    _state_keys = ['_hist']
  
     def __init__(self, cosig_key,tod_key, event_key="events"):
         Routine.__init__(self)
@@ -41,7 +43,7 @@ class CreateHistogram(Routine):
         self._pr = None
     
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
         self._hist = Hist1D(0, 5, 100) #change max
 
 
@@ -52,29 +54,7 @@ class CreateHistogram(Routine):
         tod_data = self.get_store().get(self._tod_key)    
         
         def energyseries(pixel, s_time, e_time, buffer=0):
-
-            start_time = s_time - buffer
-            end_time = e_time + buffer
-
-            a1, a2 = self._pr.get_f1(pixel)
-            b1, b2 = self._pr.get_f2(pixel)
-            d1, d2 = tod_data.data[a1], tod_data.data[a2]
-            d3, d4 = tod_data.data[b1], tod_data.data[b2]
-
-            d1 -= np.mean(d1[start_time:end_time])
-            d2 -= np.mean(d2[start_time:end_time])
-            d3 -= np.mean(d3[start_time:end_time])
-            d4 -= np.mean(d4[start_time:end_time])
-
-            time = tod_data.ctime - tod_data.ctime[0]
-            time = time[start_time:end_time]
-
-            d_1 = d1[start_time:end_time]
-            d_2 = d2[start_time:end_time]
-            d_3 = d3[start_time:end_time]
-            d_4 = d4[start_time:end_time]
-
-            return time, d_1, d_2, d_3, d_4
+            return get_timeseries(tod_data, self._pr, pixel, s_time, e_time, buffer)
 
 
 
@@ -83,10 +63,7 @@ class CreateHistogram(Routine):
 
             pix_all_amps = []
 
-            pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[1])
-            pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[2])
-            pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[3])
-            pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[4])
+            pix_all_amps.extend(energyseries(pid,start_time,end_time,buffer=0)[1:])
 
             Det_pWatts_90_a = []
             Det_pWatts_90_b = []
@@ -146,7 +123,7 @@ class CreateHistogram(Routine):
 
         event_list=[]
         for event in peaks:
-            pixels = pixels_affected_in_event(cosig, event)
+            pixels = pixels_affected_in_event(cosig, event, self.get_store())
             s_time = event[0]
             e_time = event[1]
             event_total_energy = 0
@@ -193,7 +170,7 @@ OLD CODE FOR REFERENCE
         peaks = cuts['peaks']
         cosig = cuts['coincident_signals']
         for event in peaks:
-            pixels = pixels_affected_in_event(cosig, event)
+            pixels = pixels_affected_in_event(cosig, event, self.get_store())
             s_time = event[0]
             e_time = event[1]
             event_total_energy = 0
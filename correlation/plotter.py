@@ -7,7 +7,8 @@ from scipy.interpolate import interp1d
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 from todloop.routines import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import get_timeseries
 from todloop.utils.cuts import pixels_affected_in_event
 
 class PlotGlitches(Routine):
@@ -20,7 +21,7 @@ class PlotGlitches(Routine):
         self._pr = None
 
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
 
     def execute(self):
         plot = raw_input("Do you want to plot an event? Enter y/n: ")
@@ -32,48 +33,12 @@ class PlotGlitches(Routine):
             #print('[INFO] peaks: ', peaks)
         
             def timeseries(pixel_id, s_time, e_time, buffer=10):
-
-                start_time = s_time - buffer
-                end_time = e_time + buffer
-                
-                a1, a2 = self._pr.get_f1(pixel_id)
-                d1, d2 = tod_data.data[a1], tod_data.data[a2]
-
-                # try to remove the mean from start_time to end_time
-                d1 -= np.mean(d1[start_time:end_time])
-                
-                time = tod_data.ctime - tod_data.ctime[0]
-                time = time[start_time:end_time]
-            
-                d_1 = d1[start_time:end_time]
-            
-                return time, d_1
+                # only the f1 detectors are used
+                return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer, required=(0, 1))[:2]
 
 
             def energyseries(pixel_id, s_time, e_time, buffer=0):
-
-                start_time = s_time - buffer
-                end_time = e_time + buffer
-
-                a1, a2 = self._pr.get_f1(pixel_id)
-                b1, b2 = self._pr.get_f2(pixel_id)
-                d1, d2 = tod_data.data[a1], tod_data.data[a2]
-                d3, d4 = tod_data.data[b1], tod_data.data[b2]
-
-                d1 -= np.mean(d1[start_time:end_time])
-                d2 -= np.mean(d2[start_time:end_time])
-                d3 -= np.mean(d3[start_time:end_time])
-                d4 -= np.mean(d4[start_time:end_time])
-
-                time = tod_data.ctime - tod_data.ctime[0]
-                time = time[start_time:end_time]
-
-                d_1 = d1[start_time:end_time]
-                d_2 = d2[start_time:end_time]
-                d_3 = d3[start_time:end_time]
-                d_4 = d4[start_time:end_time]
-
-                return time, d_1, d_2, d_3, d_4
+                return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer)
 
 
             """
@@ -91,8 +56,7 @@ class PlotGlitches(Routine):
                 plt.subplot2grid((11,11), (0,0), colspan=11, rowspan=3)                
                 for pid in pixels:
                
-                    x = timeseries(pid,start_time,end_time)[0]
-                    y = timeseries(pid,start_time,end_time)[1]
+                    x, y = timeseries(pid,start_time,end_time)
                 
                     plt.plot(x,y,'.-')
                     plt.title('Pixels affected from ' +str(start_time)+ '-' + str(end_time)+ ' at 90 GHz')
@@ -115,10 +79,7 @@ class PlotGlitches(Routine):
                     pix_all_amps = []
                     #freq_list = []                
                                     
-                    pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[1])
-                    pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[2])
-                    pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[3])
-                    pix_all_amps.append(energyseries(pid,start_time,end_time,buffer=0)[4])
+                    pix_all_amps.extend(energyseries(pid,start_time,end_time,buffer=0)[1:])
                     
                     #pix_id_lat.extend((pid, pid, pid, pid))
                     #freq_list.extend((90,90,150,150))
@@ -253,7 +214,7 @@ class PlotGlitches(Routine):
             #event = [260584, 260589, 5, 2]
             stime = event[0]
             etime = event[1]
-            pixels = pixels_affected_in_event(cs, event)
+            pixels = pixels_affected_in_event(cs, event, self.get_store())
             print '[INFO] Plotting Glitch...'
             plotter(pixels, stime, etime)
 
@@ -266,7 +227,7 @@ class PlotGlitches(Routine):
                     event = json.loads(e)
                     stime = event[0]
                     etime = event[1]
-                    pixels = pixels_affected_in_event(cs, event)
+                    pixels = pixels_affected_in_event(cs, event, self.get_store())
                     print '[INFO] Plotting Glitch...'
                     plotter(pixels, stime, etime)
         else:
@@ -5,7 +5,8 @@ import numpy as np
 import pandas as pd
 from scipy.interpolate import interp1d
 from todloop.base import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import get_timeseries
 from todloop.utils.cuts import pixels_affected_in_event
 
 
@@ -64,7 +65,7 @@ class CorrelationFilter(Routine):
         self._tag = None
 
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
 
     def execute(self):
         print '[INFO] Checking for correlation ...'
@@ -73,30 +74,7 @@ class CorrelationFilter(Routine):
         peaks = cuts['peaks']
 
         def timeseries(pixel_id, s_time, e_time, buffer=10):
-
-            start_time = s_time - buffer
-            end_time = e_time + buffer
-
-            a1, a2 = self._pr.get_f1(pixel_id)
-            b1, b2 = self._pr.get_f2(pixel_id)
-            d1, d2 = tod_data.data[a1], tod_data.data[a2]
-            d3, d4 = tod_data.data[b1], tod_data.data[b2]
-
-            # try to remove the mean from start_time to end_time
-            d1 -= np.mean(d1[start_time:end_time])
-            d2 -= np.mean(d2[start_time:end_time])
-            d3 -= np.mean(d3[start_time:end_time])
-            d4 -= np.mean(d4[start_time:end_time])
-
-            time = tod_data.ctime - tod_data.ctime[0]
-            time = time[start_time:end_time]
-
-            d_1 = d1[start_time:end_time]
-            d_2 = d2[start_time:end_time]
-            d_3 = d3[start_time:end_time]
-            d_4 = d4[start_time:end_time]
-
-            return time, d_1, d_2, d_3, d_4
+            return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer)
 
         def avg_signal(pixels, start_time, end_time):
 
@@ -190,7 +168,7 @@ class CorrelationFilter(Routine):
         event1 = [133034,133273,239,8]
         stime1 = event1[0]
         etime1 = event1[1]
-        pixels1 = pixels_affected_in_event(cs, event1)
+        pixels1 = pixels_affected_in_event(cs, event1, self.get_store())
         avg_x1, avg_y1 = avg_signal(pixels1, stime1, etime1)
         np.savetxt('newslow_template.txt',(avg_x1,avg_y1))
 
@@ -198,7 +176,7 @@ class CorrelationFilter(Routine):
         event2 = [9300,9303,3,2]
         stime2 = event2[0]
         etime2 = event2[1]
-        pixels2 = pixels_affected_in_event(cs, event2)
+        pixels2 = pixels_affected_in_event(cs, event2, self.get_store())
         avg_x2, avg_y2 = avg_signal(pixels2, stime2, etime2)
         
         correlation(avg_x1,avg_x2, avg_y1, avg_y2)
@@ -224,7 +202,7 @@ class CorrelationFilter(Routine):
         upper_threshold = self._coeff
 
         for peak in peaks:
-            all_pixels = pixels_affected_in_event(cs, peak)
+            all_pixels = pixels_affected_in_event(cs, peak, self.get_store())
             avg_x2, avg_y2_1,avg_y2_2,avg_y2_3,avg_y2_4 = avg_signal(all_pixels, peak[0], peak[1])
             coeff1 = correlation(avg_x1, avg_x2, avg_y1, avg_y2_1)
             coeff2 = correlation(avg_x1, avg_x2, avg_y1, avg_y2_2)
@@ -333,6 +311,7 @@ class SlowCorrelationFilter(CorrelationFilter):
         self._tag = "SLOW_DECAY"
 
 class ScatterPlot(Routine):
+    _state_keys = ['_frb_coeff', '_cr_coeff', '_slow_coeff']
     
     def __init__(self,frb_input_key, cr_input_key, slow_input_key):
         Routine.__init__(self)
@@ -5,7 +5,8 @@ import numpy as np
 import pandas as pd
 from scipy.interpolate import interp1d
 from todloop.base import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import get_timeseries
 from todloop.utils.cuts import pixels_affected_in_event
 
 class Filter(Routine):
@@ -58,7 +59,7 @@ class CorrelationFilter(Routine):
         self._tag = None
 
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
 
     def execute(self):
         print '[INFO] Checking for correlation ...'
@@ -67,30 +68,7 @@ class CorrelationFilter(Routine):
         peaks = cuts['peaks']
 
         def timeseries(pixel_id, s_time, e_time, buffer=10):
-
-            start_time = s_time - buffer
-            end_time = e_time + buffer
-
-            a1, a2 = self._pr.get_f1(pixel_id)
-            b1, b2 = self._pr.get_f2(pixel_id)
-            d1, d2 = tod_data.data[a1], tod_data.data[a2]
-            d3, d4 = tod_data.data[b1], tod_data.data[b2]
-
-            # try to remove the mean from start_time to end_time
-            d1 -= np.mean(d1[start_time:end_time])
-            d2 -= np.mean(d2[start_time:end_time])
-            d3 -= np.mean(d3[start_time:end_time])
-            d4 -= np.mean(d4[start_time:end_time])
-
-            time = tod_data.ctime - tod_data.ctime[0]
-            time = time[start_time:end_time]
-
-            d_1 = d1[start_time:end_time]
-            d_2 = d2[start_time:end_time]
-            d_3 = d3[start_time:end_time]
-            d_4 = d4[start_time:end_time]
-            
-            return time, d_1
+            return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer)[:2]
 
         """                                                                     
         TEMPLATE FRB or CR  AS EVENT 1                                          
@@ -104,8 +82,7 @@ class CorrelationFilter(Routine):
 
             for pid in pixels:
 
-                x = timeseries(pid,start_time,end_time)[0]
-                y = timeseries(pid,start_time,end_time)[1]
+                x, y = timeseries(pid,start_time,end_time)
 
                 if len(x) < temp_time:
                     buff = int(temp_time - len(x))/2
@@ -196,7 +173,7 @@ class CorrelationFilter(Routine):
         event1 = [101980, 101985, 5, 2]
         stime1 = event1[0]
         etime1 = event1[1]
-        pixels1 = pixels_affected_in_event(cs, event1)
+        pixels1 = pixels_affected_in_event(cs, event1, self.get_store())
         avg_x1, avg_y1 = avg_signal(pixels1, stime1, etime1)
         np.savetxt('frb_template.txt',(avg_x1,avg_y1))
 
@@ -205,7 +182,7 @@ class CorrelationFilter(Routine):
         event2 = [9300,9303,3,2]
         stime2 = event2[0]
         etime2 = event2[1]
-        pixels2 = pixels_affected_in_event(cs, event2)
+        pixels2 = pixels_affected_in_event(cs, event2, self.get_store())
         avg_x2, avg_y2 = avg_signal(pixels2, stime2, etime2)
         
         correlation(avg_x1,avg_x2, avg_y1, avg_y2)
@@ -224,7 +201,7 @@ class CorrelationFilter(Routine):
         upper_threshold = self._coeff
 
         for peak in peaks:
-            all_pixels = pixels_affected_in_event(cs, peak)
+            all_pixels = pixels_affected_in_event(cs, peak, self.get_store())
             avg_x1,avg_y1,avg_x2, avg_y2 = avg_signal(all_pixels, peak[0], peak[1])
             coeff = correlation(avg_x1, avg_x2, avg_y1, avg_y2)
 
@@ -284,6 +261,7 @@ class SlowCorrelationFilter(CorrelationFilter):
 
 
 class ScatterPlot(Routine):
+    _state_keys = ['_frb_coeff', '_cr_coeff', '_slow_coeff']
     
     def __init__(self,frb_input_key, cr_input_key, slow_input_key):
         Routine.__init__(self)
@@ -5,7 +5,8 @@ import numpy as np
 from scipy.interpolate import interp1d
 import matplotlib.pyplot as plt
 from todloop.routines import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import get_timeseries
 from todloop.utils.cuts import pixels_affected_in_event
 from todloop.utils.hist import Hist1D 
 
@@ -22,35 +23,11 @@ class TimeSeries(Routine):
         print '[INFO] Getting timeseries...'
         tod_data = self.get_store().get(self._tod_key)  # retrieve tod_data                                                                                                     
         array_name = self.get_array()
-        self._pr = PixelReader(season='2017',array = str(array_name))
+        self._pr = get_pixel_reader(season='2017',array = str(array_name))
 
     
         def timeseries(pixel_id, s_time, e_time, buffer=10):
-            
-            start_time = s_time - buffer
-            end_time = e_time + buffer
-                
-            a1, a2 = self._pr.get_f1(pixel_id)
-            b1, b2 = self._pr.get_f2(pixel_id)
-            d1, d2 = tod_data.data[a1], tod_data.data[a2]
-            d3, d4 = tod_data.data[b1], tod_data.data[b2]
-            
-            # try to remove the mean from start_time to end_time                                                                                                                
-            d1 -= np.mean(d1[start_time:end_time])
-            d2 -= np.mean(d2[start_time:end_time])
-            d3 -= np.mean(d3[start_time:end_time])
-            d4 -= np.mean(d4[start_time:end_time])
-                
-            time = tod_data.ctime - tod_data.ctime[0]
-            time = time[start_time:end_time]
-                
-            d_1 = d1[start_time:end_time]
-            d_2 = d2[start_time:end_time]
-            d_3 = d3[start_time:end_time]
-            d_4 = d4[start_time:end_time]
-                
-            
-            return time, d_1, d_2, d_3, d_4
+            return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer)
 
         self.get_store().set(self._output_key,timeseries)
 
@@ -81,7 +58,7 @@ class PlotGlitches(Routine):
         array_name = self.get_array()
         peaks = cuts['peaks']
         print('[INFO] peaks: ', peaks)
-        self._pr = PixelReader(season='2017',array = str(array_name))        
+        self._pr = get_pixel_reader(season='2017',array = str(array_name))        
                
         plot = raw_input("Do you want to plot an event? Enter y/n: ")
         if plot == "y":
@@ -108,11 +85,7 @@ class PlotGlitches(Routine):
                         
                 for pid in pixels:
                
-                    x = timeseries(pid,start_time,end_time)[0]
-                    y1 = timeseries(pid,start_time,end_time)[1]
-                    y2 = timeseries(pid,start_time,end_time)[2]
-                    y3 = timeseries(pid,start_time,end_time)[3]
-                    y4 = timeseries(pid,start_time,end_time)[4]
+                    x, y1, y2, y3, y4 = timeseries(pid,start_time,end_time)
                     
                     
                     plt.title('Pixel affected from ' +str(start_time)+ '-' + str(end_time)+ ', Pixel ' + str(pid))
@@ -137,7 +110,7 @@ class PlotGlitches(Routine):
             event = json.loads(e)
             stime = event[0]
             etime = event[1]
-            pixels = pixels_affected_in_event(cs, event)
+            pixels = pixels_affected_in_event(cs, event, self.get_store())
             plotter(pixels, stime, etime)
             
             self._pr.plot(pixels)
@@ -152,7 +125,7 @@ class PlotGlitches(Routine):
                     event = json.loads(e)
                     stime = event[0]
                     etime = event[1]
-                    pixels = pixels_affected_in_event(cs, event)
+                    pixels = pixels_affected_in_event(cs, event, self.get_store())
                     print '[INFO] Plotting Glitch...'
                     plotter(pixels, stime, etime)
                     self._pr.plot(pixels)
@@ -180,11 +153,7 @@ class Energy(Routine):
         """
 
         def energy_calculator(pid,stime,etime):
-            all_amps = []
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[1])
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[2])
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[3])
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[4])
+            all_amps = list(timeseries(pid,stime,etime,buffer=0)[1:])
         
             pJ_90a, pJ_90b, pJ_150a, pJ_150b = [],[],[],[]
         
@@ -232,7 +201,7 @@ class SaveEvents(Routine):
         events = []
         
         for peak in peaks:
-            all_pixels = pixels_affected_in_event(cs, peak)
+            all_pixels = pixels_affected_in_event(cs, peak, self.get_store())
             start = peak[0]
             end = peak[1]
             duration = peak[2]
@@ -266,6 +235,7 @@ class SaveEvents(Routine):
 
 class EnergyStudy(Routine):
     """ A routine to plot a histogram of the energy per detector in a list of peaks in a TOD """
+    _state_keys = ['_hist']
 
     def __init__(self,event_key="events"):
         Routine.__init__(self)
@@ -303,6 +273,7 @@ class EnergyStudy(Routine):
         """
 
 class NPixelStudy(Routine):
+    _state_keys = ['_hist']
     def __init__(self,event_key="events"):
         Routine.__init__(self)
         self._event_key = event_key
@@ -339,7 +310,7 @@ class CorrelationFilter(Routine):
 
 
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
 
     def execute(self):
         print '[INFO] Checking for correlation ...'
@@ -393,7 +364,7 @@ class CorrelationFilter(Routine):
         upper_threshold = self._coeff
         
         for peak in peaks:
-            all_pixels = pixels_affected_in_event(cs, peak)
+            all_pixels = pixels_affected_in_event(cs, peak, self.get_store())
             avg_x2, avg_y2_1,avg_y2_2,avg_y2_3,avg_y2_4 = avg_signal(all_pixels, peak[0], peak[1])
             coeff1 = correlation(avg_x1, avg_x2, avg_y1, avg_y2_1)
             coeff2 = correlation(avg_x1, avg_x2, avg_y1, avg_y2_2)
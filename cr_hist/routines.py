@@ -3,9 +3,10 @@ import matplotlib
 from todloop.utils.hist import Hist1D
 matplotlib.use("TKAgg")
 from matplotlib import pyplot as plt
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
 
 class NPixelStudy(Routine):
+    _state_keys = ['_hist']
     def __init__(self, event_key="events"):
         Routine.__init__(self)
         self._event_key = event_key
@@ -25,6 +26,7 @@ class NPixelStudy(Routine):
 
 
 class DurationStudy(Routine):
+    _state_keys = ['_hist']
     def __init__(self, event_key="events"):
         Routine.__init__(self)
         self._event_key = event_key
@@ -45,6 +47,7 @@ class DurationStudy(Routine):
         
 class CRHourStudy(Routine):
     """A study of glitches vs hour"""
+    _state_keys = ['_glitches_hour_hist', '_tods_hour_hist']
     def __init__(self, tod_info_key="tod_info", event_key="events"):
         Routine.__init__(self)
         self._glitches_hour_hist = None
@@ -82,6 +85,7 @@ class CRHourStudy(Routine):
 
 class CRPWVStudy(Routine):
     """A study of glitches vs PWV"""
+    _state_keys = ['_glitches_pwv_hist', '_tods_pwv_hist']
     def __init__(self, tod_info_key="tod_info", event_key="events"):
         Routine.__init__(self)
         self._glitches_hour_hist = None
@@ -119,6 +123,7 @@ class CRPWVStudy(Routine):
 
 
 class RaDecStudy(Routine):
+    _state_keys = ['_ras', '_decs']
     def __init__(self, input_key, ra_range=None, dec_range=None):
         """Scripts that run during initialization of the routine"""
         Routine.__init__(self)
@@ -157,6 +162,7 @@ class RaDecStudy(Routine):
 
         
 class SpatialStudy(Routine):
+    _state_keys = ['_rows', '_cols']
     def __init__(self, input_key):
         """Study the spatial histogram for events"""
         Routine.__init__(self)
@@ -166,7 +172,7 @@ class SpatialStudy(Routine):
 
     def execute(self):
         """Scripts that run for each TOD"""
-        self._pr = PixelReader(array=self.get_context().get_array())
+        self._pr = get_pixel_reader(array=self.get_context().get_array())
         events = self.get_store().get(self._input_key)  # get events
         for event in events:
             # find the pixels affected
@@ -189,6 +195,7 @@ class SpatialStudy(Routine):
 
 
 class PixelDurationStudy(Routine):
+    _state_keys = ['_npixels', '_durations']
     def __init__(self, input_key):
         """Study the pixel vs duration histogram"""
         Routine.__init__(self)
@@ -197,7 +204,7 @@ class PixelDurationStudy(Routine):
         self._durations = []
 
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
 
     def execute(self):
         """Scripts that run for each TOD"""
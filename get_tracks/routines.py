@@ -2,7 +2,7 @@ import os
 import matplotlib as mpl
 from matplotlib import pyplot as plt
 import numpy as np
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
 from todloop.base import Routine
 from todloop.utils.cuts import *
 from todloop.routines import OutputRoutine
@@ -18,7 +18,7 @@ class GetTracks(Routine):
         self._array = array
 
     def affected_pos_with_spread(self, cs, v):
-        pixels = pixels_affected(cs, v)
+        pixels = pixels_affected(cs, v, self.get_store())
         pos = np.array([self._pr.get_x_y(p) for p in pixels])
         std = np.std(pos, 0)
         spread = np.sqrt(std[0]**2+std[1]**2)
@@ -30,7 +30,7 @@ class GetTracks(Routine):
         return np.vstack([self.affected_pos_with_spread(cs, v) for v in range(start_v, end_v)])   
 
     def initialize(self):
-        self._pr = PixelReader(season=self._season, array=self._array)
+        self._pr = get_pixel_reader(season=self._season, array=self._array)
     
     def execute(self):
         cosig = self.get_context().get_store().get("data")
@@ -56,7 +56,7 @@ class PlotTracks(OutputRoutine):
         self._array = array
     
     def initialize(self):
-        self._pr = PixelReader(season=self._season, array=self._array)
+        self._pr = get_pixel_reader(season=self._season, array=self._array)
 
     def execute(self):
         tod_id = self.get_context().get_id()
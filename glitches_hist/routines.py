@@ -8,6 +8,7 @@ from matplotlib import pyplot as plt
 
 class GlitchHourStudy(Routine):
     """A study of glitches vs hour"""
+    _state_keys = ['_glitches_hour_hist', '_tods_hour_hist']
     def __init__(self):
         Routine.__init__(self)
         self._glitches_hour_hist = None
@@ -37,6 +38,7 @@ class GlitchHourStudy(Routine):
 
 class GlitchPWVStudy(Routine):
     """A study of glitches vs PWV"""
+    _state_keys = ['_glitches_pwv_hist', '_tods_pwv_hist']
     def __init__(self):
         Routine.__init__(self)
         self._glitches_hour_hist = None
@@ -73,6 +75,7 @@ class GlitchPWVStudy(Routine):
 
 class GlitchAzStudy(Routine):
     """A study of glitches vs AZ"""
+    _state_keys = ['_glitches_hist', '_tods_hist']
     def __init__(self):
         Routine.__init__(self)
         self._glitches_hist = None
@@ -6,7 +6,8 @@ import numpy as np
 from scipy.interpolate import interp1d
 import matplotlib.pyplot as plt
 from todloop.routines import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import get_timeseries
 from todloop.utils.cuts import pixels_affected_in_event
 from todloop.utils.hist import Hist1D 
 
@@ -38,37 +39,13 @@ class TimeSeries(Routine):
     
     
     def execute(self):
-        self._pr = PixelReader(season = '2017', array=self.get_context().get_array())
+        self._pr = get_pixel_reader(season = '2017', array=self.get_context().get_array())
         print '[INFO] Getting timeseries...'
         tod_data = self.get_store().get(self._tod_key)  # retrieve tod_data                                                                                                     
 
     
         def timeseries(pixel_id, s_time, e_time, buffer=10):
-            
-            start_time = s_time - buffer
-            end_time = e_time + buffer
-                
-            a1, a2 = self._pr.get_f1(pixel_id)
-            b1, b2 = self._pr.get_f2(pixel_id)
-            d1, d2 = tod_data.data[a1], tod_data.data[a2]
-            d3, d4 = tod_data.data[b1], tod_data.data[b2]
-            
-            # try to remove the mean from start_time to end_time                                                                                                                
-            d1 -= np.mean(d1[start_time:end_time])
-            d2 -= np.mean(d2[start_time:end_time])
-            d3 -= np.mean(d3[start_time:end_time])
-            d4 -= np.mean(d4[start_time:end_time])
-                
-            time = tod_data.ctime - tod_data.ctime[0]
-            time = time[start_time:end_time]
-                
-            d_1 = d1[start_time:end_time]
-            d_2 = d2[start_time:end_time]
-            d_3 = d3[start_time:end_time]
-            d_4 = d4[start_time:end_time]
-                
-            
-            return time, d_1, d_2, d_3, d_4
+            return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer)
 
         self.get_store().set(self._output_key,timeseries)
 
@@ -96,7 +73,7 @@ class PlotGlitches(Routine):
 
         for i in range(len(peaks)):
             print ('[INFO] Filtered peak: ', i,peaks[i])
-        self._pr = PixelReader(season= '2017', array=self.get_context().get_array())
+        self._pr = get_pixel_reader(season= '2017', array=self.get_context().get_array())
 
       
         plot = raw_input("Do you want to plot an event? Enter y/n: ")
@@ -117,11 +94,7 @@ class PlotGlitches(Routine):
                         
                 for pid in pixels:
                
-                    x = timeseries(pid,start_time,end_time)[0]
-                    y1 = timeseries(pid,start_time,end_time)[1]
-                    y2 = timeseries(pid,start_time,end_time)[2]
-                    y3 = timeseries(pid,start_time,end_time)[3]
-                    y4 = timeseries(pid,start_time,end_time)[4]
+                    x, y1, y2, y3, y4 = timeseries(pid,start_time,end_time)
                     
                     
                     plt.title('Pixel affected from ' +str(start_time)+ '-' + str(end_time)+ ', Pixel ' + str(pid))
@@ -189,11 +162,7 @@ class Energy(Routine):
         """
 
         def energy_calculator(pid,stime,etime):
-            all_amps = []
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[1])
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[2])
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[3])
-            all_amps.append(timeseries(pid,stime,etime,buffer=0)[4])
+            all_amps = list(timeseries(pid,stime,etime,buffer=0)[1:])
         
             pJ_90a, pJ_90b, pJ_150a, pJ_150b = [],[],[],[]
         
@@ -243,7 +212,7 @@ class SaveEvents(Routine):
         events = []
         
         for peak in peaks:
-            all_pixels = pixels_affected_in_event(cs, peak)
+            all_pixels = pixels_affected_in_event(cs, peak, self.get_store())
             start = peak[0]
             end = peak[1]
             duration = peak[2]
@@ -287,6 +256,7 @@ class SaveEvents(Routine):
 
 class EnergyStudy(Routine):
     """ A routine to plot a histogram of the energy per detector in a list of peaks in a TOD """
+    _state_keys = ['_hist']
 
     def __init__(self,event_key="events"):
         Routine.__init__(self)
@@ -336,6 +306,7 @@ class EnergyStudy(Routine):
         """
 
 class NPixelStudy(Routine):
+    _state_keys = ['_hist']
     def __init__(self,event_key="events"):
         Routine.__init__(self)
         self._event_key = event_key
@@ -377,7 +348,7 @@ class CorrelationFilter(Routine):
 
     def execute(self):
         print '[INFO] Checking for correlation ...'
-        self._pr = PixelReader(season = '2017', array=self.get_context().get_array())
+        self._pr = get_pixel_reader(season = '2017', array=self.get_context().get_array())
         tod_data = self.get_store().get(self._tod_key)  # retrieve tod_data
         events = self.get_store().get(self._input_key)
         peaks = [event['peak'] for event in events]
@@ -455,6 +426,7 @@ class CRCorrelationFilter(CorrelationFilter):
 
 
 class RaDecFilter(Routine):
+    _state_keys = ['_events_passed', '_events_processed']
     def __init__(self, output_key="events",input_key="events", ra_range=None, dec_range=None):
         """Scripts that run during initialization of the routine"""
         Routine.__init__(self)
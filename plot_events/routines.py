@@ -4,7 +4,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 from todloop.routines import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import get_timeseries
 
 
 class PlotEvents(Routine):
@@ -16,7 +17,7 @@ class PlotEvents(Routine):
         self._pr = None
 
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
 
     def execute(self):
         print '[INFO] Plotting glitches ...'
@@ -24,40 +25,7 @@ class PlotEvents(Routine):
         events = self.get_store().get(self._event_key)  # retrieve tod_data
         
         def timeseries(pixel_id, s_time, e_time, buffer=10):
-
-            start_time = s_time - buffer
-            end_time = e_time + buffer
-
-            a1, a2 = self._pr.get_f1(pixel_id)
-            b1, b2 = self._pr.get_f2(pixel_id)
-            d1, d2 = tod_data.data[a1], tod_data.data[a2]
-            d3, d4 = tod_data.data[b1], tod_data.data[b2]
-
-            # try to remove the mean from start_time to end_time
-            d1 -= np.mean(d1[start_time:end_time])
-            d2 -= np.mean(d2[start_time:end_time])
-            d3 -= np.mean(d3[start_time:end_time])
-            d4 -= np.mean(d4[start_time:end_time])
-            
-            time = tod_data.ctime - tod_data.ctime[0]
-            time = time[start_time:end_time]
-            
-            d_1 = d1[start_time:end_time]
-            d_2 = d2[start_time:end_time]
-            d_3 = d3[start_time:end_time]
-            d_4 = d4[start_time:end_time]
-
-            """
-            UNCOMMENT TO PLOT FOUR CORRESPONDING PIXELS WITH HI-LO FREQ
-            plt.plot(time,d_1, '.-', label=str(a1) + ' 90 GHz')
-            plt.plot(time, d_2, '.-', label=str(a2) + ' 90 GHz')
-            plt.plot(time, d_3, '.-', label=str(b1) + ' 150 GHz')
-            plt.plot(time, d_4, '.-', label=str(b2) + ' 150 GHz')
-            plt.legend(title='Detector UID')
-            plt.show()
-            """
-
-            return time, d_1
+            return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer)[:2]
 
 
         """
@@ -74,8 +42,7 @@ class PlotEvents(Routine):
         def plotter(pixels, start_time, end_time):
             plt.subplot2grid((11,11), (0,0), colspan=11, rowspan=3)
             for pid in pixels:
-                x = timeseries(pid,start_time,end_time)[0]
-                y = timeseries(pid,start_time,end_time)[1]
+                x, y = timeseries(pid,start_time,end_time)
 
                 plt.title('Pixels affected from ' +str(start_time)+ '-' + str(end_time)+ ' at 90 GHz')
                 plt.xlabel('TOD_ID: %d    TOD_NAME: %s' % (self.get_id(), self.get_name()))  # CHANGE TOD TRACK NAME
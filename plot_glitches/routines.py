@@ -4,7 +4,8 @@ import json
 import numpy as np
 import matplotlib.pyplot as plt
 from todloop.routines import Routine
-from todloop.utils.pixels import PixelReader
+from todloop.utils.pixels import get_pixel_reader
+from todloop.utils.snippets import get_timeseries
 from todloop.utils.cuts import pixels_affected_in_event
 
 
@@ -18,7 +19,7 @@ class PlotGlitches(Routine):
         self._pr = None
 
     def initialize(self):
-        self._pr = PixelReader()
+        self._pr = get_pixel_reader()
 
     def execute(self):
         print '[INFO] Loading Glitch Data ...'
@@ -34,40 +35,7 @@ class PlotGlitches(Routine):
             return cuts['coincident_signals']
 
         def timeseries(pixel_id, s_time, e_time, buffer=10):
-
-            start_time = s_time - buffer
-            end_time = e_time + buffer
-
-            a1, a2 = self._pr.get_f1(pixel_id)
-            b1, b2 = self._pr.get_f2(pixel_id)
-            d1, d2 = tod_data.data[a1], tod_data.data[a2]
-            d3, d4 = tod_data.data[b1], tod_data.data[b2]
-
-            # try to remove the mean from start_time to end_time
-            d1 -= np.mean(d1[start_time:end_time])
-            d2 -= np.mean(d2[start_time:end_time])
-            d3 -= np.mean(d3[start_time:end_time])
-            d4 -= np.mean(d4[start_time:end_time])
-            
-            time = tod_data.ctime - tod_data.ctime[0]
-            time = time[start_time:end_time]
-            
-            d_1 = d1[start_time:end_time]
-            d_2 = d2[start_time:end_time]
-            d_3 = d3[start_time:end_time]
-            d_4 = d4[start_time:end_time]
-
-            """
-            UNCOMMENT TO PLOT FOUR CORRESPONDING PIXELS WITH HI-LO FREQ
-            plt.plot(time,d_1, '.-', label=str(a1) + ' 90 GHz')
-            plt.plot(time, d_2, '.-', label=str(a2) + ' 90 GHz')
-            plt.plot(time, d_3, '.-', label=str(b1) + ' 150 GHz')
-            plt.plot(time, d_4, '.-', label=str(b2) + ' 150 GHz')
-            plt.legend(title='Detector UID')
-            plt.show()
-            """
-
-            return time, d_1, d_2, d_3, d_4
+            return get_timeseries(tod_data, self._pr, pixel_id, s_time, e_time, buffer)
 
 
         """
@@ -80,11 +48,7 @@ class PlotGlitches(Routine):
                         
             for pid in pixels:
                
-                x = timeseries(pid,start_time,end_time)[0]
-                y1 = timeseries(pid,start_time,end_time)[1]
-                y2 = timeseries(pid,start_time,end_time)[2]
-                y3 = timeseries(pid,start_time,end_time)[3]
-                y4 = timeseries(pid,start_time,end_time)[4]
+                x, y1, y2, y3, y4 = timeseries(pid,start_time,end_time)
 
 
                 plt.title('Pixel affected from ' +str(start_time)+ '-' + str(end_time)+ ', Pixel ' + str(pid))
@@ -111,7 +75,7 @@ class PlotGlitches(Routine):
         cs = cuts['coincident_signals']
         """
         for event in peaks:
-            all_pixels = pixels_affected_in_event(cs,event)
+            all_pixels = pixels_affected_in_event(cs, event, self.get_store())
             plotter(all_pixels, event[0], event[1])
         """
         
@@ -124,7 +88,7 @@ class PlotGlitches(Routine):
         event = json.loads(e)
         stime = event[0]
         etime = event[1]
-        pixels = pixels_affected_in_event(cs, event)
+        pixels = pixels_affected_in_event(cs, event, self.get_store())
         print 'Pixels Affected:', pixels
         plotter(pixels, stime, etime)
         
@@ -140,7 +104,7 @@ class PlotGlitches(Routine):
                 event = json.loads(e)
                 stime = event[0]
                 etime = event[1]
-                pixels = pixels_affected_in_event(cs, event)
+                pixels = pixels_affected_in_event(cs, event, self.get_store())
                 print '[INFO] Plotting Glitch...'
                 plotter(pixels, stime, etime)
                 self._pr.plot(pixels)
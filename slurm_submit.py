@@ -11,21 +11,22 @@ slurm_template='''#!/bin/sh
 {{ act }}
 #SBATCH -J {{ name }}                      # job name 
 #SBATCH -t 90:00:00                        # 90 hours walltime
-#SBATCH --mem=8000MB                       # memory in MB 
+#SBATCH --mem={{ mem }}MB                   # memory in MB 
 #SBATCH --output={{ logfile }}             # file for STDOUT 
 
 
 python {{ script }} {{ opts }}
 '''
 
-def generate_bash(name, script, options, act, enum=0):
+def generate_bash(name, script, options, act, enum=0, mem=8000):
     """Generate bash based on the template"""
     compiled = Environment().from_string(slurm_template).render(
         name = name,
         logfile = "logs/%s_%d.log" % (name, enum),
         script = script,
         act = act,
-        opts = options
+        opts = options,
+        mem = mem
     )
     print '[INFO] Compiling with options:', options
     filename = generate_file(compiled, name, enum)
@@ -70,6 +71,7 @@ if __name__ == "__main__":
     parser.add_argument("--start", help="starting index", type=int, required=True)
     parser.add_argument("--end", help="ending index", type=int, required=True)
     parser.add_argument("--act", help="run in act cluster", type=bool)
+    parser.add_argument("--mem", help="memory per job in MB", type=int, default=8000)
     args = parser.parse_args()
     name = args.name
     script = args.script
@@ -81,7 +83,7 @@ if __name__ == "__main__":
     filenames = []
     
     for i, p in enumerate(parameters):
-        filenames.append(generate_bash(name, script, p, act, i))
+        filenames.append(generate_bash(name, script, p, act, i, args.mem))
     
     # run bash
     run_bash(filenames)
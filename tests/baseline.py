@@ -0,0 +1,235 @@
+"""The implementations replaced by the vectorized ones, kept as they
+were to check that the new ones give the same results"""
+import numpy as np
+import moby2
+
+
+def merge_cuts(cut1, cut2):
+    """Merge two cutvectors
+    input cuts have to be CutVector type"""
+    if len(cut1) == 0:
+        return cut2
+    if len(cut2) == 0:
+        return cut1
+
+    nsamps = max(cut1[-1][1], cut2[-1][1])
+    c1m = cut1.get_mask(nsamps=nsamps)
+    c2m = cut2.get_mask(nsamps=nsamps)
+    cm = np.logical_or(c1m, c2m)
+    merged = moby2.tod.CutsVector.from_mask(mask=cm)
+    return merged
+
+
+def common_cuts(cut1, cut2):
+    """Find common cuts from two cuts
+    Input cuts must be of CutVectors type"""
+    if len(cut1) == 0:
+        return cut1
+    if len(cut2) == 0:
+        return cut2
+    nsamps = max(cut1[-1][1], cut2[-1][1])
+    c1m = cut1.get_mask(nsamps=nsamps)
+    c2m = cut2.get_mask(nsamps=nsamps)
+    cm = np.logical_and(c1m, c2m)
+    common = moby2.tod.CutsVector.from_mask(mask=cm)
+    return common
+
+
+def cut_contains(cv, v):
+    """check if a specific time is cut in a det (provided CutVector)"""
+    for c in cv:
+        if c[0] <= v <= c[1]:
+            return True
+    return False
+
+
+def pixels_affected(cs, v):
+    return [int(p) for p in cs if cut_contains(cs[p], v)]
+
+
+def pixels_affected_in_event(cs, event):
+    pixels_affected_list = []
+    start_time = event[0]
+    end_time = event[1]
+    for t in range(start_time, end_time):
+        pixels_affected_list.extend(pixels_affected(cs, t))
+
+    return list(set(pixels_affected_list))
+
+
+def remove_overlap_vector(original, to_remove, buff=0):
+    """remove the to_remove CutVector from original CutVector"""
+    for row in to_remove:
+        original = original[(original[:, 1]<row[0]-buff) | (original[:, 0]>row[1]+buff)]
+    return original
+
+
+def remove_overlap_tod(original, to_remove, buff=0):
+    """remove the to_remove TODCuts from original TODCuts"""
+    ndet = len(original.cuts)
+    for i in range(ndet):
+        # loop over detector
+        original.cuts[i] = remove_overlap_vector(original.cuts[i], to_remove.cuts[i], buff)
+    return original
+
+
+def trim_edge_cuts(cuts, nsamps):
+    """remove edge cuts, cuts covering first/last THRES sampling points are removed"""
+    thres = 100 # sampling points
+    for i in range(len(cuts.cuts)):
+        cuts.cuts[i] = cuts.cuts[i][(cuts.cuts[i][:, 0] > thres) & (cuts.cuts[i][:, 1] < (nsamps-thres))]
+    return cuts
+
+
+def find_cosigs(cuts, pr, strict=True, polarized=False):
+    """FindCosigs.execute: the coincident signals of each pixel"""
+    # get all pixels
+    pixels = pr.get_pixels()
+
+    # initialize dictionary to store coincident signals
+    cosig = {}
+
+    # loop through pixels and find cosig for each pixel
+    for p in pixels:
+        dets_f1 = pr.get_f1(p)
+        dets_f2 = pr.get_f2(p)
+
+        if strict:  # strict mode, 4 TES have to be present
+            if len(dets_f1) == 2 and len(dets_f2) == 2:
+                cuts_f1_A = cuts.cuts[dets_f1[0]]  # low freq, polarization A
+                cuts_f1_B = cuts.cuts[dets_f1[1]]  # low freq, polarization B
+
+                cuts_f2_A = cuts.cuts[dets_f2[0]]  # high freq, polarization A
+                cuts_f2_B = cuts.cuts[dets_f2[1]]  # high freq, polarization B
+
+                if polarized:  # if looking for polarized, glitch may occur in either polarization
+                    cuts_f1 = merge_cuts(cuts_f1_A, cuts_f1_B)  # polarized spikes may appear at either pol
+                    cuts_f2 = merge_cuts(cuts_f2_A, cuts_f2_B)
+
+                else:  # if looking for unpolarized, glitch must occur in both polarizations
+                    cuts_f1 = common_cuts(cuts_f1_A, cuts_f1_B)  # unpolarized spikes appear in both pols
+                    cuts_f2 = common_cuts(cuts_f2_A, cuts_f2_B)
+
+                cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
+
+        else:  # loose mode, at least one TES has to be present each freq
+            if len(dets_f1) == 2 and len(dets_f2) == 2:
+                cuts_f1_A = cuts.cuts[dets_f1[0]]  # low freq, polarization A
+                cuts_f1_B = cuts.cuts[dets_f1[1]]  # low freq, polarization B
+
+                cuts_f2_A = cuts.cuts[dets_f2[0]]  # high freq, polarization A
+                cuts_f2_B = cuts.cuts[dets_f2[1]]  # high freq, polarization B
+
+                if polarized:  # if looking for polarized, glitch may occur in either polarization
+                    cuts_f1 = merge_cuts(cuts_f1_A, cuts_f1_B)  # polarized spikes may appear at either pol
+                    cuts_f2 = merge_cuts(cuts_f2_A, cuts_f2_B)
+
+                else:  # if looking for unpolarized, glitch must occur in both polarizations
+                    cuts_f1 = common_cuts(cuts_f1_A, cuts_f1_B)  # unpolarized spikes appear in both pols
+                    cuts_f2 = common_cuts(cuts_f2_A, cuts_f2_B)
+
+                cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
+
+            elif len(dets_f1) == 1 and len(dets_f2) == 2:
+                cuts_f1 = cuts.cuts[dets_f1[0]]  # low freq, polarization A
+
+                cuts_f2_A = cuts.cuts[dets_f2[0]]  # high freq, polarization A
+                cuts_f2_B = cuts.cuts[dets_f2[1]]  # high freq, polarization B
+
+                if polarized:  # if looking for polarized, glitch may occur in either polarization
+                    cuts_f2 = merge_cuts(cuts_f2_A, cuts_f2_B)
+
+                else:  # if looking for unpolarized, glitch must occur in both polarizations
+                    cuts_f2 = common_cuts(cuts_f2_A, cuts_f2_B)
+
+                cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
+
+            elif len(dets_f1) == 2 and len(dets_f2) == 1:
+                cuts_f1_A = cuts.cuts[dets_f1[0]]  # low freq, polarization A
+                cuts_f1_B = cuts.cuts[dets_f1[1]]  # low freq, polarization B
+
+                cuts_f2 = cuts.cuts[dets_f2[0]]  # high freq, polarization A
+
+                if polarized:  # if looking for polarized, glitch may occur in either polarization
+                    cuts_f1 = merge_cuts(cuts_f1_A, cuts_f1_B)
+
+                else:  # if looking for unpolarized, glitch must occur in both polarizations
+                    cuts_f1 = common_cuts(cuts_f1_A, cuts_f1_B)
+
+                cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
+
+            elif len(dets_f1) == 1 and len(dets_f2) == 1:
+                cuts_f1 = cuts.cuts[dets_f1[0]]  # low freq, polarization A
+                cuts_f2 = cuts.cuts[dets_f2[0]]  # high freq, polarization A
+
+                cosig[str(p)] = common_cuts(cuts_f1, cuts_f2)  # store coincident signals by pixel id
+
+    # cosig may contain empty cut vectors because we didn't enforce it, filter them out now
+    cosig_filtered = {}
+    for pixel in cosig:
+        cuts = cosig[pixel]
+        if len(cuts) != 0:
+            cosig_filtered[pixel] = cuts
+    return cosig_filtered
+
+
+def find_peaks(hist, nsamps):
+    """FindEvents.find_peaks: peaks in the histogram of cosigs"""
+    last = 0
+    peaks = []
+    for i in range(nsamps):
+        if hist[i] > 0 and last == 0:
+            peak_start = i
+        if hist[i] == 0 and last > 0:
+            peak_end = i
+            peak_amp = max(hist[peak_start:peak_end])
+            peak_duration = peak_end - peak_start
+            peaks.append([peak_start, peak_end, peak_duration, peak_amp])
+        last = hist[i]
+    return peaks
+
+
+def find_events(cosig, nsamps):
+    """FindEvents.execute: the peaks of the cosigs of all pixels"""
+    # generate a histogram of cosigs
+    cosig_hist = np.zeros(nsamps)
+
+    for pixel in cosig:  # loop through key and value pair in cosig dict
+        cuts = cosig[pixel]
+        mask = cuts.get_mask(nsamps=nsamps)
+        cosig_hist += mask
+
+    return find_peaks(cosig_hist, nsamps)
+
+
+def generate_pixel_dict(array_data):
+    """PixelReader.generate_pixel_dict"""
+    array_pos = np.vstack([array_data['array_x'], array_data['array_y']]).T
+    freqs = np.sort(np.unique(array_data['nom_freq']))[1:]  # gather freqs (exclude 0)
+    pixel_dict = {}  # initialize empty pixel_dict
+
+    for det_id in array_data['det_uid']:
+        if np.all(array_pos[det_id, :] == [0, 0]):  # not physical
+            continue
+        if array_data['det_type'][det_id] != 'tes':  # remove non-tes
+            continue
+        dets = np.where(np.all(array_pos == array_pos[det_id, :], axis=1))[0]
+        # make a dictionary of frequencies: f1: lower freq, f2: higher freq
+        pol_dict = {
+            'f1': [i for i in dets if array_data['nom_freq'][i] == freqs[0] and
+                   array_data['det_type'][det_id] == 'tes'],
+            'f2': [i for i in dets if array_data['nom_freq'][i] == freqs[1] and
+                   array_data['det_type'][det_id] == 'tes']
+        }
+        pixel_id = dets[0]  # index pixel by the smallest det_uid
+        pixel_dict[str(pixel_id)] = pol_dict
+
+    return pixel_dict
+
+
+def get_pixels_within_radius(array_data, pixel_dict, pixel, radius):
+    """PixelReader.get_pixels_within_radius, on the positions before
+    calibrate_array"""
+    ar = np.vstack([array_data['array_x'], array_data['array_y']]).T
+    dist = np.sqrt(np.sum((ar - ar[pixel, :])**2, axis=1))
+    return [det for det in np.arange(len(ar))[dist < radius] if str(det) in pixel_dict]
@@ -0,0 +1,44 @@
+"""Fake arrays and TODs shared by the tests"""
+import numpy as np
+from todloop.utils import pixels
+
+
+def make_array_data(nx=6, ny=6, spacing=0.5):
+    """Return the array data of a hexagonal grid of nx * ny pixels with
+    two detectors per frequency, spacing apart, away from [0, 0] which
+    is for detectors without a position, and a last group of dark
+    detectors with no frequency (not a pixel)"""
+    xs, ys = [], []
+    for j in range(ny):
+        for i in range(nx):
+            xs.append(1 + (i + 0.5 * (j % 2)) * spacing)
+            ys.append(1 + j * spacing * np.sqrt(3) / 2)
+    npix = len(xs) + 1
+    ndet = npix * 4
+    return {
+        'det_uid': np.arange(ndet),
+        'array_x': np.repeat(np.append(xs, -10.0), 4),
+        'array_y': np.repeat(np.append(ys, -10.0), 4),
+        'nom_freq': np.append(np.tile([90, 90, 150, 150], npix - 1), [0, 0, 0, 0]),
+        'det_type': np.array(['tes'] * (ndet - 4) + ['dark'] * 4),
+        'row': np.arange(ndet) // 32,
+        'col': np.arange(ndet) % 32,
+    }
+
+
+def register_pixel_reader(season='2016', array='ar4', **kwargs):
+    """Build a PixelReader of a fake array and make get_pixel_reader
+    return it, as if it had been loaded from the geometry file"""
+    pr = pixels.PixelReader(season=season, array=array, array_data=make_array_data(**kwargs))
+    pixels._pixel_readers[(season, array, None)] = pr
+    return pr
+
+
+class FakeTOD:
+    """The fields of a moby2 TOD used by the routines"""
+    def __init__(self, data, sampling_rate=400.):
+        self.data = data
+        nsamps = data.shape[1]
+        self.ctime = 1500000000 + np.arange(nsamps) / sampling_rate
+        self.alt = np.linspace(0.5, 0.6, nsamps)
+        self.az = np.linspace(1.0, 1.2, nsamps)
@@ -0,0 +1,451 @@
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from todloop.base import TODLoop, Routine, merge_values, empty_value
+from todloop.cache import CachedRoutine
+from todloop.utils.hist import Hist1D
+
+
+TOD_LIST = ["%d.%d.ar4" % (1500000000 + 200 * i, 1500000100 + 200 * i) for i in range(10)]
+
+
+class Writer(Routine):
+    def __init__(self, output_key):
+        Routine.__init__(self)
+        self._output_key = output_key
+
+    def execute(self):
+        self.get_store().set(self._output_key, self.get_id())
+
+
+class Failing(Routine):
+    """Raises on the second TOD, once the graph of routines is built"""
+    def __init__(self, input_key, output_key):
+        Routine.__init__(self)
+        self._input_key = input_key
+        self._output_key = output_key
+
+    def execute(self):
+        if self.get_id() == 1:
+            raise ValueError("failing on purpose")
+        self.get_store().set(self._output_key, self.get_store().get(self._input_key))
+
+
+def make_loop():
+    loop = TODLoop()
+    loop._tod_list = ["1500000000.1500000100.ar4", "1500000200.1500000300.ar4", "1500000400.1500000500.ar4"]
+    loop.add_routine(Writer(output_key="a"))
+    loop.add_routine(Failing(input_key="a", output_key="c"))
+    loop.add_routine(Failing(input_key="c", output_key="e"))  # still pending when c fails
+    return loop
+
+
+def run_with_timeout(loop, timeout=20, **kwargs):
+    """Run the loop in a thread, return (finished, exception)"""
+    result = {}
+
+    def target():
+        try:
+            loop.run(**kwargs)
+        except Exception as e:
+            result['error'] = e
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive(), result.get('error')
+
+
+class TestExecuteGraph(unittest.TestCase):
+    def test_routine_raising_with_threads(self):
+        finished, error = run_with_timeout(make_loop(), threads=3)
+        self.assertTrue(finished, "the loop hangs when a routine raises")
+        self.assertTrue(isinstance(error, ValueError))
+
+    def test_routine_raising_with_threads_and_fault_isolation(self):
+        failure_dir = tempfile.mkdtemp() + "/"
+        try:
+            loop = make_loop()
+            loop.enable_fault_isolation(failure_dir)
+            finished, error = run_with_timeout(loop, threads=3)
+            self.assertTrue(finished, "the loop hangs when a routine raises")
+            self.assertTrue(error is None)
+            with open(failure_dir + "skip.txt") as f:
+                self.assertEqual(f.read().split(), ["1"])
+        finally:
+            shutil.rmtree(failure_dir)
+
+
+class Copy(Routine):
+    """Copies a key, or vetoes the TOD veto_id"""
+    _state_keys = ['_ids']
+
+    def __init__(self, input_key, output_key, veto_id=None):
+        Routine.__init__(self)
+        self._input_key = input_key
+        self._output_key = output_key
+        self._veto_id = veto_id
+        self._ids = []
+
+    def execute(self):
+        self._ids.append(self.get_id())
+        if self.get_id() == self._veto_id:
+            self.veto()
+            return
+        self.get_store().set(self._output_key, self.get_store().get(self._input_key))
+
+
+def make_branches():
+    """Two branches a -> b -> c and a -> d -> e, the first vetoes TOD 2"""
+    loop = TODLoop()
+    loop._tod_list = TOD_LIST[:4]
+    loop.add_routine(Writer(output_key="a"))
+    routines = [Copy("a", "b", veto_id=2), Copy("b", "c"), Copy("a", "d"), Copy("d", "e")]
+    for routine in routines:
+        loop.add_routine(routine)
+    return loop, routines
+
+
+class TestBranches(unittest.TestCase):
+    def test_dependencies(self):
+        loop, routines = make_branches()
+        self.assertEqual(loop.get_dependencies(), {0: set(), 1: {0}, 2: {1}, 3: {0}, 4: {3}})
+
+    def test_veto_per_branch(self):
+        loop, routines = make_branches()
+        loop.run(threads=3)
+        self.assertEqual([r._ids for r in routines], [range(4), [0, 1, 3], range(4), range(4)])
+
+    def test_veto_without_threads(self):
+        loop, routines = make_branches()
+        loop.run()
+        self.assertEqual([r._ids for r in routines], [range(4), [0, 1, 3], [0, 1, 3], [0, 1, 3]])
+
+
+class Plot(Routine):
+    """Reads a key without declaring it, like the plotters"""
+    def __init__(self):
+        Routine.__init__(self)
+        self.ids = []
+
+    def execute(self):
+        self.ids.append(self.get_store().get("b"))
+
+
+class Selector(Routine):
+    """Uses no keys and vetoes TOD 1, like TODSelector"""
+    def execute(self):
+        if self.get_id() == 1:
+            self.veto()
+
+
+class TestReaders(unittest.TestCase):
+    def make_loop(self):
+        loop = TODLoop()
+        loop._tod_list = TOD_LIST[:4]
+        routines = [Writer(output_key="a"), Copy("a", "b", veto_id=2), Plot(), Copy("a", "d"),
+                    Selector(), Copy("b", "c"), Copy("a", "b2")]
+        for routine in routines:
+            loop.add_routine(routine)
+        return loop, routines
+
+    def test_dependencies(self):
+        loop, routines = self.make_loop()
+        # Plot declares no keys yet, it keeps its place
+        self.assertEqual(loop.get_dependencies()[3], {0, 2})
+        loop.run(0, 1)
+        self.assertEqual(loop.get_dependencies(), {0: set(), 1: {0}, 2: {1}, 3: {0}, 4: {0, 1, 2, 3},
+                                                   5: {1, 4}, 6: {0, 4}})
+
+    def test_veto(self):
+        loop, routines = self.make_loop()
+        loop.run(threads=3)
+        self.assertEqual(routines[2].ids, [0, 1, 3])  # after the veto of b, before the selector
+        self.assertEqual(routines[3]._ids, range(4))  # doesn't wait for the plot
+        self.assertEqual(routines[5]._ids, [0, 3])
+        self.assertEqual(routines[6]._ids, [0, 3])  # the selector waited for b
+
+
+def make_manifest_loop(manifest_path, failure_dir, veto_id=2):
+    loop = TODLoop()
+    loop._tod_list = TOD_LIST[:5]
+    loop.add_routine(Writer(output_key="a"))
+    recorder = Copy("a", "b", veto_id=veto_id)
+    loop.add_routine(recorder)
+    loop.add_routine(Failing(input_key="b", output_key="c"))  # fails on TOD 1
+    loop.enable_manifest(manifest_path)
+    loop.enable_fault_isolation(failure_dir)
+    return loop, recorder
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp() + "/"
+        self._manifest = self._dir + "manifest.json"
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_resume(self):
+        loop, recorder = make_manifest_loop(self._manifest, self._dir)
+        loop.run(0, 3)
+        self.assertEqual(recorder._ids, [0, 1, 2])
+        with open(self._manifest) as f:
+            self.assertEqual(json.load(f)['tods'], {'0': 'done', '1': 'failed', '2': 'vetoed'})
+
+        # done and vetoed TODs are skipped, failed ones are run again
+        loop, recorder = make_manifest_loop(self._manifest, self._dir)
+        loop.run(0, 5, resume=True)
+        self.assertEqual(recorder._ids, [1, 3, 4])
+
+    def test_resume_with_workers(self):
+        loop, recorder = make_manifest_loop(self._manifest, self._dir)
+        loop.run(0, 5, workers=2)
+        loop, recorder = make_manifest_loop(self._manifest, self._dir)
+        loop.run(0, 5, resume=True)
+        self.assertEqual(recorder._ids, [1])
+
+    def test_configuration_changed(self):
+        loop, recorder = make_manifest_loop(self._manifest, self._dir)
+        loop.run(0, 3)
+        loop, recorder = make_manifest_loop(self._manifest, self._dir, veto_id=3)
+        loop.run(0, 3, resume=True)
+        self.assertEqual(recorder._ids, [0, 1, 2])
+
+
+class Counter(Routine):
+    _state_keys = ['_ids']
+
+    def __init__(self, input_key):
+        Routine.__init__(self)
+        self._input_key = input_key
+        self._ids = []
+
+    def execute(self):
+        self._ids.append(self.get_store().get(self._input_key))
+
+
+class TestCachedRoutine(unittest.TestCase):
+    def test_state_saved_and_reduced(self):
+        state_dir = tempfile.mkdtemp() + "/"
+        try:
+            loop = TODLoop()
+            loop._tod_list = make_loop()._tod_list
+            loop.add_routine(Writer(output_key="a"))
+            loop.add_routine(CachedRoutine(Counter(input_key="a"), cache_dir=state_dir + "cache/"))
+            loop.run(state_dir=state_dir)
+
+            counter = Counter(input_key="a")
+            loop = TODLoop()
+            loop.add_routine(Writer(output_key="a"))
+            loop.add_routine(CachedRoutine(counter, cache_dir=state_dir + "cache/"))
+            loop.reduce(state_dir)
+            self.assertEqual(counter._ids, [0, 1, 2])
+        finally:
+            shutil.rmtree(state_dir)
+
+
+class Scaled(Routine):
+    """Writes the tod_id times a factor and counts its calls"""
+    def __init__(self, output_key, factor=1):
+        Routine.__init__(self)
+        self._output_key = output_key
+        self._factor = factor
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        self.get_store().set(self._output_key, self.get_id() * self._factor)
+
+
+class Doubler(Routine):
+    """Doubles a key and counts its calls"""
+    def __init__(self, input_key, output_key):
+        Routine.__init__(self)
+        self._input_key = input_key
+        self._output_key = output_key
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        self.get_store().set(self._output_key, 2 * self.get_store().get(self._input_key))
+
+
+class Values(Routine):
+    """Records the values of a key"""
+    def __init__(self, input_key):
+        Routine.__init__(self)
+        self._input_key = input_key
+        self.values = []
+
+    def execute(self):
+        self.values.append(self.get_store().get(self._input_key))
+
+
+class TestCacheInvalidation(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp() + "/"
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def run_cached(self, factor=1, other_factor=1, downstream_factor=1):
+        """Run a -> cached b, with an unrelated branch and a downstream
+        routine, return the number of calls of b and the values of b"""
+        loop = TODLoop()
+        loop._tod_list = TOD_LIST[:3]
+        loop.add_routine(Scaled(output_key="a", factor=factor))
+        loop.add_routine(Scaled(output_key="other", factor=other_factor))
+        cached = Doubler(input_key="a", output_key="b")
+        loop.add_routine(CachedRoutine(cached, cache_dir=self.cache_dir))
+        loop.add_routine(Scaled(output_key="c", factor=downstream_factor))
+        values = Values(input_key="b")
+        loop.add_routine(values)
+        loop.run()
+        return cached.calls, values.values
+
+    def test_invalidation(self):
+        self.assertEqual(self.run_cached(), (3, [0, 2, 4]))
+        self.assertEqual(self.run_cached(), (0, [0, 2, 4]))  # all hits
+        self.assertEqual(self.run_cached(other_factor=2, downstream_factor=2), (0, [0, 2, 4]))
+        self.assertEqual(self.run_cached(factor=2), (3, [0, 4, 8]))  # upstream changed
+        self.assertEqual(self.run_cached(factor=2), (0, [0, 4, 8]))
+
+    def test_undeclared_input(self):
+        loop = TODLoop()
+        loop.add_routine(Scaled(output_key="a"))
+        loop.add_routine(Scaled(output_key="other"))
+        cached = CachedRoutine(Doubler(input_key="a", output_key="b"), cache_dir=self.cache_dir,
+                               input_keys=["a", "undeclared"])
+        loop.add_routine(cached)
+        other = TODLoop()
+        other.add_routine(Scaled(output_key="a"))
+        other.add_routine(Scaled(output_key="other", factor=2))
+        other_cached = CachedRoutine(Doubler(input_key="a", output_key="b"), cache_dir=self.cache_dir,
+                                     input_keys=["a", "undeclared"])
+        other.add_routine(other_cached)
+        self.assertNotEqual(cached._upstream_hash, other_cached._upstream_hash)
+
+
+class Arrays(Routine):
+    def __init__(self):
+        Routine.__init__(self)
+        self.arrays = []
+
+    def execute(self):
+        self.arrays.append(self.get_array())
+
+
+class TestContext(unittest.TestCase):
+    def test_get_array(self):
+        loop = TODLoop()
+        loop._tod_list = ["1500000000.1500000100.ar4", "1500000200.1500000300.ar5.zip",
+                          "data/1500000400.1500000500.ar6.zip"]
+        arrays = Arrays()
+        loop.add_routine(arrays)
+        loop.run()
+        self.assertEqual(arrays.arrays, ["ar4", "ar5", "ar6"])
+
+
+class Tally(Routine):
+    """Accumulates a number, a list and a histogram of the tod_ids"""
+    _state_keys = ['_count', '_ids', '_hist']
+
+    def __init__(self):
+        Routine.__init__(self)
+        self._count = 0
+        self._ids = []
+        self._hist = None
+
+    def initialize(self):
+        self._hist = Hist1D(0, 10, 10)
+
+    def execute(self):
+        self._count += 1
+        self._ids.append(self.get_id())
+        self._hist.fill(self.get_id())
+
+
+class SeededTally(Tally):
+    """Starts from a non-zero state"""
+    def initialize(self):
+        Tally.initialize(self)
+        self._count = 5
+        self._ids = [-1]
+        self._hist.fill(9.5, 5)
+
+
+def run_tally(cls=Tally, **kwargs):
+    loop = TODLoop()
+    loop._tod_list = TOD_LIST
+    tally = cls()
+    loop.add_routine(tally)
+    loop.run(**kwargs)
+    return tally
+
+
+class TestWorkers(unittest.TestCase):
+    def test_states_merged(self):
+        tally = run_tally(workers=3)
+        self.assertEqual(tally._count, 10)
+        self.assertEqual(sorted(tally._ids), range(10))
+        self.assertEqual(list(tally._hist.hist), [1] * 10)
+
+    def test_initial_state_counted_once(self):
+        tally = run_tally(SeededTally, workers=3)
+        self.assertEqual(tally._count, 15)
+        self.assertEqual(sorted(tally._ids), range(-1, 10))
+        self.assertEqual(list(tally._hist.hist), [1] * 9 + [6])
+
+
+class TestStates(unittest.TestCase):
+    def test_reduce_partial_runs(self):
+        state_dir = tempfile.mkdtemp() + "/"
+        try:
+            run_tally(start=0, end=4, state_dir=state_dir)
+            run_tally(start=4, state_dir=state_dir)
+            loop = TODLoop()
+            tally = Tally()
+            loop.add_routine(tally)
+            loop.reduce(state_dir)
+            self.assertEqual(tally._count, 10)
+            self.assertEqual(tally._ids, range(10))
+            self.assertEqual(list(tally._hist.hist), [1] * 10)
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_reduce_initial_state_counted_once(self):
+        state_dir = tempfile.mkdtemp() + "/"
+        try:
+            run_tally(SeededTally, start=0, end=4, state_dir=state_dir)
+            run_tally(SeededTally, start=4, state_dir=state_dir, workers=2)
+            loop = TODLoop()
+            tally = SeededTally()
+            loop.add_routine(tally)
+            loop.reduce(state_dir)
+            self.assertEqual(tally._count, 15)
+            self.assertEqual(sorted(tally._ids), range(-1, 10))
+            self.assertEqual(list(tally._hist.hist), [1] * 9 + [6])
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_merge_state(self):
+        first, second = run_tally(start=0, end=3), run_tally(start=3, end=5)
+        first.merge_state(second)
+        self.assertEqual((first._count, first._ids), (5, range(5)))
+        self.assertEqual(list(first._hist.hist), [1] * 5 + [0] * 5)
+
+    def test_merge_values(self):
+        self.assertEqual(merge_values({'a': 1, 'b': [1]}, {'b': [2], 'c': None}), {'a': 1, 'b': [1, 2], 'c': None})
+        self.assertEqual(merge_values(None, 2), 2)
+        self.assertEqual(empty_value({'a': 3, 'b': [1], 'c': None, 'd': (1.5,)}), {'a': 0, 'b': [], 'c': None, 'd': ()})
+        hist = Hist1D(0, 1, 10)
+        hist.fill(0.5)
+        self.assertEqual((empty_value(hist).nbins, list(empty_value(hist).hist)), (10, [0] * 10))
+        self.assertRaises(ValueError, Hist1D(0, 1, 10).merge, Hist1D(0, 1, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
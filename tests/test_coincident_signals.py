@@ -0,0 +1,169 @@
+import unittest
+import numpy as np
+from todloop.base import TODLoop, Routine
+from todloop.utils.cuts import PackedCuts, get_peak_pixels
+from coincident_signals.routines import FindCosigs, FindEvents, FindClusters, join_events
+from transform.routines import CosigToEvent
+from tests.helpers import register_pixel_reader
+from tests import baseline
+
+
+NSAMPS = 1000
+
+
+class CutsWriter(Routine):
+    """Write cuts on the 4 detectors of some pixels at the same time"""
+    def __init__(self, pr, events, output_key="cuts"):
+        Routine.__init__(self)
+        self._pr = pr
+        self._events = events  # [(start, end, pixels)]
+        self._output_key = output_key
+
+    def execute(self):
+        cut_list = [[] for _ in range(len(self._pr.get_det_pixels()))]
+        for start, end, pixels in self._events:
+            for p in pixels:
+                for det in self._pr.get_f1(p) + self._pr.get_f2(p):
+                    cut_list[det].append([start, end])
+        cuts = PackedCuts.from_list(cut_list, nsamps=NSAMPS)
+        self.get_store().set(self._output_key, {'cuts': cuts, 'nsamps': NSAMPS})
+
+
+class CountPeaks(Routine):
+    _state_keys = ['_peaks']
+
+    def __init__(self, input_key="events"):
+        Routine.__init__(self)
+        self._input_key = input_key
+        self._peaks = []
+
+    def execute(self):
+        self._peaks.append(len(self.get_store().get(self._input_key)['peaks']))
+
+
+class Collect(Routine):
+    def __init__(self, input_key="events"):
+        Routine.__init__(self)
+        self._input_key = input_key
+        self._data = []
+
+    def execute(self):
+        self._data.append(self.get_store().get(self._input_key))
+
+
+class TestFindEvents(unittest.TestCase):
+    def setUp(self):
+        self.pr = register_pixel_reader()
+        pixels = sorted(self.pr.get_pixels())
+        self.events = [(100, 110, pixels[:3]), (300, 320, pixels[5:6]), (500, 501, pixels[10:14])]
+
+    def run_loop(self, release):
+        loop = TODLoop()
+        loop._tod_list = ["1500000000.1500000100.ar4", "1500000200.1500000300.ar4"]
+        loop.add_routine(CutsWriter(self.pr, self.events))
+        loop.add_routine(FindCosigs(input_key="cuts", output_key="cosig"))
+        loop.add_routine(FindEvents(input_key="cosig", output_key="events"))
+        counter = CountPeaks()
+        loop.add_routine(counter)
+        if release:
+            loop.limit_memory()
+        loop.run()
+        return counter._peaks
+
+    def test_find_events(self):
+        self.assertEqual(self.run_loop(release=False), [3, 3])
+
+    def test_find_events_with_release(self):
+        # nsamps is written by FindCosigs and read by FindEvents
+        self.assertEqual(self.run_loop(release=True), [3, 3])
+
+    def test_pixels_affected(self):
+        loop = TODLoop()
+        loop._tod_list = ["1500000000.1500000100.ar4"]
+        loop.add_routine(CutsWriter(self.pr, self.events))
+        loop.add_routine(FindCosigs(input_key="cuts", output_key="cosig"))
+        loop.add_routine(FindEvents(input_key="cosig", output_key="peaks"))
+        loop.add_routine(CosigToEvent(input_key="peaks", output_key="events"))
+        collect_peaks, collect_events = Collect(input_key="peaks"), Collect()
+        loop.add_routine(collect_peaks)
+        loop.add_routine(collect_events)
+        loop.run()
+
+        cosig = collect_peaks._data[0]['coincident_signals']
+        events = collect_events._data[0]
+        self.assertEqual(len(events), 3)
+        for event in events:
+            self.assertTrue(all(type(p) is int for p in event['pixels_affected']))
+            self.assertEqual(sorted(event['pixels_affected']),
+                             sorted(baseline.pixels_affected_in_event(cosig, [event['start'], event['end']])))
+
+
+
+class TestFindClusters(unittest.TestCase):
+    def run_loop(self, finder, events):
+        pr = register_pixel_reader()
+        loop = TODLoop()
+        loop._tod_list = ["1500000000.1500000100.ar4"]
+        loop.add_routine(CutsWriter(pr, events))
+        loop.add_routine(FindCosigs(input_key="cuts", output_key="cosig"))
+        loop.add_routine(finder(input_key="cosig", output_key="clusters"))
+        loop.add_routine(CosigToEvent(input_key="clusters", output_key="events"))
+        collect = Collect()
+        loop.add_routine(collect)
+        loop.run()
+        return collect._data[0]
+
+    def test_simultaneous_clusters(self):
+        pixels = sorted(register_pixel_reader().get_pixels())
+        near, far = pixels[:2], pixels[-2:]  # adjacent pixels at opposite corners
+        events = self.run_loop(FindClusters, [(100, 110, near), (100, 110, far)])
+        self.assertEqual(len(events), 2)
+        self.assertEqual(sorted(sorted(event['pixels_affected']) for event in events),
+                         sorted([sorted(near), sorted(far)]))
+        self.assertEqual(len(set(event['id'] for event in events)), 2)
+        for event in events:
+            self.assertEqual((event['start'], event['end'], event['number_of_pixels']), (100, 110, 2))
+            self.assertTrue(all(type(p) is int for p in event['pixels_affected']))
+
+    def test_simultaneous_events(self):
+        # FindEvents groups all the pixels cut at the same time
+        pixels = sorted(register_pixel_reader().get_pixels())
+        near, far = pixels[:2], pixels[-2:]
+        events = self.run_loop(FindEvents, [(100, 110, near), (100, 110, far)])
+        self.assertEqual(len(events), 1)
+        self.assertEqual(sorted(events[0]['pixels_affected']), sorted(near + far))
+        self.assertTrue(all(type(p) is int for p in events[0]['pixels_affected']))
+
+    def test_peak_pixels_saved_as_strings(self):
+        # outputs of FindEvents saved before the pixels were stored as ints
+        data = {'coincident_signals': {}, 'peaks': [[100, 110, 10, 2]], 'peak_pixels': {100: ['4', '8']}}
+        self.assertEqual(get_peak_pixels(data, data['peaks'][0]), [4, 8])
+        self.assertEqual(get_peak_pixels(data, [100, 110, 10, 2, np.array(['4', '8'])]), [4, 8])
+
+
+class TestJoinEvents(unittest.TestCase):
+    def test_dense_single_array(self):
+        events = [(t * 0.5, t * 0.5 + 0.01, 'ar4', 0, [t]) for t in range(200)]
+        events.append((50.0, 50.01, 'ar5', 1, [0]))
+        coincidences = join_events(events, tolerance=0.1)
+        self.assertEqual(len(coincidences), 1)
+        self.assertEqual(coincidences[0]['arrays'], ['ar4', 'ar5'])
+        self.assertEqual(sorted((e['array'], e['peak']) for e in coincidences[0]['events']),
+                         [('ar4', [100]), ('ar5', [0])])
+
+        # each close ar4 event is paired with the ar5 one, never with each other
+        coincidences = join_events(events, tolerance=1.0)
+        self.assertEqual(sorted(e['peak'][0] for c in coincidences for e in c['events'] if e['array'] == 'ar4'),
+                         [98, 99, 100, 101, 102])
+        self.assertTrue(all(len(c['events']) == 2 for c in coincidences))
+
+    def test_three_arrays(self):
+        events = [(10.0, 10.1, 'ar4', 0, [0]), (10.05, 10.1, 'ar5', 1, [0]), (10.02, 10.2, 'ar6', 2, [0]),
+                  (20.0, 20.1, 'ar4', 0, [1]), (20.05, 20.1, 'ar5', 1, [1])]
+        coincidences = join_events(events, tolerance=0.1)
+        self.assertEqual([c['arrays'] for c in coincidences], [['ar4', 'ar5', 'ar6'], ['ar4', 'ar5']])
+        self.assertEqual(len(join_events(events, tolerance=0.1, min_arrays=3)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
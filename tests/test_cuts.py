@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from todloop.base import DataStore
+from todloop.utils.cuts import CosigIndex, get_cosig_index, pixels_affected, pixels_affected_in_event
+
+
+def make_cosigs(seed=0):
+    """Random short cuts on many pixels and one cut covering most of the TOD"""
+    rng = np.random.RandomState(seed)
+    cs = {}
+    for p in range(50):
+        starts = np.sort(rng.randint(0, 10000, 20))
+        cs[str(p)] = np.array([[s, s + rng.randint(0, 30)] for s in starts])
+    cs['50'] = np.array([[100, 9000]])
+    return cs
+
+
+def brute_force(cs, start, end):
+    return sorted(int(p) for p in cs if any(s <= end and e >= start for s, e in cs[p]))
+
+
+class TestCosigIndex(unittest.TestCase):
+    def test_queries(self):
+        cs = make_cosigs()
+        index = CosigIndex(cs)
+        for start, end in [(0, 0), (99, 99), (100, 100), (5000, 5010), (9000, 9000),
+                           (9001, 9050), (0, 20000), (20000, 20001)]:
+            self.assertEqual(index.query(start, end), brute_force(cs, start, end))
+        self.assertEqual(pixels_affected(cs, 5000), brute_force(cs, 5000, 5000))
+        self.assertEqual(pixels_affected_in_event(cs, [5000, 5011]), brute_force(cs, 5000, 5010))
+        self.assertEqual(CosigIndex({}).query(0, 10), [])
+
+    def test_shared_per_tod(self):
+        store = DataStore()
+        cs = make_cosigs()
+        index = get_cosig_index(cs, store)
+        self.assertIs(get_cosig_index(cs, store), index)
+
+        store.end_tod(complete=True)
+        self.assertIsNone(store.peek("cosig_index"))  # not kept across TODs
+        other = make_cosigs(seed=1)
+        self.assertEqual(get_cosig_index(other, store).query(0, 20000), brute_force(other, 0, 20000))
+
+        # a cosig dict set again after a change is indexed again
+        store.set("cosig", other)
+        other['51'] = np.array([[20000, 20010]])
+        store.set("cosig", other)
+        self.assertEqual(get_cosig_index(other, store).query(20000, 20000), [51])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import numpy as np
+import moby2
+from todloop.base import TODLoop, Routine
+from todloop.utils import pixels, intervals
+from todloop.utils.cuts import PackedCuts
+from coincident_signals.routines import FindCosigs, FindEvents
+from tests import baseline
+from tests.helpers import make_array_data
+from tests.test_intervals import random_intervals
+
+NSAMPS = 2000
+MODES = [(True, False), (True, True), (False, False), (False, True)]  # (strict, polarized)
+
+
+def register_masked_pixel_reader():
+    """A PixelReader where some pixels miss one or more detectors"""
+    array_data = make_array_data()
+    mask = np.ones(len(array_data['det_uid']), dtype=int)
+    mask[[1, 6, 8, 10, 12, 13, 19]] = 0
+    pr = pixels.PixelReader(season='2016', array='ar4', array_data=array_data, mask=mask)
+    pixels._pixel_readers[('2016', 'ar4', None)] = pr
+    return pr
+
+
+def make_cuts(seed, raw=False, max_cuts=40):
+    """Random cuts on all detectors, overlapping between detectors, and
+    within a detector with raw=True"""
+    rng = np.random.RandomState(seed)
+    ndet = len(make_array_data()['det_uid'])
+    tod_cuts = moby2.TODCuts(nsamps=NSAMPS, det_uid=np.arange(ndet))
+    for det in range(ndet):
+        cuts = random_intervals(rng, rng.randint(0, max_cuts), nsamps=NSAMPS, max_length=80, raw=raw)
+        tod_cuts.cuts[det] = moby2.tod.CutsVector(cuts_in=cuts, nsamps=NSAMPS)
+    return tod_cuts
+
+
+class CutsSetter(Routine):
+    def __init__(self, cuts, output_key="cuts"):
+        Routine.__init__(self)
+        self._cuts = cuts
+        self._output_key = output_key
+
+    def execute(self):
+        self.get_store().set(self._output_key, {'cuts': self._cuts, 'nsamps': NSAMPS})
+
+
+class Keep(Routine):
+    """Keeps the data store of the last TOD"""
+    def __init__(self):
+        Routine.__init__(self)
+        self.store = None
+
+    def execute(self):
+        self.store = dict(self.get_store()._store)
+
+
+def run_find_cosigs(cuts, **kwargs):
+    loop = TODLoop()
+    loop._tod_list = ["1500000000.1500000100.ar4"]
+    loop.add_routine(CutsSetter(cuts))
+    loop.add_routine(FindCosigs(input_key="cuts", output_key="cosig", **kwargs))
+    keep = Keep()
+    loop.add_routine(keep)
+    loop.run()
+    return keep.store
+
+
+def assert_same_cosigs(test, cosig, expected):
+    test.assertEqual(sorted(cosig), sorted(expected))
+    for p in expected:
+        np.testing.assert_array_equal(np.asarray(cosig[p]).reshape(-1, 2), np.asarray(expected[p]).reshape(-1, 2))
+
+
+class TestFindCosigs(unittest.TestCase):
+    def setUp(self):
+        self.pr = register_masked_pixel_reader()
+
+    def test_same_as_baseline(self):
+        for seed in range(3):
+            for packed in [False, True]:
+                cuts = make_cuts(seed)
+                for strict, polarized in MODES:
+                    expected = baseline.find_cosigs(cuts, self.pr, strict, polarized)
+                    self.assertTrue(len(expected) > 0)
+                    store = run_find_cosigs(PackedCuts.from_tod_cuts(cuts) if packed else cuts,
+                                            strict=strict, polarized=polarized)
+                    assert_same_cosigs(self, store['cosig'], expected)
+                    self.assertEqual(store['nsamps'], NSAMPS)
+
+    def test_overlapping_raw_cuts(self):
+        # the baseline masks stopped at the end of the last cut of a
+        # detector; the cosigs are those of the merged cuts of each detector
+        raw, merged = make_cuts(0, raw=True), make_cuts(0, raw=True)
+        for det in range(len(merged.cuts)):
+            merged.cuts[det] = moby2.tod.CutsVector(cuts_in=intervals.normalize(merged.cuts[det]), nsamps=NSAMPS)
+        for strict, polarized in MODES:
+            store = run_find_cosigs(raw, strict=strict, polarized=polarized)
+            assert_same_cosigs(self, store['cosig'], baseline.find_cosigs(merged, self.pr, strict, polarized))
+
+
+class TestAllModes(unittest.TestCase):
+    def setUp(self):
+        self.pr = register_masked_pixel_reader()
+
+    def test_same_as_single_modes(self):
+        cuts = make_cuts(1)
+        store = run_find_cosigs(cuts, all_modes=True)
+        keys = FindCosigs(output_key="cosig", all_modes=True).get_mode_keys()
+        self.assertEqual(keys[(False, True)], "cosig_loose_polarized")
+        for (strict, polarized), key in keys.items():
+            assert_same_cosigs(self, store[key], run_find_cosigs(cuts, strict=strict, polarized=polarized)['cosig'])
+        self.assertNotIn('cosig', store)
+
+    def test_find_events_of_all_modes(self):
+        loop = TODLoop()
+        loop._tod_list = ["1500000000.1500000100.ar4"]
+        loop.add_routine(CutsSetter(make_cuts(1, max_cuts=10)))  # separate peaks
+        finder = FindCosigs(input_key="cuts", output_key="cosig", all_modes=True)
+        loop.add_routine(finder)
+        keys = sorted(finder.get_mode_keys().values())
+        loop.add_routine(FindEvents(input_key=keys, output_key=[key + "_events" for key in keys]))
+        keep = Keep()
+        loop.add_routine(keep)
+        loop.run()
+
+        n_peaks = 0
+        for key in keys:
+            events = keep.store[key + "_events"]
+            self.assertIs(events['coincident_signals'], keep.store[key])
+            self.assertEqual(events['peaks'], baseline.find_events(keep.store[key], NSAMPS))
+            n_peaks += len(events['peaks'])
+        self.assertTrue(n_peaks > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
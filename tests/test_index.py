@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from todloop.index import TODIndex
+
+
+class TestTODIndex(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp() + "/"
+        self._list = self._dir + "s16_pa3_list.txt"
+        with open(self._list, "w") as f:
+            f.write("1463475576.1463485804.ar3.zip\n1463475600.1463485900.ar3.zip\n")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_saved_and_loaded(self):
+        TODIndex.from_list(self._list)
+        index = TODIndex.from_list(self._list)
+        self.assertEqual(index.select(array='ar3'), [0, 1])
+        self.assertEqual(index.get_season(0), 's16')
+
+    def test_stale_index_rebuilt(self):
+        # index saved before it had a version, with the arrays of names ending in .zip
+        index_path = self._list + ".index.npz"
+        with open(index_path, "wb") as f:
+            np.savez(f, names=np.array(["1463475576.1463485804.ar3.zip", "1463475600.1463485900.ar3.zip"]),
+                     arrays=np.array(["zip", "zip"]), ctimes=np.array([1463475576, 1463475600]),
+                     seasons=np.array(["s16", "s16"]))
+        os.utime(index_path, (os.path.getmtime(self._list) + 10,) * 2)
+        index = TODIndex.from_list(self._list)
+        self.assertEqual(index.select(array='ar3'), [0, 1])
+        self.assertEqual(TODIndex.load(index_path).select(array='ar3'), [0, 1])  # saved again
+
+
+if __name__ == '__main__':
+    unittest.main()
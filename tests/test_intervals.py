@@ -0,0 +1,104 @@
+import unittest
+import numpy as np
+import moby2
+from todloop.utils import intervals
+from todloop.utils.cuts import merge_cuts, common_cuts
+from tests import baseline
+
+NSAMPS = 500
+
+
+def random_intervals(rng, n, nsamps=NSAMPS, max_length=40, raw=False):
+    """Sorted disjoint intervals like a CutsVector, or with raw=True
+    overlapping intervals in any order, as cuts can be before merging"""
+    starts = rng.randint(0, nsamps - 1, n)
+    ends = np.minimum(starts + rng.randint(1, max_length, n), nsamps)
+    cuts = np.vstack([starts, ends]).T
+    if raw:
+        return cuts
+    return intervals.normalize(cuts)
+
+
+def to_mask(cuts, nsamps=NSAMPS):
+    mask = np.zeros(nsamps, dtype=bool)
+    for start, end in np.asarray(cuts).reshape(-1, 2):
+        mask[start:end] = True
+    return mask
+
+
+def from_mask(mask):
+    return np.asarray(moby2.tod.CutsVector.from_mask(mask)).reshape(-1, 2)
+
+
+def cuts_vector(cuts):
+    return moby2.tod.CutsVector(cuts_in=cuts, nsamps=NSAMPS)
+
+
+class TestIntervals(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def check(self, result, mask):
+        np.testing.assert_array_equal(np.asarray(result).reshape(-1, 2), from_mask(mask))
+
+    def test_against_masks(self):
+        for _ in range(50):
+            a = random_intervals(self.rng, self.rng.randint(0, 15), raw=True)
+            b = random_intervals(self.rng, self.rng.randint(0, 15), raw=True)
+            self.check(intervals.normalize(a), to_mask(a))
+            self.check(intervals.union(a, b), to_mask(a) | to_mask(b))
+            self.check(intervals.intersection(a, b), to_mask(a) & to_mask(b))
+            self.check(intervals.complement(a, NSAMPS), ~to_mask(a))
+            difference = intervals.difference(a, b)
+            self.check(difference, to_mask(a) & ~to_mask(b))
+            self.check(intervals.coverage([a, b, a], 2), to_mask(a) & (to_mask(b) | to_mask(a)))
+
+    def test_dilate_and_filter(self):
+        for _ in range(50):
+            a = random_intervals(self.rng, self.rng.randint(0, 15), raw=True)
+            dilated = np.zeros(NSAMPS, dtype=bool)
+            for start, end in a:
+                dilated[max(start - 3, 0):end + 3] = True
+            self.check(intervals.dilate(a, 3, NSAMPS), dilated)
+            normalized = intervals.normalize(a)
+            lengths = normalized[:, 1] - normalized[:, 0]
+            np.testing.assert_array_equal(intervals.filter_length(a, 5, 20),
+                                          normalized[(lengths >= 5) & (lengths <= 20)])
+
+    def test_coverage_grouped(self):
+        sets = [random_intervals(self.rng, self.rng.randint(0, 15)) for _ in range(6)]
+        groups = np.repeat([0, 0, 1, 1, 2, 2], [len(s) for s in sets])
+        flat = np.concatenate(sets)
+        starts, ends, result_groups = intervals.coverage_grouped(flat[:, 0], flat[:, 1], groups, [2, 1, 2])
+        for group, min_count in enumerate([2, 1, 2]):
+            a, b = sets[2 * group], sets[2 * group + 1]
+            expected = to_mask(a) & to_mask(b) if min_count == 2 else to_mask(a) | to_mask(b)
+            self.check(np.vstack([starts, ends]).T[result_groups == group], expected)
+
+
+class TestMergeCommonCuts(unittest.TestCase):
+    def test_same_as_baseline(self):
+        rng = np.random.RandomState(1)
+        for _ in range(50):
+            a = cuts_vector(random_intervals(rng, rng.randint(0, 15)))
+            b = cuts_vector(random_intervals(rng, rng.randint(0, 15)))
+            np.testing.assert_array_equal(np.asarray(merge_cuts(a, b)).reshape(-1, 2),
+                                          np.asarray(baseline.merge_cuts(a, b)).reshape(-1, 2))
+            np.testing.assert_array_equal(np.asarray(common_cuts(a, b)).reshape(-1, 2),
+                                          np.asarray(baseline.common_cuts(a, b)).reshape(-1, 2))
+
+    def test_overlapping_raw_cuts(self):
+        # the baseline masks stop at the end of the last cut, so they lose
+        # the samples of an earlier cut ending after it; the intervals
+        # keep them, like masks of the full length
+        a = cuts_vector([[100, 200], [150, 160]])
+        b = cuts_vector([[120, 130], [170, 180]])
+        np.testing.assert_array_equal(merge_cuts(a, b), from_mask(to_mask(a) | to_mask(b)))
+        np.testing.assert_array_equal(common_cuts(a, b), from_mask(to_mask(a) & to_mask(b)))
+        np.testing.assert_array_equal(baseline.merge_cuts(a, b), [[100, 180]])
+        np.testing.assert_array_equal(merge_cuts(a, b), [[100, 200]])
+        np.testing.assert_array_equal(common_cuts(a, b), [[120, 130], [170, 180]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+import moby2
+from todloop.utils.cuts import PackedCuts, remove_overlap_vector, remove_overlap_tod
+from tests import baseline
+from tests.test_intervals import random_intervals
+
+NSAMPS = 500
+NDET = 20
+
+
+def make_tod_cuts(rng, max_cuts=10, max_length=40):
+    tod_cuts = moby2.TODCuts(nsamps=NSAMPS, det_uid=np.arange(NDET))
+    for det in range(NDET):
+        cuts = random_intervals(rng, rng.randint(0, max_cuts), max_length=max_length)
+        tod_cuts.cuts[det] = moby2.tod.CutsVector(cuts_in=cuts, nsamps=NSAMPS)
+    return tod_cuts
+
+
+class TestRemoveOverlap(unittest.TestCase):
+    def test_vector_same_as_baseline(self):
+        rng = np.random.RandomState(0)
+        for buff in [0, 1, 5]:
+            for _ in range(50):
+                original = random_intervals(rng, rng.randint(0, 15))
+                to_remove = random_intervals(rng, rng.randint(0, 5), max_length=5)
+                np.testing.assert_array_equal(remove_overlap_vector(original, to_remove, buff),
+                                              baseline.remove_overlap_vector(original, to_remove, buff))
+
+    def test_touching_cuts(self):
+        original = np.array([[10, 20], [30, 40], [50, 60]])
+        # cut ends are inclusive like in the baseline: [20, 25] touches [10, 20]
+        np.testing.assert_array_equal(remove_overlap_vector(original, np.array([[20, 25]])), [[30, 40], [50, 60]])
+        np.testing.assert_array_equal(remove_overlap_vector(original, np.array([[23, 27]]), buff=3), [[50, 60]])
+        np.testing.assert_array_equal(remove_overlap_vector(original, np.array([[24, 26]]), buff=3), original)
+
+    def test_tod_same_as_baseline(self):
+        for seed in range(5):
+            rng = np.random.RandomState(seed)
+            original, mce = make_tod_cuts(rng), make_tod_cuts(rng, max_cuts=4, max_length=5)
+            expected = baseline.remove_overlap_tod(make_tod_cuts(np.random.RandomState(seed)), mce, buff=2)
+            result = remove_overlap_tod(original, mce, buff=2)
+            packed = remove_overlap_tod(PackedCuts.from_tod_cuts(make_tod_cuts(np.random.RandomState(seed))),
+                                        PackedCuts.from_tod_cuts(mce), buff=2)
+            for det in range(NDET):
+                np.testing.assert_array_equal(result.cuts[det], expected.cuts[det])
+                np.testing.assert_array_equal(np.asarray(packed.cuts[det]).reshape(-1, 2),
+                                              np.asarray(expected.cuts[det]).reshape(-1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import cPickle
+import unittest
+import numpy as np
+from todloop.utils.cuts import PackedCuts, trim_edge_cuts
+from tests import baseline
+from tests.test_overlaps import make_tod_cuts, NDET, NSAMPS
+
+
+def assert_same_cuts(a, b):
+    assert len(a.cuts) == len(b.cuts)
+    for det in range(len(a.cuts)):
+        np.testing.assert_array_equal(np.asarray(a.cuts[det]).reshape(-1, 2), np.asarray(b.cuts[det]).reshape(-1, 2))
+
+
+class TestPackedCuts(unittest.TestCase):
+    def setUp(self):
+        self.tod_cuts = make_tod_cuts(np.random.RandomState(0))
+
+    def test_round_trip(self):
+        packed = PackedCuts.from_tod_cuts(self.tod_cuts)
+        self.assertEqual((packed.get_ndet(), packed.nsamps), (NDET, NSAMPS))
+        self.assertEqual(packed.starts.dtype, np.int32)
+        assert_same_cuts(packed, self.tod_cuts)
+        assert_same_cuts(packed.to_tod_cuts(), self.tod_cuts)
+        np.testing.assert_array_equal(packed.to_tod_cuts().det_uid, self.tod_cuts.det_uid)
+        self.assertIs(PackedCuts.from_tod_cuts(packed), packed)
+
+    def test_pickle(self):
+        packed = PackedCuts.from_tod_cuts(self.tod_cuts)
+        loaded = cPickle.loads(cPickle.dumps(packed, cPickle.HIGHEST_PROTOCOL))
+        assert_same_cuts(loaded, packed)
+        self.assertEqual(loaded.nsamps, NSAMPS)
+
+    def test_select(self):
+        packed = PackedCuts.from_tod_cuts(self.tod_cuts)
+        keep = packed.ends - packed.starts > 10
+        selected = packed.select(keep)
+        for det in range(NDET):
+            cuts = np.asarray(self.tod_cuts.cuts[det]).reshape(-1, 2)
+            np.testing.assert_array_equal(np.asarray(selected[det]).reshape(-1, 2),
+                                          cuts[cuts[:, 1] - cuts[:, 0] > 10])
+
+    def test_trim_edge_cuts_same_as_baseline(self):
+        expected = baseline.trim_edge_cuts(make_tod_cuts(np.random.RandomState(0)), NSAMPS)
+        assert_same_cuts(trim_edge_cuts(PackedCuts.from_tod_cuts(self.tod_cuts), NSAMPS), expected)
+        assert_same_cuts(trim_edge_cuts(make_tod_cuts(np.random.RandomState(0)), NSAMPS), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from todloop.utils import pixels
+from todloop.utils.pixels import PixelReader, get_pixel_reader
+from tests import baseline
+from tests.helpers import make_array_data, register_pixel_reader
+
+
+def make_shuffled_array_data(seed=0):
+    """The fake array with its detectors in random order, some of them
+    without a position or not tes, and a pixel with three f1 detectors"""
+    array_data = make_array_data()
+    order = np.random.RandomState(seed).permutation(len(array_data['det_uid']))
+    for name in ['array_x', 'array_y', 'nom_freq', 'det_type']:
+        array_data[name] = array_data[name][order]
+    array_data['array_x'][:3] = 0  # not physical
+    array_data['array_y'][:3] = 0
+    array_data['det_type'][3:5] = 'dark'
+    array_data['array_x'][5], array_data['array_y'][5] = array_data['array_x'][6], array_data['array_y'][6]
+    array_data['nom_freq'][5] = array_data['nom_freq'][6] = 90
+    return array_data
+
+
+class TestAdjacency(unittest.TestCase):
+    def test_nearest_ring_of_hexagonal_grid(self):
+        pr = PixelReader(season='2016', array='ar4', array_data=make_array_data(spacing=0.5))
+        self.assertEqual(sorted(pr.get_adjacent_pixels(56)), [28, 32, 52, 60, 76, 80])
+        self.assertEqual(sorted(pr.get_adjacent_pixels(0)), [4, 24])  # corner
+        self.assertEqual(sorted(pr.get_adjacent_detectors(57)), range(28, 36) + range(52, 56) +
+                         range(60, 64) + range(76, 84))
+
+    def test_fixed_threshold(self):
+        # squared distance 0.64 between neighbours, beyond the threshold of 0.6
+        pr = PixelReader(season='2016', array='ar4', array_data=make_array_data(spacing=0.8))
+        self.assertEqual(pr.get_adjacent_pixels(56), [])
+
+
+class TestRadius(unittest.TestCase):
+    def test_same_as_baseline(self):
+        for season, scale in [('2016', 1.0), ('2017', 10000.0)]:
+            array_data = make_shuffled_array_data()
+            array_data['array_x'] *= scale
+            array_data['array_y'] *= scale
+            expected = dict((radius, [baseline.get_pixels_within_radius(
+                array_data, baseline.generate_pixel_dict(array_data), p, radius * scale) for p in range(20)])
+                for radius in [0.3, 0.6, 1.2, 10.0])
+            pr = PixelReader(season=season, array='ar4', array_data=array_data)
+            for radius in expected:
+                self.assertEqual([pr.get_pixels_within_radius(p, radius * scale) for p in range(20)],
+                                 expected[radius])
+                self.assertEqual(pr.get_pixels_within_radius(range(20), radius * scale), expected[radius])
+            self.assertTrue(any(len(pixels) > 1 for pixels in expected[0.6]))
+
+
+class TestLookupTables(unittest.TestCase):
+    def test_pixel_dict(self):
+        for seed in range(3):
+            array_data = make_shuffled_array_data(seed)
+            expected = baseline.generate_pixel_dict(array_data)
+            pr = PixelReader(season='2016', array='ar4', array_data=array_data)
+            self.assertEqual(sorted(pr.get_pixels()), sorted(int(p) for p in expected))
+            for p in expected:
+                self.assertEqual(pr.get_f1(p), expected[p]['f1'])
+                self.assertEqual(pr.get_f2(p), expected[p]['f2'])
+
+    def test_tables(self):
+        array_data = make_shuffled_array_data()
+        mask = np.random.RandomState(1).randint(0, 2, len(array_data['det_uid']))
+        for pr in [PixelReader(season='2016', array='ar4', array_data=array_data),
+                   PixelReader(season='2016', array='ar4', array_data=array_data, mask=mask)]:
+            pixel_ids, pixel_dets, pixel_ndets = pr.get_pixel_table()
+            self.assertEqual(list(pixel_ids), sorted(pr.get_pixels()))
+            det_pixels = -np.ones(len(array_data['det_uid']), dtype=int)
+            for i, p in enumerate(pixel_ids):
+                for band, dets in enumerate([pr.get_f1(p), pr.get_f2(p)]):
+                    self.assertEqual(pixel_ndets[i, band], len(dets))
+                    self.assertEqual(list(pixel_dets[i, band]), (dets + [-1, -1])[:2])
+                    det_pixels[dets] = p
+            self.assertEqual(list(pr.get_det_pixels()), list(det_pixels))
+        self.assertTrue(np.any(pixel_ndets == 3))
+        self.assertTrue(np.any(pixel_ndets == 1))  # masked
+
+
+class TestSharedReader(unittest.TestCase):
+    def tearDown(self):
+        pixels._pixel_readers.clear()
+
+    def test_shared(self):
+        pr = register_pixel_reader(season='2016', array='ar4')
+        self.assertIs(get_pixel_reader('2016', 'ar4'), pr)
+        self.assertIs(get_pixel_reader('2016', 'ar4', None), pr)
+
+    def test_by_mask(self):
+        mask = np.ones(len(make_array_data()['det_uid']), dtype=int)
+        pr = PixelReader(season='2016', array='ar4', array_data=make_array_data(), mask=mask)
+        pixels._pixel_readers[('2016', 'ar4', tuple(mask))] = pr
+        register_pixel_reader(season='2016', array='ar4')
+        self.assertIs(get_pixel_reader('2016', 'ar4', mask), pr)
+        self.assertIs(get_pixel_reader('2016', 'ar4', list(mask)), pr)  # same mask, other type
+        self.assertIsNot(get_pixel_reader('2016', 'ar4'), pr)
+
+
+class TestGeometryFile(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_round_trip(self):
+        for season in ['2016', '2017']:
+            array_data = make_shuffled_array_data()
+            if season == '2017':  # positions in different units
+                array_data['array_x'] *= 10000.0
+                array_data['array_y'] *= 10000.0
+            pixels.save_geometry(season, 'ar4', array_data, self.cache_dir)
+            mask = np.random.RandomState(1).randint(0, 2, len(array_data['det_uid']))
+            loaded = PixelReader.from_cache(season, 'ar4', mask=mask, cache_dir=self.cache_dir)
+            built = PixelReader(season=season, array='ar4', array_data=array_data, mask=mask)
+            self.assertEqual(loaded._pixel_dict, built._pixel_dict)
+            for table, expected in zip(loaded.get_pixel_table() + loaded.get_adjacency(),
+                                       built.get_pixel_table() + built.get_adjacency()):
+                self.assertEqual(table.tolist(), expected.tolist())
+            self.assertEqual(loaded.get_det_pixels().tolist(), built.get_det_pixels().tolist())
+            np.testing.assert_array_equal(loaded.get_x_y_array(), built.get_x_y_array())
+            self.assertEqual(loaded.get_pixels_within_radius(56, 2.0), built.get_pixels_within_radius(56, 2.0))
+
+    def test_adjacency_read(self):
+        pixels.save_geometry('2016', 'ar4', make_array_data(), self.cache_dir)
+        path = pixels.get_geometry_path('2016', 'ar4', self.cache_dir)
+        with np.load(path) as geometry:
+            saved = dict((name, geometry[name]) for name in geometry.files)
+        saved['adjacent'] = saved['adjacent'][::-1]
+        np.savez(path, **saved)
+        pr = PixelReader.from_cache('2016', 'ar4', cache_dir=self.cache_dir)
+        self.assertEqual(pr.get_adjacency()[2].tolist(), saved['adjacent'].tolist())
+
+    def test_version(self):
+        pixels.save_geometry('2016', 'ar4', make_array_data(), self.cache_dir)
+        path = pixels.get_geometry_path('2016', 'ar4', self.cache_dir)
+        with np.load(path) as geometry:
+            saved = dict((name, geometry[name]) for name in geometry.files)
+        saved['version'] = pixels.GEOMETRY_VERSION - 1
+        np.savez(path, **saved)
+        self.assertRaises(IOError, PixelReader.from_cache, '2016', 'ar4', cache_dir=self.cache_dir)
+        os.remove(path)
+        self.assertRaises(IOError, PixelReader.from_cache, '2016', 'ar4', cache_dir=self.cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
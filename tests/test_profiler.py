@@ -0,0 +1,64 @@
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+from todloop.base import TODLoop, Routine
+from todloop.profiler import count_items
+
+
+class ListWriter(Routine):
+    """Writes a list with one item per tod_id up to the current one"""
+    def __init__(self, output_key):
+        Routine.__init__(self)
+        self._output_key = output_key
+
+    def execute(self):
+        self.get_store().set(self._output_key, range(self.get_id() + 1))
+
+
+class Reader(Routine):
+    def __init__(self, input_key):
+        Routine.__init__(self)
+        self._input_key = input_key
+
+    def execute(self):
+        self.get_store().get(self._input_key)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp() + "/"
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_report(self):
+        loop = TODLoop()
+        loop._tod_list = ["1500000000.1500000100.ar4", "1500000200.1500000300.ar4", "1500000400.1500000500.ar4"]
+        loop.add_routine(ListWriter(output_key="items"))
+        loop.add_routine(Reader(input_key="items"))
+        loop.enable_profiling(self._dir)
+        loop.run()
+
+        with open(self._dir + "profile.0_3.csv") as f:
+            records = list(csv.DictReader(f))
+        self.assertEqual(len(records), 2 * (1 + 3 + 1))  # initialize, execute per TOD, finalize
+        execute = [r for r in records if r['stage'] == 'execute']
+        self.assertEqual([(r['tod_id'], r['routine'], r['items_in'], r['items_out']) for r in execute],
+                         [('0', 'ListWriter', '', '1'), ('0', 'Reader', '1', ''),
+                          ('1', 'ListWriter', '', '2'), ('1', 'Reader', '2', ''),
+                          ('2', 'ListWriter', '', '3'), ('2', 'Reader', '3', '')])
+        with open(self._dir + "profile.0_3.json") as f:
+            summary = json.load(f)
+        self.assertEqual(summary['routines']['0.ListWriter']['calls'], 5)
+        self.assertEqual(sorted(tod_id for tod_id, _ in summary['slowest_tods']), [0, 1, 2])
+
+    def test_count_items(self):
+        self.assertEqual(count_items({'peaks': [1, 2], 'coincident_signals': {}}), 2)
+        self.assertEqual(count_items([1, 2, 3]), 3)
+        self.assertEqual(count_items(1.0), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from todloop.base import TODLoop, Routine
+from todloop.routines import SnippetLoader
+from todloop.utils import pixels
+from todloop.utils.pixels import PixelReader
+from todloop.utils.snippets import extract_snippets, get_timeseries, save_snippets, SnippetStore
+from coincident_signals.routines import SaveSnippets
+from tests.helpers import make_array_data, register_pixel_reader, FakeTOD
+
+TOD_LIST = ["1500000000.1500000100.ar4", "1500000200.1500000300.ar4", "1500000400.1500000500.ar4"]
+# [start, end, duration, n_pixels, pixels], the first two simultaneous
+PEAKS = [[100, 110, 10, 2, [4, 8]], [100, 110, 10, 1, [140]], [500, 540, 40, 3, [28, 32, 56]],
+         [990, 1000, 10, 1, [0]]]
+
+
+def make_tod(tod_id):
+    return FakeTOD(np.random.RandomState(tod_id).normal(size=(len(make_array_data()['det_uid']), 1000)))
+
+
+class EventSetter(Routine):
+    """Sets the TOD and the events of FindClusters"""
+    def execute(self):
+        self.get_store().set("tod_data", make_tod(self.get_id()))
+        self.get_store().set("events", {'peaks': PEAKS})
+
+
+class Timeseries(Routine):
+    """Reads the timeseries and the ctime of the events"""
+    def __init__(self, buffer):
+        Routine.__init__(self)
+        self._buffer = buffer
+        self.timeseries = {}
+
+    def execute(self):
+        tod_data = self.get_store().get("tod_data")
+        pr = pixels.get_pixel_reader('2016', 'ar4')
+        for start, end, _, _, event_pixels in PEAKS:
+            for pixel in event_pixels:
+                self.timeseries[(self.get_id(), pixel, start)] = (
+                    get_timeseries(tod_data, pr, pixel, start, end, buffer=self._buffer), tod_data.ctime[start])
+
+
+class TestSnippets(unittest.TestCase):
+    def setUp(self):
+        array_data = make_array_data()
+        self._data = np.random.RandomState(0).normal(size=(len(array_data['det_uid']), 1000))
+        self._tod = FakeTOD(self._data)
+        self._mask = np.ones(len(array_data['det_uid']), dtype=int)
+        self._mask[57] = 0  # f1B of pixel 56
+        self._pr = PixelReader(season='2016', array='ar4', array_data=array_data, mask=self._mask)
+
+    def test_timeseries(self):
+        time, d1, d2, d3, d4 = get_timeseries(self._tod, self._pr, 4, 100, 110, buffer=5)
+        self.assertEqual(len(time), 20)
+        for det, d in zip([4, 5, 6, 7], [d1, d2, d3, d4]):
+            np.testing.assert_allclose(d, self._data[det, 95:115] - self._data[det, 95:115].mean())
+
+    def test_missing_detector(self):
+        self.assertRaises(ValueError, extract_snippets, self._tod, self._pr, [(4, 100, 110), (56, 100, 110)])
+        self.assertRaises(KeyError, extract_snippets, self._tod, self._pr, [(5, 100, 110)])
+
+    def test_required_detectors(self):
+        mask = self._mask.copy()
+        mask[63] = 0  # f2B of pixel 60
+        pr = PixelReader(season='2016', array='ar4', array_data=make_array_data(), mask=mask)
+        self.assertRaises(ValueError, get_timeseries, self._tod, pr, 60, 100, 110)
+        self.assertRaises(ValueError, get_timeseries, self._tod, pr, 56, 100, 110, required=(0, 1))
+        time, d1, d2, d3, d4 = get_timeseries(self._tod, pr, 60, 100, 110, buffer=5, required=(0, 1))
+        for det, d in zip([60, 61, 62], [d1, d2, d3]):
+            np.testing.assert_allclose(d, self._data[det, 95:115] - self._data[det, 95:115].mean())
+        self.assertTrue(np.all(np.isnan(d4)))
+
+    def test_saved_snippets(self):
+        snippet_dir = tempfile.mkdtemp() + "/"
+        try:
+            save_snippets(snippet_dir + "tod.npz", self._tod, self._pr, [("0.100", 100, 110, [4, 8])])
+            store = SnippetStore(snippet_dir + "tod.npz")
+            pixels, time, snippets = store.get_event("0.100")
+            self.assertEqual(list(pixels), [4, 8])
+            self.assertFalse(np.any(np.isnan(snippets)))
+            self.assertRaises(ValueError, save_snippets, snippet_dir + "bad.npz", self._tod, self._pr,
+                              [("0.100", 100, 110, [4, 56])])
+        finally:
+            shutil.rmtree(snippet_dir)
+
+
+class TestSnippetLoop(unittest.TestCase):
+    def setUp(self):
+        register_pixel_reader(season='2016', array='ar4')
+        self.snippet_dir = tempfile.mkdtemp() + "/"
+
+    def tearDown(self):
+        pixels._pixel_readers.clear()
+        shutil.rmtree(self.snippet_dir)
+
+    def run_loop(self, routines, start=0, end=None):
+        loop = TODLoop()
+        loop._tod_list = TOD_LIST
+        for routine in routines:
+            loop.add_routine(routine)
+        loop.run(start, end)
+
+    def test_same_as_tod(self):
+        self.run_loop([EventSetter(), SaveSnippets(cosig_key="events", output_dir=self.snippet_dir, buffer=20)])
+        store = SnippetStore(self.snippet_dir + "1.npz")
+        self.assertEqual(store.get_event_ids(), ["1.100", "1.100.1", "1.500", "1.990"])
+        self.assertEqual(list(store.get_event("1.500")[0]), [28, 32, 56])
+
+        for buffer in [0, 10, 20]:
+            from_tod, from_snippets = Timeseries(buffer), Timeseries(buffer)
+            self.run_loop([EventSetter(), from_tod])
+            self.run_loop([SnippetLoader(input_dir=self.snippet_dir), from_snippets])
+            self.assertEqual(sorted(from_snippets.timeseries), sorted(from_tod.timeseries))
+            for key, (timeseries, ctime) in from_tod.timeseries.items():
+                self.assertEqual(from_snippets.timeseries[key][1], ctime)
+                for expected, value in zip(timeseries, from_snippets.timeseries[key][0]):
+                    np.testing.assert_allclose(value, expected, rtol=1e-5, atol=1e-5)
+
+    def test_missing_file_vetoed(self):
+        self.run_loop([EventSetter(), SaveSnippets(cosig_key="events", output_dir=self.snippet_dir)], 0, 2)
+        from_snippets = Timeseries(10)
+        self.run_loop([SnippetLoader(input_dir=self.snippet_dir), from_snippets])
+        self.assertEqual(sorted(set(key[0] for key in from_snippets.timeseries)), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,19 @@
+import os
+import sys
+import glob
+import Queue
+import hashlib
+import traceback
+import json
+import cPickle
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from todloop.profiler import Profiler
+from todloop.manifest import Manifest
+from todloop.index import TODIndex, get_array
+
+
 class TODLoop:
     """Main driving class for looping through coincident signals of different TODs"""
     def __init__(self):
@@ -6,9 +22,22 @@ class TODLoop:
         self._store = DataStore()  # initialize data store
         self._metadata = {}  # store metadata here
         self._tod_list = None
+        self._index = None  # TODIndex of the list of TODs
         self._tod_id = None
         self._tod_name = None
         self._skip_list = []
+        self._prefetch = 0  # number of TODs to load ahead
+        self._prefetch_pool = None
+        self._prefetched = {}  # pending loads: {tod_id: {routine index: result}}
+        self._threads = 1  # number of threads to run independent routines
+        self._thread_pool = None
+        self._dependencies = None  # {routine index: set of indexes it depends on}
+        self._local = threading.local()  # veto signal of each thread
+        self._profiler = None
+        self._keys = None  # keys read and written by each routine, for the profiler
+        self._manifest = None
+        self._failure_dir = None  # folder of the failure log and skip file
+        self._routine_index = None  # index of the routine being executed
 
     def add_routine(self, routine):
         """Add a routine to the event loop"""
@@ -16,61 +45,468 @@ class TODLoop:
         print '[INFO] Added routine: %s' % routine.__class__.__name__
         routine.add_context(self)  # make event loop accessible in each routine
 
-    def add_tod_list(self, tod_list_dir):
-        """Add a list of TODs as input
+    def add_tod_list(self, tod_list_dir, season=None):
+        """Add a list of TODs as input, and load its index which is used
+        to select TODs in run
         @par:
-            tod_list_dir: string"""
+            tod_list_dir: string
+            season:       string - season of the TODs, see TODIndex.from_list"""
         with open(tod_list_dir, "r") as f:
             self._tod_list = [line.split('\n')[0] for line in f.readlines()]
             self._metadata['list'] = self._tod_list
+        self._index = TODIndex.from_list(tod_list_dir, season)
+
+    def get_index(self):
+        """Return the TODIndex of the list of TODs"""
+        if self._index is None:
+            self._index = TODIndex(self._tod_list)
+        return self._index
 
     def add_skip(self, skip_list):
-        self._skip_list = skip_list
+        """Add TODs to skip
+        @par:
+            skip_list: [int] or string - list of tod_id, or path of a
+                       file with one tod_id per line such as the skip
+                       file written with enable_fault_isolation"""
+        if isinstance(skip_list, basestring):
+            with open(skip_list, "r") as f:
+                lines = [line.strip() for line in f.readlines()]
+                skip_list = [int(line) for line in lines if line and not line.startswith('#')]
+            print '[INFO] Loaded %d TODs to skip' % len(skip_list)
+        self._skip_list = self._skip_list + list(skip_list)
+
+    def enable_fault_isolation(self, output_dir):
+        """Catch the exceptions raised by routines so that a TOD that
+        fails doesn't stop the loop. The TOD, routine and traceback of
+        each failure are appended to failures.log, and the tod_id to
+        skip.txt in the output folder, which can be given to add_skip.
+        @par:
+            output_dir: string"""
+        if not os.path.exists(output_dir):
+            print '[INFO] Path %s does not exist, creating ...' % output_dir
+            os.makedirs(output_dir)
+        self._failure_dir = output_dir
+
+    def record_failure(self, tod_id, exc_info):
+        """Log a failed TOD and add it to the skip file
+        @par:
+            tod_id:   int
+            exc_info: tuple returned by sys.exc_info"""
+        if self._routine_index is not None:
+            routine = self._routines[self._routine_index].__class__.__name__
+        else:
+            routine = None
+        print '[ERROR] tod: %d failed in %s: %s, skipping ...' % (tod_id, routine, exc_info[1])
+        log = "[%d] %s routine: %s\n%s\n" % (tod_id, self._tod_name, routine,
+                                            ''.join(traceback.format_exception(*exc_info)))
+        # single writes in append mode, as workers may share the files
+        with open(self._failure_dir + "failures.log", "a") as f:
+            f.write(log)
+        with open(self._failure_dir + "skip.txt", "a") as f:
+            f.write("%d\n" % tod_id)
 
     def get_store(self):
         """Access the shared data storage"""
         return self._store
+
+    def limit_memory(self, release_keys=True, budget=None, scratch_dir="/tmp/todloop/"):
+        """Reduce the memory used by the data store
+        @par:
+            release_keys: bool - release each key after the last routine
+                          reading it and clear the store after each TOD
+            budget:       int - if given, spill the least recently used
+                          objects to scratch_dir above this many bytes
+            scratch_dir:  string - folder for the spilled objects"""
+        if release_keys:
+            reads, writes = self.get_declared_keys()
+            consumers = {}
+            for i in range(len(self._routines)):
+                for key in reads[i] | writes[i]:
+                    consumers.setdefault(key, set()).add(i)
+            self._store.enable_release(consumers)
+        if budget is not None:
+            self._store.set_budget(budget, scratch_dir)
+
+    def get_declared_keys(self):
+        """Find the keys each routine reads and writes, see Routine.get_keys
+        @ret:
+            reads:  [set of keys read by each routine]
+            writes: [set of keys written by each routine]"""
+        keys = [routine.get_keys() for routine in self._routines]
+        return [k[0] for k in keys], [k[1] for k in keys]
+
+    def get_dependencies(self):
+        """Find the earlier routines that each routine has to wait for,
+        based on the keys declared by the routines and the keys they have
+        been seen to read and write in the data store. A routine depends
+        on an earlier one if it uses a key the earlier one writes, or
+        writes a key the earlier one reads, so routines that only read
+        keys (plots, studies) just wait for their inputs. Routines that
+        use no keys at all (filters on whole TODs such as TODSelector)
+        keep their place in the order of the loop. With threads, a
+        routine that vetoes while only reading keys doesn't stop the
+        routines after it, unless they depend on it.
+        @ret:
+            {routine index: set of routine indexes}"""
+        reads, writes = self.get_declared_keys()
+        seen_reads, seen_writes = self._store.get_accesses()
+        for i in range(len(self._routines)):
+            reads[i] |= seen_reads.get(i, set())
+            writes[i] |= seen_writes.get(i, set())
+
+        dependencies = {}
+        for j in range(len(self._routines)):
+            dependencies[j] = set()
+            for i in range(j):
+                if (not (reads[i] or writes[i]) or not (reads[j] or writes[j]) or
+                        writes[i] & (reads[j] | writes[j]) or reads[i] & writes[j]):
+                    dependencies[j].add(i)
+        return dependencies
     
+    def enable_profiling(self, output_dir):
+        """Record the wall time, cpu time, memory change and number of
+        items in and out of each routine for every TOD, and write a report
+        to the output folder at the end of the run
+        @par:
+            output_dir: string"""
+        self._profiler = Profiler(output_dir)
+
+    def enable_manifest(self, path):
+        """Record the TODs that are done, vetoed or failed in a manifest
+        file after each TOD, which allows a run to be resumed with
+        run(..., resume=True)
+        @par:
+            path: string - path of the manifest file"""
+        self._manifest = Manifest(path)
+
+    def get_config(self):
+        """Return the configuration of the loop: the list of TODs and the
+        parameters of each routine"""
+        tod_list = json.dumps(self._tod_list)
+        return {
+            'tod_list': hashlib.md5(tod_list).hexdigest(),
+            'routines': [routine.get_config() for routine in self._routines]
+        }
+
+    def call(self, index, stage):
+        """Call the initialize, execute or finalize method of a routine,
+        through the profiler if profiling is enabled
+        @par:
+            index: int - index of the routine
+            stage: string - name of the method"""
+        func = getattr(self._routines[index], stage)
+        if not self._profiler:
+            return func()
+        reads, writes = self._keys
+        return self._profiler.call(self, index, stage, func, reads[index], writes[index])
+
     def initialize(self):
         """Initialize all routines"""
-        for routine in self._routines:
-            routine.initialize()
+        self._keys = self.get_declared_keys()
+        for i in range(len(self._routines)):
+            self.call(i, 'initialize')
     
     def execute(self):
-        """Execute all routines"""
-        for routine in self._routines:
-            # check veto signal, if received, skip subsequent routines
-            if self._veto:
-                break
-            else:
-                routine.execute()
+        """Execute all routines
+        @ret:
+            bool - True if no routine vetoed"""
+        if self._thread_pool and self._dependencies:
+            complete = self.execute_graph()
+        else:
+            for i in range(len(self._routines)):
+                # check veto signal, if received, skip subsequent routines
+                if self._veto:
+                    break
+                else:
+                    self._routine_index = i
+                    self._store.begin_routine(i)
+                    self.call(i, 'execute')
+                    self._store.end_routine(i)
+            complete = not self._veto
+        self._store.end_tod(complete=complete)
         self._veto = False
+        if self._thread_pool and complete:
+            # build the graph once the keys used by all routines are known
+            self._dependencies = self.get_dependencies()
+        return complete
+
+    def execute_graph(self):
+        """Execute all routines in the thread pool, each routine starts
+        as soon as the routines it depends on are done, so independent
+        branches run concurrently. A veto only skips the routines that
+        depend on the routine that vetoed.
+        @ret:
+            bool - True if no routine vetoed"""
+        pending = range(len(self._routines))
+        done = set()
+        skipped = set()  # vetoed or skipped routines
+        results = Queue.Queue()
+        running = 0
+        error = None
+        while pending or running:
+            if error:  # wait for the running routines and stop
+                pending = []
+                ready = []
+            else:
+                ready = [i for i in pending if self._dependencies[i] <= done]
+            for i in ready:
+                pending.remove(i)
+                if self._dependencies[i] & skipped:  # an upstream routine vetoed
+                    skipped.add(i)
+                    done.add(i)
+                else:
+                    self._thread_pool.apply_async(self._execute_routine, (i,), callback=results.put)
+                    running += 1
+            if ready and not running:
+                continue  # skipping routines may have made others ready
+            if not running:
+                break  # stopped by an error, nothing left to wait for
+            i, veto, exc_info = results.get()
+            running -= 1
+            if exc_info and not error:
+                error = exc_info
+                self._routine_index = i
+            done.add(i)
+            if veto:
+                skipped.add(i)
+        if error:
+            raise error[0], error[1], error[2]
+        return not skipped
+
+    def _execute_routine(self, index):
+        """Execute a routine in a thread of the pool and return its index,
+        its veto signal and the exception raised if any"""
+        self._local.veto = False
+        try:
+            self._store.begin_routine(index)
+            self.call(index, 'execute')
+            self._store.end_routine(index)
+        except Exception:
+            return index, False, sys.exc_info()
+        return index, self._local.veto, None
     
     def finalize(self):
         """Finalize all routines"""
-        for routine in self._routines:
-            routine.finalize()
+        for i in range(len(self._routines)):
+            self.call(i, 'finalize')
     
-    def run(self, start, end):
+    def process(self, tod_id):
+        """Run all routines on a single TOD
+        @par:
+            tod_id: int"""
+        self._tod_id = tod_id
+        self._tod_name = self._tod_list[tod_id]
+        self._routine_index = None
+        try:
+            complete = self.execute()
+        except Exception:
+            if self._manifest:
+                self._manifest.record(tod_id, 'failed')
+            if not self._failure_dir:
+                raise
+            self.record_failure(tod_id, sys.exc_info())
+            self._store.end_tod(complete=False)  # discard the partial results
+            self._veto = False
+            return
+        if self._manifest:
+            self._manifest.record(tod_id, 'done' if complete else 'vetoed')
+
+    def process_list(self, tod_ids):
+        """Run all routines on a list of TODs, loading the inputs of the
+        next TODs in a background thread if prefetch is enabled
+        @par:
+            tod_ids: [int]"""
+        if self._prefetch > 0:
+            self._prefetch_pool = ThreadPool(processes=1)
+        if self._threads > 1:
+            self._thread_pool = ThreadPool(processes=self._threads)
+        try:
+            for i, tod_id in enumerate(tod_ids):
+                if self._prefetch_pool:
+                    for next_id in tod_ids[i+1:i+1+self._prefetch]:
+                        self.prefetch(next_id)
+                self.process(tod_id)
+                self._prefetched.pop(tod_id, None)  # drop loads left by a veto
+        finally:
+            if self._prefetch_pool:
+                self._prefetch_pool.close()
+                self._prefetch_pool.join()
+                self._prefetch_pool = None
+            self._prefetched = {}
+            if self._thread_pool:
+                self._thread_pool.close()
+                self._thread_pool.join()
+                self._thread_pool = None
+
+    def prefetch(self, tod_id):
+        """Start loading the inputs of a TOD with all prefetchable routines
+        in the background, the results are picked up by fetch
+        @par:
+            tod_id: int"""
+        if tod_id in self._prefetched:
+            return
+        tod_name = self._tod_list[tod_id]
+        self._prefetched[tod_id] = dict(
+            (i, self._prefetch_pool.apply_async(routine.load, (tod_id, tod_name)))
+            for i, routine in enumerate(self._routines) if routine._prefetchable)
+
+    def fetch(self, routine):
+        """Return the inputs of the current TOD loaded by a prefetchable
+        routine, either from a background load or by loading it now
+        @par:
+            routine: Routine
+        @ret:
+            the object returned by routine.load"""
+        pending = self._prefetched.get(self._tod_id, {})
+        index = self._routines.index(routine)
+        if index in pending:
+            return pending.pop(index).get()  # wait for the background load
+        return routine.load(self._tod_id, self._tod_name)
+
+    def run(self, start=0, end=None, workers=1, state_dir=None, prefetch=0, threads=1, resume=False,
+            select=None):
         """Main driver function to run the loop
         @param:
-            start: starting tod_id
-            end:   ending tod_id"""
+            start:     starting tod_id
+            end:       ending tod_id, by default the end of the list
+            workers:   number of processes to spread the TODs over
+            state_dir: if given, save the partial state of each routine
+                       in this folder instead of finalizing, the partial
+                       results are combined later with reduce
+            prefetch:  number of TODs whose inputs are loaded ahead in
+                       the background, which is also the maximum number
+                       of TODs kept in memory besides the current one
+            threads:   number of threads to run independent branches of
+                       routines concurrently for each TOD, see
+                       get_dependencies for how the branches are found
+            resume:    skip the TODs that the manifest records as done or
+                       vetoed, unless the configuration has changed. Note
+                       that routines accumulating results across TODs only
+                       see the TODs processed in this run
+            select:    only run the TODs between start and end matching
+                       these criteria of TODIndex.select, for example
+                       {'array': 'ar4', 'ctime': (1500000000, 1501000000)},
+                       {'names': [...]} or {'ids': [...]}"""
 
-        self.initialize()
-        for tod_id in range(start, end):
-            if tod_id in self._skip_list:
+        if end is None:
+            end = len(self._tod_list)
+        if select:
+            tod_ids = self.get_index().select(start, end, **select)
+            print '[INFO] Selected %d TODs' % len(tod_ids)
+        else:
+            tod_ids = range(start, end)
+
+        skip_list = set(self._skip_list)
+        selected, tod_ids = tod_ids, []
+        for tod_id in selected:
+            if tod_id in skip_list:
                 print '[INFO] tod: %d in the skip_list, skipping ...' % tod_id
                 continue  # skip if in skip list
-            self._tod_id = tod_id
-            self._tod_name = self._tod_list[tod_id]
-            self.execute()
+            tod_ids.append(tod_id)
 
-        self.finalize()
+        if self._manifest:
+            if resume:
+                self._manifest.load(self.get_config())
+                completed = self._manifest.get_completed()
+                print '[INFO] Resuming, skipping %d completed TODs ...' % len(completed.intersection(tod_ids))
+                tod_ids = [tod_id for tod_id in tod_ids if tod_id not in completed]
+            else:
+                self._manifest.start(self.get_config())
+        elif resume:
+            print '[WARNING] No manifest enabled, nothing to resume from'
+
+        self._prefetch = prefetch
+        self._threads = threads
+        self.initialize()
+        if state_dir:
+            # save only what this run accumulates, reduce starts from
+            # the initial states
+            for routine in self._routines:
+                routine.reset_state()
+        if workers > 1:
+            self.run_parallel(tod_ids, workers)
+        else:
+            self.process_list(tod_ids)
+
+        if state_dir:
+            self.save_states(state_dir, start, end)
+        else:
+            self.finalize()
+        if self._profiler:
+            self._profiler.report(".%d_%d" % (start, end))
+
+    def run_parallel(self, tod_ids, workers):
+        """Process the TODs in a pool of worker processes and merge the
+        state of each routine back before finalize. The routines are
+        initialized in this process and forked into each worker, so
+        every worker has its own copy of the routines and data store.
+        @par:
+            tod_ids: [int]
+            workers: int"""
+        global _worker_loop
+        _worker_loop = self
+        # interleave the ids so that each worker sees a similar mix of TODs
+        chunks = [tod_ids[i::workers] for i in range(workers)]
+        print '[INFO] Running %d TODs with %d workers ...' % (len(tod_ids), workers)
+        # one chunk per process, a process reused for a second chunk
+        # would return the state accumulated over both chunks
+        pool = multiprocessing.Pool(processes=workers, maxtasksperchild=1)
+        try:
+            results = pool.map(_run_worker, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            _worker_loop = None
+            if self._manifest:
+                self._manifest.merge_parts()
+
+        # merge the partial results of each worker
+        for states, records in results:
+            for routine, state in zip(self._routines, states):
+                routine.merge_state(state)
+            if self._profiler:
+                self._profiler.add_records(records)
         
+    def save_states(self, state_dir, start, end):
+        """Save the partial state of each routine that has one
+        @par:
+            state_dir: string
+            start:     starting tod_id of this run
+            end:       ending tod_id of this run"""
+        if not os.path.exists(state_dir):
+            print '[INFO] Path %s does not exist, creating ...' % state_dir
+            os.makedirs(state_dir)
+        for i, routine in enumerate(self._routines):
+            if routine._state_keys:
+                filename = "%d.%s.%d_%d.state" % (i, routine.__class__.__name__, start, end)
+                routine.save_state(state_dir + filename)
+
+    def reduce(self, state_dir):
+        """Merge the partial states saved by runs with a state_dir and
+        finalize all routines, as if the loop had run over all TODs
+        @par:
+            state_dir: string"""
+        self.initialize()
+        for i, routine in enumerate(self._routines):
+            if not routine._state_keys:
+                continue
+            pattern = "%s%d.%s.*.state" % (state_dir, i, routine.__class__.__name__)
+            for filename in sorted(glob.glob(pattern)):
+                routine.load_state(filename)
+        self.finalize()
+
     def veto(self):
         """Veto a TOD from subsequent routines"""
-        self._veto = True
+        if self._dependencies and self._thread_pool:
+            self._local.veto = True  # only veto the routines depending on this one
+        else:
+            self._veto = True
+
+    def is_vetoed(self):
+        """Return True if the routine being executed has vetoed the TOD"""
+        if self._dependencies and self._thread_pool:
+            return getattr(self._local, 'veto', False)
+        return self._veto
     
     def get_id(self):
         """Return the index of current TOD in the list"""
@@ -82,9 +518,8 @@ class TODLoop:
         return self._tod_name
 
     def get_array(self):
-        """Return name of the TOD"""
-        # get metadata
-        return self._tod_name.split('.')[-1]
+        """Return the array of the TOD"""
+        return get_array(self._tod_name)
 
     def add_metadata(self, key, obj):
         """Add a metadata, which will be saved together with the output
@@ -108,10 +543,85 @@ class TODLoop:
             return self._metadata
 
 
+_worker_loop = None  # loop inherited by the worker processes of run_parallel
+
+
+def _run_worker(tod_ids):
+    """Process a chunk of TODs in a worker process of run_parallel
+    and return the state of each routine and the profiler records"""
+    loop = _worker_loop
+    loop._store.clear()  # start from an empty data store
+    if loop._profiler:
+        loop._profiler.reset()  # the parent keeps the records of initialize
+    if loop._manifest:
+        loop._manifest.use_part()  # workers save their own part of the manifest
+    for routine in loop._routines:
+        routine.reset_state()  # the parent merges what each worker adds to its own state
+    loop.process_list(tod_ids)
+    states = [routine.get_state() for routine in loop._routines]
+    records = loop._profiler.get_records() if loop._profiler else None
+    return states, records
+
+
+def describe_value(value):
+    """Describe a parameter of a routine with basic python types, large
+    arrays are replaced by a hash of their content"""
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [describe_value(v) for v in value]
+    if isinstance(value, dict):
+        return dict((str(k), describe_value(v)) for k, v in value.items())
+    if hasattr(value, 'tostring'):  # numpy arrays
+        return hashlib.md5(value.tostring()).hexdigest()
+    return value.__class__.__name__
+
+
+def empty_value(value):
+    """Return an accumulator with nothing accumulated, of the same kind
+    as value: numbers are 0, lists are empty, dicts have the empty value
+    of each item and objects providing an empty method (such as Hist1D)
+    are emptied with it"""
+    if value is None:
+        return None
+    if hasattr(value, 'empty'):
+        return value.empty()
+    if isinstance(value, dict):
+        return dict((key, empty_value(v)) for key, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return value[:0]
+    return value * 0
+
+
+def merge_values(value, other):
+    """Merge two partial results of an accumulator. Numbers are added,
+    lists are concatenated and objects providing a merge method (such
+    as Hist1D) are merged with it"""
+    if value is None:
+        return other
+    if other is None:
+        return value
+    if hasattr(value, 'merge'):
+        value.merge(other)
+        return value
+    if isinstance(value, dict):
+        for key in other:
+            value[key] = merge_values(value.get(key), other[key])
+        return value
+    return value + other
+
+
 class Routine:
     """A routine is a reusable unit of a particular algorithm,
     for example, it can be filtering algorithms that can be used
     in various studies."""
+    # attributes that accumulate results across TODs. Workers and runs
+    # with a state_dir start them from their empty value (see empty_value
+    # and reset_state) and only the results they add are merged into the
+    # state after initialize, so initial values are counted once
+    _state_keys = []
+    _prefetchable = False  # True for loaders implementing load
+
     def __init__(self):
         self._context = None
 
@@ -129,6 +639,94 @@ class Routine:
         a good place to close opened files or connection if any."""
         pass
     
+    def get_keys(self):
+        """Return the keys given to the routine (attributes ending with
+        _key, a key or a list of keys), the ones with output in their
+        names are written
+        @ret:
+            reads:  set of keys read
+            writes: set of keys written"""
+        reads, writes = set(), set()
+        for name, value in vars(self).items():
+            if not name.endswith('_key'):
+                continue
+            if isinstance(value, str):
+                value = [value]
+            elif not isinstance(value, (list, tuple)):
+                continue
+            keys = set(key for key in value if isinstance(key, str))
+            if 'output' in name:
+                writes |= keys
+            else:
+                reads |= keys
+        return reads, writes
+
+    def get_config(self):
+        """Return the parameters of the routine (its attributes, except
+        the ones accumulating results) as basic python types, used to
+        tell whether a routine has been configured differently"""
+        params = {}
+        for name, value in vars(self).items():
+            if name in self._state_keys or name == '_context':
+                continue
+            params[name] = describe_value(value)
+        name = "%s.%s" % (self.__class__.__module__, self.__class__.__name__)
+        return {'routine': name, 'params': params}
+
+    def load(self, tod_id, tod_name):
+        """Load the inputs of a TOD without touching the data store, so
+        that the loop can call it in a background thread ahead of time.
+        Only called for routines with _prefetchable = True, others load
+        nothing ahead.
+        @par:
+            tod_id:   int
+            tod_name: string
+        @ret:
+            the loaded object, passed to execute through fetch"""
+        return None
+
+    def fetch(self):
+        """A short cut to calling the fetch of parent pipeline, which
+        returns the result of load for the current TOD"""
+        return self.get_context().fetch(self)
+
+    def get_state(self):
+        """Return the partial results accumulated so far, which are
+        the attributes listed in _state_keys"""
+        return dict((key, getattr(self, key)) for key in self._state_keys)
+
+    def reset_state(self):
+        """Empty the partial results, before accumulating results to be
+        merged into another instance of the routine"""
+        for key in self._state_keys:
+            setattr(self, key, empty_value(getattr(self, key)))
+
+    def merge_state(self, other):
+        """Merge the partial results from another instance of the same
+        routine into this one
+        @par:
+            other: Routine or its state as returned by get_state"""
+        if isinstance(other, Routine):
+            other = other.get_state()
+        for key in other:
+            setattr(self, key, merge_values(getattr(self, key), other[key]))
+
+    def save_state(self, path):
+        """Save the partial results to a file
+        @par:
+            path: string"""
+        with open(path, "w") as f:
+            cPickle.dump(self.get_state(), f, cPickle.HIGHEST_PROTOCOL)
+            print '[INFO] State saved: %s' % path
+
+    def load_state(self, path):
+        """Merge the partial results saved in a file by save_state
+        @par:
+            path: string"""
+        with open(path, "r") as f:
+            self.merge_state(cPickle.load(f))
+            print '[INFO] State loaded: %s' % path
+
     def veto(self):
         """Prevent the TOD to be processed by other routines (stopped
         the pipeline for the TOD currently running. It's useful for
@@ -158,15 +756,53 @@ class Routine:
         return self.get_context().get_name()
     
     def get_array(self):
-        tod_name = self.get_context().get_name()
-        array_name = tod_name.split(".")[-2]
-        return array_name 
+        """A short cut to calling the get_array of parent pipeline"""
+        return self.get_context().get_array()
+
+def estimate_size(obj, depth=4):
+    """Roughly estimate the memory used by an object in bytes, counting
+    the numpy arrays held in dicts, lists and object attributes (such as
+    the data of a moby2 TOD) up to a given depth
+    @par:
+        obj:   any object
+        depth: int - levels of containers to look into
+    @ret:
+        int"""
+    if hasattr(obj, 'nbytes'):
+        return obj.nbytes
+    if depth == 0:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sum(estimate_size(value, depth-1) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_size(value, depth-1) for value in obj)
+    if hasattr(obj, '__dict__') and not callable(obj):
+        return sum(estimate_size(value, depth-1) for value in vars(obj).values())
+    return sys.getsizeof(obj)
+
 
 class DataStore:
     """Cache class for event loop"""
     def __init__(self):
         self._store = {}
-    
+        self._lock = threading.RLock()  # routines may run in several threads
+        self._local = threading.local()  # index of the routine run by each thread
+        self._release = False  # release keys after their last reader
+        self._learned = False  # True once the keys used by all routines in a TOD are known
+        self._consumers = {}  # {key: set of indexes of routines that use the key}
+        self._finished = set()  # routines executed in this TOD
+        self._readers = {}  # {key: set of routines that read the key in this TOD}
+        self._writers = {}  # {key: set of routines that wrote the key in this TOD}
+        self._seen_reads = {}  # {routine index: set of keys read}
+        self._seen_writes = {}  # {routine index: set of keys written}
+        self._budget = None  # memory budget in bytes
+        self._scratch_dir = None  # folder to spill objects to when over budget
+        self._sizes = {}  # {key: estimated size in bytes}
+        self._spilled = {}  # {key: path of the scratch file}
+        self._access = {}  # {key: order of the last access}
+        self._n_access = 0
+        self._derived = {}  # {key: object it was built from}, for the current TOD
+
     def get(self, key):
         """Retrieve an object based on a key
         @par:
@@ -174,10 +810,15 @@ class DataStore:
         @ret:   
             Object of an arbitrary type associated with the key
             or None if no object is associated with the key"""
-        if key in self._store:
-            return self._store[key]
-        else:
-            return None
+        with self._lock:
+            self._record(self._readers, key)
+            if key in self._spilled:
+                self.restore(key)
+            if key in self._store:
+                self._touch(key)
+                return self._store[key]
+            else:
+                return None
     
     def set(self, key, obj):
         """Save an object with a key
@@ -185,4 +826,186 @@ class DataStore:
             key: str
             obj: a object of arbitrary type
         @ret: nil"""
-        self._store[key] = obj
+        with self._lock:
+            self._record(self._writers, key)
+            old = self._store.get(key)
+            for derived_key, source in self._derived.items():
+                if source is old or source is obj:  # replaced or changed in place
+                    del self._derived[derived_key]
+                    self.delete(derived_key)
+            self.delete(key)  # drop the old object and its scratch file if any
+            self._store[key] = obj
+            self._touch(key)
+            if self._budget is not None:
+                self._sizes[key] = estimate_size(obj)
+                self.spill(keep=key)
+
+    def get_derived(self, key, source, build):
+        """Retrieve an object built from another one, e.g. an index, and
+        build it with build(source) if it hasn't been built from the same
+        source in this TOD yet. The object is saved under key until the
+        end of the TOD, so routines running in several threads share it.
+        A source changed in place has to be set again to be rebuilt. As a
+        cache, the key is not counted as read or written by the routines.
+        @par:
+            key:    str
+            source: object the derived object is built from
+            build:  function of source
+        @ret:
+            the derived object"""
+        with self._lock:
+            if self._derived.get(key) is source:
+                if key in self._spilled:
+                    self.restore(key)
+                if key in self._store:
+                    self._touch(key)
+                    return self._store[key]
+            obj = build(source)
+            routine = getattr(self._local, 'routine', None)
+            self._local.routine = None  # not recorded
+            try:
+                self.set(key, obj)
+            finally:
+                self._local.routine = routine
+            self._derived[key] = source
+            return obj
+
+    def peek(self, key):
+        """Retrieve an object in memory without recording the access
+        @par:
+            key: str
+        @ret:
+            the object or None if it's not in memory"""
+        return self._store.get(key)
+
+    def delete(self, key):
+        """Remove an object from the store
+        @par:
+            key: str"""
+        with self._lock:
+            self._store.pop(key, None)
+            self._sizes.pop(key, None)
+            self._access.pop(key, None)
+            if key in self._spilled:
+                os.remove(self._spilled.pop(key))
+
+    def clear(self):
+        """Remove all objects from the store"""
+        with self._lock:
+            for key in self._store.keys() + self._spilled.keys():
+                self.delete(key)
+
+    def enable_release(self, consumers):
+        """Release each key once all the routines using it have been
+        executed for the current TOD. Keys read by routines that are
+        not given here are learned from the calls to get in each TOD
+        that is processed by all routines, so nothing is released before
+        a first TOD has been processed by all routines.
+        @par:
+            consumers: {key: set of indexes of the routines using the key}"""
+        self._release = True
+        self._consumers = consumers
+
+    def set_budget(self, budget, scratch_dir):
+        """Spill the least recently used objects to scratch files when
+        the objects in memory take more than a budget
+        @par:
+            budget:      int - memory budget in bytes
+            scratch_dir: string - folder for the scratch files"""
+        if not os.path.exists(scratch_dir):
+            print '[INFO] Path %s does not exist, creating ...' % scratch_dir
+            os.makedirs(scratch_dir)
+        self._budget = budget
+        self._scratch_dir = scratch_dir
+
+    def get_accesses(self):
+        """Return the keys each routine has been seen to read and write
+        in the TODs processed by all routines
+        @ret:
+            reads:  {routine index: set of keys}
+            writes: {routine index: set of keys}"""
+        return self._seen_reads, self._seen_writes
+
+    def begin_routine(self, index):
+        """Called by the loop before a routine is executed
+        @par:
+            index: int - index of the routine in the loop"""
+        self._local.routine = index
+
+    def end_routine(self, index):
+        """Called by the loop after a routine is executed, releases the
+        keys that no remaining routine uses
+        @par:
+            index: int - index of the routine in the loop"""
+        self._local.routine = None
+        with self._lock:
+            self._finished.add(index)
+            if not (self._release and self._learned):
+                return
+            for key in self._store.keys() + self._spilled.keys():
+                if key in self._consumers and self._consumers[key] <= self._finished:
+                    self.delete(key)
+
+    def end_tod(self, complete):
+        """Called by the loop after all routines are executed for a TOD
+        @par:
+            complete: bool - False if the TOD was vetoed by a routine"""
+        if complete:  # only learn from TODs seen by all routines
+            for accesses, seen in [(self._readers, self._seen_reads),
+                                   (self._writers, self._seen_writes)]:
+                for key, routines in accesses.items():
+                    for i in routines:
+                        seen.setdefault(i, set()).add(key)
+                    if self._release:
+                        self._consumers.setdefault(key, set()).update(routines)
+            self._learned = True
+        if self._release:
+            self.clear()  # nothing is kept across TODs
+        for key in self._derived:
+            self.delete(key)  # built from the objects of this TOD
+        self._derived = {}
+        self._readers = {}
+        self._writers = {}
+        self._finished = set()
+
+    def _record(self, accesses, key):
+        routine = getattr(self._local, 'routine', None)
+        if routine is not None:
+            accesses.setdefault(key, set()).add(routine)
+
+    def spill(self, keep=None):
+        """Write the least recently used objects to scratch files until
+        the objects in memory fit in the budget
+        @par:
+            keep: str - key that should stay in memory"""
+        in_memory = sorted(self._store, key=lambda k: self._access[k])
+        for key in in_memory:
+            if sum(self._sizes.get(k, 0) for k in self._store) <= self._budget:
+                break
+            if key == keep:
+                continue
+            path = "%s%d.%s.pickle" % (self._scratch_dir, os.getpid(), key)
+            try:
+                with open(path, "w") as f:
+                    cPickle.dump(self._store[key], f, cPickle.HIGHEST_PROTOCOL)
+            except (cPickle.PicklingError, TypeError):  # e.g. functions
+                os.remove(path)
+                continue
+            print '[INFO] Spilled %s to %s' % (key, path)
+            del self._store[key]
+            self._spilled[key] = path
+
+    def restore(self, key):
+        """Load a spilled object back into memory
+        @par:
+            key: str"""
+        path = self._spilled.pop(key)
+        with open(path, "r") as f:
+            self._store[key] = cPickle.load(f)
+        os.remove(path)
+        self._touch(key)
+        self.spill(keep=key)
+
+    def _touch(self, key):
+        self._n_access += 1
+        self._access[key] = self._n_access
@@ -0,0 +1,165 @@
+import os
+import json
+import inspect
+import hashlib
+import cPickle
+from todloop.base import Routine
+
+
+class CachedRoutine(Routine):
+    """A wrapper that caches the outputs of a routine on disk. If an
+    entry is found, the outputs are loaded instead of running the
+    routine, including its veto decision. An entry is keyed by:
+    - the name of the TOD
+    - the parameters of the routine and the source code of its class
+      (and an optional _version attribute of the class)
+    - the same for the earlier routines writing its input keys, and the
+      ones writing their inputs in turn (all the earlier routines if one
+      of the input keys isn't declared by any of them)
+    The content of the inputs isn't read, so the cache doesn't notice
+    when files read by the upstream loaders change: clear the cache
+    folder (or set a _version) in that case.
+
+    On a cache hit, execute isn't called, so only the outputs and the
+    veto are restored: the other side effects of the routine for the TOD
+    (files or plots saved, results accumulated in _state_keys) don't
+    happen. Only wrap routines whose result for a TOD is their outputs.
+
+    Example:
+        loop.add_routine(CachedRoutine(FindCosigs(input_key="cuts", output_key="cosig"),
+                                       cache_dir="outputs/cache/find_cosigs/",
+                                       output_keys=["cosig", "nsamps"]))
+    """
+    def __init__(self, routine, cache_dir, input_keys=None, output_keys=None):
+        """
+        :param routine: Routine - the routine to cache
+        :param cache_dir: string - folder to store the cached outputs
+        :param input_keys: [string] - keys read by the routine, by default
+                           the keys given to the routine
+        :param output_keys: [string] - keys written by the routine, by
+                            default the output keys given to the routine
+        """
+        Routine.__init__(self)
+        self._routine = routine
+        self._cache_dir = cache_dir
+        reads, writes = routine.get_keys()
+        self._input_keys = sorted(input_keys or reads)
+        self._output_keys = sorted(output_keys or writes)
+        # the routine is described before it changes itself in initialize
+        self._routine_hash = hash_routine(routine)
+        self._upstream_hash = None
+        if routine._state_keys:
+            print '[WARNING] Results accumulated by %s are skipped on cache hits' % routine.__class__.__name__
+
+    @property
+    def _state_keys(self):
+        # the loop saves and reduces the states of routines with state keys
+        return self._routine._state_keys
+
+    def add_context(self, context):
+        Routine.add_context(self, context)
+        self._routine.add_context(context)
+        # the routines added before this one, not initialized yet
+        routines = context._routines
+        upstream = routines[:routines.index(self)] if self in routines else routines
+        self._upstream_hash = hash_upstream(upstream, self._input_keys)
+
+    def initialize(self):
+        if not os.path.exists(self._cache_dir):
+            print '[INFO] Path %s does not exist, creating ...' % self._cache_dir
+            os.makedirs(self._cache_dir)
+        self._routine.initialize()
+
+    def execute(self):
+        store = self.get_store()
+        entry_hash = hashlib.md5(self._routine_hash + self._upstream_hash + self.get_name()).hexdigest()
+        filepath = "%s%s.pickle" % (self._cache_dir, entry_hash)
+        name = self._routine.__class__.__name__
+
+        if os.path.isfile(filepath):
+            with open(filepath, "r") as f:
+                entry = cPickle.load(f)
+            print '[INFO] Cache hit for %s: %s' % (name, filepath)
+            for key, obj in entry['outputs'].items():
+                store.set(key, obj)
+            if entry['veto']:
+                self.veto()
+            return
+
+        self._routine.execute()
+        entry = {
+            'outputs': dict((key, store.get(key)) for key in self._output_keys),
+            'veto': self.get_context().is_vetoed(),
+        }
+        with open(filepath + ".tmp", "w") as f:
+            cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(filepath + ".tmp", filepath)
+        print '[INFO] Cached outputs of %s: %s' % (name, filepath)
+
+    def finalize(self):
+        self._routine.finalize()
+
+    def get_keys(self):
+        return set(self._input_keys), set(self._output_keys)
+
+    def get_config(self):
+        config = self._routine.get_config()
+        config['cache_dir'] = self._cache_dir
+        return config
+
+    def get_state(self):
+        return self._routine.get_state()
+
+    def reset_state(self):
+        self._routine.reset_state()
+
+    def merge_state(self, other):
+        if isinstance(other, CachedRoutine):
+            other = other.get_state()
+        self._routine.merge_state(other)
+
+
+def hash_routine(routine):
+    """Hash the parameters of a routine and the source code of its
+    classes, so that changing either invalidates the cache"""
+    sources = []
+    for cls in inspect.getmro(routine.__class__):
+        if cls is Routine:
+            break
+        try:
+            sources.append(inspect.getsource(cls))
+        except (IOError, TypeError):  # source not available
+            sources.append(cls.__name__)
+    description = {
+        'config': routine.get_config(),
+        'version': getattr(routine, '_version', None),
+        'source': hashlib.md5(''.join(sources)).hexdigest(),
+    }
+    return hashlib.md5(json.dumps(description, sort_keys=True)).hexdigest()
+
+
+def hash_upstream(routines, keys):
+    """Hash the routines that the inputs of a routine come from: the
+    routines writing its input keys, the ones writing their input keys
+    and so on. Routines that declare no keys may write anything, so
+    they're included as well, and all routines are if a key isn't
+    written by any of them.
+    @par:
+        routines: [Routine] - the routines running before, in order
+        keys:     [string] - input keys of the routine"""
+    keys = set(keys)
+    hashes = []
+    for routine in reversed(routines):
+        reads, writes = routine.get_keys()
+        if writes & keys or not (reads or writes):
+            hashes.append(get_routine_hash(routine))
+            keys = (keys - writes) | reads
+    if keys:  # written by routines that don't declare them
+        hashes = [get_routine_hash(routine) for routine in reversed(routines)]
+    return hashlib.md5(''.join(hashes)).hexdigest()
+
+
+def get_routine_hash(routine):
+    if isinstance(routine, CachedRoutine):
+        return routine._routine_hash
+    return hash_routine(routine)
@@ -4,6 +4,7 @@ import moby2
 
 
 class NPixelFilter(Routine):
+    _state_keys = ['_events_passed', '_events_processed']
     def __init__(self, min_pixels=0, max_pixels=100, input_key="events", output_key="events"):
         """Scripts that run during initialization of the routine"""
         Routine.__init__(self)
@@ -35,6 +36,7 @@ class NPixelFilter(Routine):
 
         
 class DurationFilter(Routine):
+    _state_keys = ['_events_passed', '_events_processed']
     def __init__(self, min_duration=1, max_duration=100, input_key="events", output_key="events"):
         """Scripts that run during initialization of the routine"""
         Routine.__init__(self)
@@ -66,6 +68,7 @@ class DurationFilter(Routine):
         
 
 class CoeffFilter(Routine):
+    _state_keys = ['_events_passed', '_events_processed']
     def __init__(self, min_coeff=0.8, max_coeff=1, input_key="events", output_key="events"):
         """Filter events based on coefficient"""
         Routine.__init__(self)
@@ -0,0 +1,145 @@
+import os
+import re
+import numpy as np
+
+
+INDEX_VERSION = 2  # increase when the content of the index files changes, e.g. get_array
+
+
+class TODIndex:
+    """An index of a list of TODs mapping each tod_id to the name, array,
+    starting ctime and season of the TOD, so that a subset of the list
+    can be selected without going through every TOD. It is built once
+    from the list and saved next to it in binary (.npz) form."""
+    def __init__(self, names, season=None):
+        """
+        :param names: [string] - names (or paths) of the TODs, in the order
+                      of the list, the tod_id being the position in the list
+        :param season: string - season of the TODs such as 's16'
+        """
+        basenames = [os.path.basename(name) for name in names]
+        self._names = np.array(names)
+        self._arrays = np.array([get_array(name) for name in basenames])
+        self._ctimes = np.array([get_ctime(name) for name in basenames], dtype=np.int64)
+        self._seasons = np.array([season or ''] * len(names))
+        self._ids = None  # {name: tod_id}, built when first needed
+
+    @classmethod
+    def from_list(cls, tod_list_dir, season=None):
+        """Load the index of a TOD list, building and saving it if the
+        list is newer than the saved index
+        :param tod_list_dir: string - path of the list of TODs
+        :param season: string - season of the TODs, by default taken from
+                       the name of the list such as s16_pa3_list.txt"""
+        index_path = tod_list_dir + ".index.npz"
+        if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(tod_list_dir):
+            try:
+                return cls.load(index_path)
+            except IOError as e:
+                print '[INFO] %s, rebuilding ...' % e
+        with open(tod_list_dir, "r") as f:
+            names = [line.split('\n')[0] for line in f.readlines()]
+        if season is None:
+            match = re.match(r'(s\d\d)_', os.path.basename(tod_list_dir))
+            season = match.group(1) if match else None
+        index = cls(names, season)
+        try:
+            index.save(index_path)
+        except (IOError, OSError) as e:
+            print '[WARNING] Cannot save the TOD index %s: %s' % (index_path, e)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save
+        :param path: string - path of the .npz file"""
+        index = cls([])
+        with np.load(path) as data:
+            version = int(data['version']) if 'version' in data.files else 1
+            if version != INDEX_VERSION:
+                raise IOError("TOD index %s has version %d instead of %d" % (path, version, INDEX_VERSION))
+            index._names = data['names']
+            index._arrays = data['arrays']
+            index._ctimes = data['ctimes']
+            index._seasons = data['seasons']
+        return index
+
+    def save(self, path):
+        """Save the index in binary form
+        :param path: string - path of the .npz file"""
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, version=INDEX_VERSION, names=self._names, arrays=self._arrays,
+                     ctimes=self._ctimes, seasons=self._seasons)
+        os.rename(path + ".tmp", path)
+        print '[INFO] TOD index saved: %s' % path
+
+    def __len__(self):
+        return len(self._names)
+
+    def get_name(self, tod_id):
+        return self._names[tod_id]
+
+    def get_array(self, tod_id):
+        return self._arrays[tod_id]
+
+    def get_ctime(self, tod_id):
+        return self._ctimes[tod_id]
+
+    def get_season(self, tod_id):
+        return self._seasons[tod_id] or None
+
+    def get_id(self, name):
+        """Return the tod_id of a TOD name, or None if not in the list"""
+        if self._ids is None:
+            self._ids = {}
+            for tod_id, tod_name in enumerate(self._names):
+                self._ids[os.path.basename(tod_name)] = tod_id
+        return self._ids.get(os.path.basename(name))
+
+    def select(self, start=0, end=None, array=None, ctime=None, season=None, names=None, ids=None):
+        """Return the tod_ids, in increasing order, matching all the given
+        criteria
+        :param start: int - first tod_id
+        :param end: int - tod_id after the last one, by default the end
+                    of the list
+        :param array: string or [string] - arrays such as 'ar4'
+        :param ctime: (int, int) - starting ctime window, end excluded
+        :param season: string or [string] - seasons such as 's16'
+        :param names: [string] - names of the TODs
+        :param ids: [int] - tod_ids
+        :return: [int]"""
+        mask = np.zeros(len(self), dtype=bool)
+        mask[start:end] = True
+        if array is not None:
+            mask &= np.in1d(self._arrays, np.atleast_1d(array))
+        if ctime is not None:
+            mask &= (self._ctimes >= ctime[0]) & (self._ctimes < ctime[1])
+        if season is not None:
+            mask &= np.in1d(self._seasons, np.atleast_1d(season))
+        if names is not None:
+            selected = np.zeros(len(self), dtype=bool)
+            tod_ids = [self.get_id(name) for name in names]
+            selected[[tod_id for tod_id in tod_ids if tod_id is not None]] = True
+            mask &= selected
+        if ids is not None:
+            selected = np.zeros(len(self), dtype=bool)
+            selected[[tod_id for tod_id in ids if 0 <= tod_id < len(self)]] = True
+            mask &= selected
+        return [int(tod_id) for tod_id in np.nonzero(mask)[0]]
+
+
+def get_ctime(tod_name):
+    """Return the starting ctime in the name of a TOD such as
+    1463475576.1463485804.ar3, or -1 if the name has no ctime"""
+    try:
+        return int(tod_name.split('.')[0])
+    except ValueError:
+        return -1
+
+
+def get_array(tod_name):
+    """Return the array in the name of a TOD such as
+    1463475576.1463485804.ar3, the name can end with .zip"""
+    if tod_name.endswith('.zip'):
+        tod_name = tod_name[:-len('.zip')]
+    return tod_name.split('.')[-1]
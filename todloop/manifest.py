@@ -0,0 +1,108 @@
+import os
+import glob
+import json
+import hashlib
+
+
+class Manifest:
+    """A record of the TODs processed by a run of TODLoop, saved after each
+    TOD so that a run that dies can be resumed where it stopped. Each TOD
+    is either done, vetoed or failed. The configuration of the routines
+    is saved as well, so that a resumed run with a different configuration
+    starts over."""
+    def __init__(self, path):
+        """
+        :param path: string - path of the manifest file
+        """
+        self._path = path
+        self._config = None
+        self._config_hash = None
+        self._tods = {}  # {tod_id: status}
+        self._part = None  # path of the part file of a worker process
+
+    def load(self, config):
+        """Load the manifest saved by a previous run, including the part
+        files left by worker processes. The previous records are dropped
+        if they were made with a different configuration.
+        :param config: dict - configuration of the loop"""
+        self.start(config)
+        paths = [self._path] + sorted(glob.glob(self._path + ".part.*"))
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            with open(path, "r") as f:
+                saved = json.load(f)
+            if saved['config_hash'] != self._config_hash:
+                print '[WARNING] Configuration changed since %s, starting over' % path
+                continue
+            for tod_id, status in saved['tods'].items():
+                self._tods[int(tod_id)] = status
+        print '[INFO] Manifest loaded: %d TODs completed' % len(self.get_completed())
+
+    def start(self, config):
+        """Start a new manifest without the records of previous runs
+        :param config: dict - configuration of the loop"""
+        self._config = config
+        self._config_hash = hash_config(config)
+        self._tods = {}
+        folder = os.path.dirname(self._path)
+        if folder and not os.path.exists(folder):
+            print '[INFO] Path %s does not exist, creating ...' % folder
+            os.makedirs(folder)
+
+    def record(self, tod_id, status):
+        """Record the status of a TOD and save the manifest
+        :param tod_id: int
+        :param status: string - done, vetoed or failed"""
+        self._tods[tod_id] = status
+        self.save()
+
+    def get_status(self, tod_id):
+        return self._tods.get(tod_id)
+
+    def get_completed(self):
+        """Return the ids of TODs that are done or vetoed"""
+        return set(tod_id for tod_id, status in self._tods.items()
+                   if status in ('done', 'vetoed'))
+
+    def get_failed(self):
+        return set(tod_id for tod_id, status in self._tods.items() if status == 'failed')
+
+    def use_part(self):
+        """Save to a part file of this process instead of the manifest,
+        used by worker processes which run at the same time"""
+        self._part = "%s.part.%d" % (self._path, os.getpid())
+        self._tods = {}
+
+    def merge_parts(self):
+        """Merge the part files of the worker processes into the manifest"""
+        for path in sorted(glob.glob(self._path + ".part.*")):
+            with open(path, "r") as f:
+                saved = json.load(f)
+            if saved['config_hash'] == self._config_hash:
+                for tod_id, status in saved['tods'].items():
+                    self._tods[int(tod_id)] = status
+        self.save()
+        for path in glob.glob(self._path + ".part.*"):
+            os.remove(path)
+
+    def save(self):
+        """Save the manifest atomically, a crash while saving leaves the
+        previous version intact"""
+        path = self._part or self._path
+        manifest = {
+            'config': self._config,
+            'config_hash': self._config_hash,
+            'tods': dict((str(tod_id), status) for tod_id, status in self._tods.items()),
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)  # atomic on posix
+
+
+def hash_config(config):
+    """Return a hash of a configuration made of basic python types"""
+    return hashlib.md5(json.dumps(config, sort_keys=True)).hexdigest()
@@ -0,0 +1,140 @@
+import os
+import csv
+import json
+import time
+import resource
+
+
+def get_rss():
+    """Return the resident memory of this process in bytes"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:  # no procfs, use the peak memory instead
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_cpu_time():
+    """Return the user + system cpu time of this process in seconds"""
+    t = os.times()
+    return t[0] + t[1]
+
+
+def count_items(obj):
+    """Count the items in an object of the data store, the peaks of
+    a dictionary of coincident signals or the length of a list of events
+    @ret:
+        int or None if the object has no length"""
+    if isinstance(obj, dict) and 'peaks' in obj:
+        return len(obj['peaks'])
+    if isinstance(obj, (list, tuple, dict)):
+        return len(obj)
+    return None
+
+
+class Profiler:
+    """Record the wall time, cpu time, memory change and number of items
+    processed by each routine of a TODLoop"""
+    columns = ['tod_id', 'tod_name', 'index', 'routine', 'stage', 'wall_time',
+               'cpu_time', 'rss_delta', 'items_in', 'items_out']
+
+    def __init__(self, output_dir):
+        """
+        :param output_dir: string - folder to write the report to
+        """
+        self._output_dir = output_dir
+        self._records = []
+
+    def call(self, loop, index, stage, func, reads=(), writes=()):
+        """Call a method of a routine and record its cost
+        :param loop:   TODLoop
+        :param index:  int - index of the routine
+        :param stage:  string - initialize, execute or finalize
+        :param func:   the method to call
+        :param reads:  [string] - keys read by the routine
+        :param writes: [string] - keys written by the routine"""
+        store = loop.get_store()
+        items_in = self.count(store, reads)
+        rss, cpu, wall = get_rss(), get_cpu_time(), time.time()
+        try:
+            return func()
+        finally:
+            record = {
+                'tod_id': loop.get_id() if stage == 'execute' else None,
+                'tod_name': loop.get_name() if stage == 'execute' else None,
+                'index': index,
+                'routine': loop._routines[index].__class__.__name__,
+                'stage': stage,
+                'wall_time': time.time() - wall,
+                'cpu_time': get_cpu_time() - cpu,  # includes other threads
+                'rss_delta': get_rss() - rss,
+                'items_in': items_in,
+                'items_out': self.count(store, writes),
+            }
+            self._records.append(record)
+
+    def count(self, store, keys):
+        counts = [count_items(store.peek(key)) for key in keys]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+
+    def reset(self):
+        self._records = []
+
+    def get_records(self):
+        return self._records
+
+    def add_records(self, records):
+        """Add the records of another profiler, such as a worker's"""
+        self._records.extend(records)
+
+    def summarize(self, n_slowest=10):
+        """Summarize the records by routine and by TOD
+        :param n_slowest: int - number of slowest TODs to report
+        :return: dict"""
+        routines = {}
+        tods = {}
+        for r in self._records:
+            name = "%d.%s" % (r['index'], r['routine'])
+            entry = routines.setdefault(name, {'calls': 0, 'wall_time': 0.,
+                                               'cpu_time': 0., 'max_wall_time': 0.,
+                                               'max_rss_delta': 0})
+            entry['calls'] += 1
+            entry['wall_time'] += r['wall_time']
+            entry['cpu_time'] += r['cpu_time']
+            entry['max_wall_time'] = max(entry['max_wall_time'], r['wall_time'])
+            entry['max_rss_delta'] = max(entry['max_rss_delta'], r['rss_delta'])
+            if r['stage'] == 'execute':
+                tods[r['tod_id']] = tods.get(r['tod_id'], 0.) + r['wall_time']
+
+        for entry in routines.values():
+            entry['mean_wall_time'] = entry['wall_time'] / entry['calls']
+        slowest_routines = sorted(routines, key=lambda k: -routines[k]['wall_time'])
+        slowest_tods = sorted(tods, key=lambda k: -tods[k])[:n_slowest]
+        return {
+            'routines': routines,
+            'slowest_routines': slowest_routines,
+            'slowest_tods': [[tod_id, tods[tod_id]] for tod_id in slowest_tods],
+        }
+
+    def report(self, tag=""):
+        """Write the records to a csv file and the summary to a json file
+        in the output folder, and print the slowest routines
+        :param tag: string - appended to the file names"""
+        if not os.path.exists(self._output_dir):
+            print '[INFO] Path %s does not exist, creating ...' % self._output_dir
+            os.makedirs(self._output_dir)
+        csv_path = "%sprofile%s.csv" % (self._output_dir, tag)
+        with open(csv_path, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(self._records)
+        summary = self.summarize()
+        json_path = "%sprofile%s.json" % (self._output_dir, tag)
+        with open(json_path, "w") as f:
+            json.dump(summary, f, indent=1)
+        print '[INFO] Profile saved: %s, %s' % (csv_path, json_path)
+        for name in summary['slowest_routines']:
+            entry = summary['routines'][name]
+            print '[INFO] %s: total %.2f s, mean %.3f s, max %.3f s over %d calls' % (
+                name, entry['wall_time'], entry['mean_wall_time'], entry['max_wall_time'], entry['calls'])
@@ -1,5 +1,6 @@
 import os
 from todloop.base import Routine
+from todloop.utils.snippets import SnippetStore
 import cPickle
 import pprint
 
@@ -17,9 +18,13 @@ class OutputRoutine(Routine):
 
     def save_data(self, data):
         tod_id = self.get_context().get_id()
-        with open(self._output_dir+str(tod_id)+".pickle", "w") as f:
+        filepath = self._output_dir+str(tod_id)+".pickle"
+        # write to a temporary file first so that a job killed while
+        # saving doesn't leave a truncated pickle behind
+        with open(filepath+".tmp", "w") as f:
             cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
-            print '[INFO] Data saved: %s' % self._output_dir+str(tod_id)+".pickle"
+        os.rename(filepath+".tmp", filepath)
+        print '[INFO] Data saved: %s' % filepath
 
     def save_figure(self, fig):
         tod_id = self.get_context().get_id()
@@ -62,6 +67,8 @@ class Logger(Routine):
 
 class DataLoader(Routine):
     """A routine that load the saved coincident signals"""
+    _prefetchable = True
+
     def __init__(self, input_dir=None, postfix="pickle", output_key="data"):
         """
         :param input_dir:  string
@@ -76,22 +83,26 @@ class DataLoader(Routine):
     def initialize(self):
         self.load_metadata()
 
+    def load(self, tod_id, tod_name):
+        """Load the file of a given TOD, return None if it's not found"""
+        filepath = "%s%s.%s" % (self._input_dir, tod_id, self._postfix)
+        if not os.path.isfile(filepath):
+            print '[WARNING] Not found: %s, skipping ...' % filepath
+            return None
+        with open(filepath, "r") as f:
+            data = cPickle.load(f)
+            print '[INFO] Fetched: %s' % filepath
+        if not data:  # check if data is None
+            print '[WARNING] Data is None, skipping ...'
+        return data
+
     def execute(self):
         """A function that fetch a batch of files in order"""
-        i = self.get_id()
-        filepath = "%s%s.%s" % (self._input_dir, i, self._postfix)
-        if os.path.isfile(filepath):
-            with open(filepath, "r") as f:
-                data = cPickle.load(f)
-                print '[INFO] Fetched: %s' % filepath
-                if data:  # check if data is None
-                    self.get_store().set(self._output_key, data)
-                else:  # data is None
-                    print '[WARNING] Data is None, skipping ...'
-                    self.veto()  # skipping
-        else:
-            print '[WARNING] Not found: %s, skipping ...' % filepath
-            self.veto()
+        data = self.fetch()  # prefetched in the background if enabled
+        if data:
+            self.get_store().set(self._output_key, data)
+        else:  # file not found or data is None
+            self.veto()  # skipping
 
     def load_metadata(self):
         """Load metadata if there is one"""
@@ -104,3 +115,24 @@ class DataLoader(Routine):
 
     def get_metadata(self):
         return self._metadata
+
+
+class SnippetLoader(DataLoader):
+    """A routine that loads the snippets saved by SaveSnippets as a
+    SnippetStore, which routines can use in place of tod_data"""
+    def __init__(self, input_dir=None, output_key="tod_data"):
+        """
+        :param input_dir:  string
+        :param output_key: string - key used to store the snippets
+        """
+        DataLoader.__init__(self, input_dir=input_dir, postfix="npz", output_key=output_key)
+
+    def load(self, tod_id, tod_name):
+        """Load the snippets of a given TOD, return None if not found"""
+        filepath = "%s%s.%s" % (self._input_dir, tod_id, self._postfix)
+        if not os.path.isfile(filepath):
+            print '[WARNING] Not found: %s, skipping ...' % filepath
+            return None
+        snippets = SnippetStore(filepath)
+        print '[INFO] Fetched: %s' % filepath
+        return snippets
@@ -5,6 +5,8 @@ import pandas as pd
 
 
 class TODLoader(Routine):
+    _prefetchable = True
+
     def __init__(self, output_key="tod_data", abspath=False):
         """
         A routine that loads the TOD and save it to a key
@@ -19,15 +21,19 @@ class TODLoader(Routine):
     def initialize(self):
         self._fb = get_filebase()
 
-    def execute(self):
+    def load(self, tod_id, tod_name):
+        """Load the TOD with a given name"""
         if self._abspath:  # if absolute path is given
-            tod_filename = self.get_name()
+            tod_filename = tod_name
         else:
-            tod_name = self.get_name()
             tod_filename = self._fb.filename_from_name(tod_name, single=True)  # get file path
         print '[INFO] Loading TOD: %s ...' % tod_filename
         tod_data = moby2.scripting.get_tod({'filename': tod_filename, 'repair_pointing': True})
         print '[INFO] TOD loaded'
+        return tod_data
+
+    def execute(self):
+        tod_data = self.fetch()  # prefetched in the background if enabled
         self.get_store().set(self._output_key, tod_data)  # save tod_data in memory for routines to process
 
 
@@ -60,11 +66,13 @@ class TODInfoLoader(Routine):
 class TODSelector(Routine):
     def __init__(self, tod_list):
         """A routine that takes a list of TOD names and run the TODLoop on 
-        the given TOD list based on a base list
+        the given TOD list based on a base list. Note that
+        loop.run(start, end, select={'names': tod_list}) only iterates
+        over these TODs instead of vetoing the others
         :param: 
             tod_list: a list of tods names to run over"""
         Routine.__init__(self)
-        self._tod_list = tod_list 
+        self._tod_list = set(tod_list)  # constant time lookup
             
     def execute(self):
         """Scripts that run for each TOD"""
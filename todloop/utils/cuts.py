@@ -1,7 +1,96 @@
 import numpy as np
 import moby2
+from todloop.utils import intervals
 
 
+def to_cuts_vector(data, nsamps):
+    """Wrap an array of [start, end) intervals into a CutVector"""
+    return moby2.tod.CutsVector(cuts_in=data, nsamps=nsamps)
+
+
+class PackedCuts:
+    """The cuts of all detectors of a TOD packed in three flat arrays:
+    the starts and ends of all cuts, detector after detector, and the
+    offset of the first cut of each detector (CSR layout). It replaces a
+    TODCuts with its list of CutVectors by a few contiguous buffers that
+    are quick to pickle, and which the functions of this module can
+    process for all detectors at once. cuts.cuts[det] still returns the
+    CutVector of a detector."""
+    def __init__(self, det_offsets, starts, ends, nsamps, det_uid=None, sample_offset=0):
+        """
+        :param det_offsets: int array (ndet+1) - the cuts of detector i are
+                            at det_offsets[i]:det_offsets[i+1]
+        :param starts: int32 array - first sample of each cut
+        :param ends: int32 array - sample after the last one of each cut
+        :param nsamps: int - number of samples of the TOD
+        :param det_uid: int array - det_uid of each detector
+        :param sample_offset: int
+        """
+        self.det_offsets = np.asarray(det_offsets, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+        self.nsamps = nsamps
+        ndet = len(self.det_offsets) - 1
+        self.det_uid = np.arange(ndet) if det_uid is None else np.asarray(det_uid)
+        self.sample_offset = sample_offset
+
+    @classmethod
+    def from_tod_cuts(cls, tod_cuts):
+        """Pack a TODCuts (or any object with a list of CutVectors in
+        its cuts attribute)"""
+        if isinstance(tod_cuts, PackedCuts):
+            return tod_cuts
+        return cls.from_list(tod_cuts.cuts, getattr(tod_cuts, 'nsamps', None),
+                             getattr(tod_cuts, 'det_uid', None), getattr(tod_cuts, 'sample_offset', 0))
+
+    @classmethod
+    def from_list(cls, cut_list, nsamps=None, det_uid=None, sample_offset=0):
+        """Pack a list of CutVectors, one per detector"""
+        if isinstance(cut_list, PackedCuts):
+            return cut_list
+        cut_list = [np.asarray(cv).reshape(-1, 2) for cv in cut_list]
+        counts = [len(cv) for cv in cut_list]
+        flat = np.concatenate(cut_list + [np.zeros((0, 2), dtype=np.int32)])
+        det_offsets = np.append(0, np.cumsum(counts))
+        return cls(det_offsets, flat[:, 0], flat[:, 1], nsamps, det_uid, sample_offset)
+
+    def to_tod_cuts(self):
+        """Unpack into a moby2 TODCuts"""
+        tod_cuts = moby2.TODCuts(nsamps=self.nsamps, det_uid=self.det_uid,
+                                 sample_offset=self.sample_offset)
+        for i in range(self.get_ndet()):
+            tod_cuts.cuts[i] = self[i]
+        return tod_cuts
+
+    @property
+    def cuts(self):
+        """Allow cuts.cuts[det] like for a TODCuts"""
+        return self
+
+    def __len__(self):
+        return self.get_ndet()
+
+    def __getitem__(self, det):
+        """Return the CutVector of a detector"""
+        begin, end = self.det_offsets[det], self.det_offsets[det+1]
+        data = np.vstack([self.starts[begin:end], self.ends[begin:end]]).T
+        return to_cuts_vector(data, self.nsamps)
+
+    def get_ndet(self):
+        return len(self.det_offsets) - 1
+
+    def get_dets(self):
+        """Return the detector index of each cut"""
+        return np.repeat(np.arange(self.get_ndet()), np.diff(self.det_offsets))
+
+    def select(self, keep):
+        """Return the packed cuts with only the cuts where keep is True
+        :param keep: bool array - one value per cut"""
+        counts = np.bincount(self.get_dets()[keep], minlength=self.get_ndet())
+        det_offsets = np.append(0, np.cumsum(counts))
+        return PackedCuts(det_offsets, self.starts[keep], self.ends[keep], self.nsamps,
+                          self.det_uid, self.sample_offset)
+
 def merge_cuts(cut1, cut2):
     """Merge two cutvectors
     input cuts have to be CutVector type"""
@@ -11,11 +100,7 @@ def merge_cuts(cut1, cut2):
         return cut1
 
     nsamps = max(cut1[-1][1], cut2[-1][1])
-    c1m = cut1.get_mask(nsamps=nsamps)
-    c2m = cut2.get_mask(nsamps=nsamps)
-    cm = np.logical_or(c1m, c2m)
-    merged = moby2.tod.CutsVector.from_mask(mask=cm)
-    return merged
+    return to_cuts_vector(intervals.union(cut1, cut2), nsamps)
 
 
 def common_cuts(cut1, cut2):
@@ -26,32 +111,117 @@ def common_cuts(cut1, cut2):
     if len(cut2) == 0:
         return cut2
     nsamps = max(cut1[-1][1], cut2[-1][1])
-    c1m = cut1.get_mask(nsamps=nsamps)
-    c2m = cut2.get_mask(nsamps=nsamps)
-    cm = np.logical_and(c1m, c2m)
-    common = moby2.tod.CutsVector.from_mask(mask=cm)
-    return common
+    return to_cuts_vector(intervals.intersection(cut1, cut2), nsamps)
+
+
+def find_coincidences(cuts, pixel_dets, polarized=False):
+    """Find the coincident signals of many pixels at once. The cuts of
+    the detectors of each frequency of a pixel are combined, a union if
+    looking for polarized signals or an intersection otherwise, and the
+    coincident signals are the intersection of both frequencies. With a
+    single detector in a frequency its cuts are used as they are.
+    @par:
+        cuts:       TODCuts or PackedCuts
+        pixel_dets: int array (npix, 2, 2) - detectors of each pixel for
+                    f1 and f2, -1 where a detector is missing. Each
+                    frequency needs at least one detector
+        polarized:  bool, or [bool] to find the coincident signals of
+                    several modes while gathering the cuts only once
+    @ret:
+        PackedCuts - the coincident signals, one row per pixel, or a
+        list of them if polarized is a list"""
+    cuts = PackedCuts.from_tod_cuts(cuts)
+    pixel_dets = np.asarray(pixel_dets, dtype=int).reshape(-1, 2, 2)
+    npix = len(pixel_dets)
+
+    # the cuts of every detector slot, slots grouped by pixel and frequency
+    slot_dets = pixel_dets.ravel()
+    slot_bands = np.repeat(np.arange(2 * npix), 2)
+    present = slot_dets >= 0
+    slot_dets, slot_bands = slot_dets[present], slot_bands[present]
+    counts = np.diff(cuts.det_offsets)[slot_dets]
+    first = np.repeat(cuts.det_offsets[slot_dets] - (np.cumsum(counts) - counts), counts)
+    index = first + np.arange(counts.sum())
+    slots = np.repeat(np.arange(len(slot_dets)), counts)
+
+    # merge overlapping cuts within a detector
+    det_starts, det_ends, slots = intervals.coverage_grouped(cuts.starts[index], cuts.ends[index], slots, 1)
+    ndets = (pixel_dets >= 0).sum(axis=2).ravel()  # per pixel and frequency
+
+    results = []
+    for mode in (polarized if isinstance(polarized, (list, tuple)) else [polarized]):
+        # number of the detectors of a frequency that must be cut at the
+        # same time, by number of detectors present: {ndet: min_count}
+        min_counts = {1: 1, 2: 1} if mode else {1: 1, 2: 2}
+        band_min_count = np.array([min_counts.get(n, 1) for n in range(3)])[ndets]
+
+        # combine the detectors of each frequency, then require both
+        # frequencies of the pixel
+        starts, ends, bands = intervals.coverage_grouped(det_starts, det_ends, slot_bands[slots], band_min_count)
+        starts, ends, pixels = intervals.coverage_grouped(starts, ends, bands // 2, 2)
+        det_offsets = np.append(0, np.cumsum(np.bincount(pixels, minlength=npix)))
+        results.append(PackedCuts(det_offsets, starts, ends, cuts.nsamps))
+    return results if isinstance(polarized, (list, tuple)) else results[0]
+
+
+def find_overlaps(cut_list, to_remove_list, buff=0):
+    """Find the cuts overlapping with the to_remove cuts of the same
+    detector, padded by buff on both sides, for all detectors at once
+    @par:
+        cut_list:       [CutVector] or PackedCuts - cuts of each detector
+        to_remove_list: [CutVector] or PackedCuts - cuts to remove of
+                        each detector
+        buff:           int
+    @ret:
+        bool array - True for the cuts to remove, detector after detector"""
+    cuts = PackedCuts.from_list(cut_list)
+    remove = PackedCuts.from_list(to_remove_list)
+    starts, ends = cuts.starts.astype(np.int64), cuts.ends.astype(np.int64)
+    remove_starts, remove_ends = remove.starts.astype(np.int64), remove.ends.astype(np.int64)
+    if len(starts) == 0 or len(remove_starts) == 0:
+        return np.zeros(len(starts), dtype=bool)
+
+    # shift each detector to its own range of samples, so that a single
+    # sorted search covers all detectors without mixing them
+    span = max(ends.max(), remove_ends.max()) + 2 * buff + 2
+    starts = starts + cuts.get_dets() * span
+    ends = ends + cuts.get_dets() * span
+    remove_starts = remove_starts + remove.get_dets() * span
+    remove_ends = remove_ends + remove.get_dets() * span
+
+    # a cut overlaps if one of the to_remove cuts starting before its end
+    # ends after its start
+    order = np.argsort(remove_starts, kind='mergesort')
+    max_ends = np.maximum.accumulate(remove_ends[order] + buff)
+    n_before = np.searchsorted(remove_starts[order] - buff, ends, side='right')
+    overlap = n_before > 0
+    overlap[overlap] = max_ends[n_before[overlap] - 1] >= starts[overlap]
+    return overlap
 
 
 def remove_overlap_vector(original, to_remove, buff=0):
     """remove the to_remove CutVector from original CutVector"""
-    for row in to_remove:
-        original = original[(original[:, 1]<row[0]-buff) | (original[:, 0]>row[1]+buff)]
-    return original
+    return original[~find_overlaps([original], [to_remove], buff)]
 
 
 def remove_overlap_tod(original, to_remove, buff=0):
-    """remove the to_remove TODCuts from original TODCuts"""
-    ndet = len(original.cuts)
-    for i in range(ndet):
+    """remove the to_remove TODCuts from original TODCuts, both can
+    also be PackedCuts"""
+    overlaps = find_overlaps(original.cuts, to_remove.cuts, buff)
+    if isinstance(original, PackedCuts):
+        return original.select(~overlaps)
+    det_offsets = np.append(0, np.cumsum([len(cv) for cv in original.cuts]))
+    for i in range(len(original.cuts)):
         # loop over detector
-        original.cuts[i] = remove_overlap_vector(original.cuts[i], to_remove.cuts[i], buff)
+        original.cuts[i] = original.cuts[i][~overlaps[det_offsets[i]:det_offsets[i+1]]]
     return original
 
 
 def trim_edge_cuts(cuts, nsamps):
     """remove edge cuts, cuts covering first/last THRES sampling points are removed"""
     thres = 100 # sampling points
+    if isinstance(cuts, PackedCuts):
+        return cuts.select((cuts.starts > thres) & (cuts.ends < (nsamps-thres)))
     for i in range(len(cuts.cuts)):
         cuts.cuts[i] = cuts.cuts[i][(cuts.cuts[i][:, 0] > thres) & (cuts.cuts[i][:, 1] < (nsamps-thres))]
     return cuts
@@ -65,16 +235,118 @@ def cut_contains(cv, v):
     return False
 
 
-def pixels_affected(cs, v):
-    return [int(p) for p in cs if cut_contains(cs[p], v)]
+class CosigIndex:
+    """An index of the coincident signals of all pixels of a TOD, to find
+    the pixels with a cut at a given time or within a time window without
+    going through every cut. The cuts are sorted by their start, and a
+    tree holds the largest end of each range of cuts, so a query only
+    descends into the ranges that start before the window and end after
+    its start: O((k + 1) log n) for k cuts found, however long the other
+    cuts are. Like cut_contains, the ends of the cuts are inclusive."""
+    def __init__(self, cs):
+        """
+        :param cs: {pixel: CutVector} - the coincident signals
+        """
+        pixels, cuts = [], [np.zeros((0, 2), dtype=int)]
+        for p in cs:
+            cv = np.asarray(cs[p]).reshape(-1, 2)
+            pixels.extend([int(p)] * len(cv))
+            cuts.append(cv)
+        cuts = np.concatenate(cuts)
+        order = np.argsort(cuts[:, 0], kind='mergesort')
+        self._starts = cuts[order, 0]
+        self._pixels = np.array(pixels, dtype=int)[order]
+
+        # max tree over the ends: node i covers the nodes 2i and 2i+1,
+        # the leaves are the cuts from node size on
+        self._size = 1
+        while self._size < len(cuts):
+            self._size *= 2
+        tree = np.empty(2 * self._size, dtype=np.int64)
+        tree[:] = np.iinfo(np.int64).min
+        tree[self._size:self._size + len(cuts)] = cuts[order, 1]
+        level = self._size // 2
+        while level >= 1:
+            tree[level:2*level] = np.maximum(tree[2*level:4*level:2], tree[2*level+1:4*level:2])
+            level //= 2
+        self._tree = tree.tolist()  # faster to index one by one
 
+    def query(self, start, end):
+        """Return the pixels with a cut overlapping [start, end], both
+        inclusive"""
+        last = np.searchsorted(self._starts, end, side='right')  # cuts starting by end
+        tree, size = self._tree, self._size
+        hits = []
+        nodes = [(1, 0, size)] if last > 0 else []
+        while nodes:
+            node, first, stop = nodes.pop()
+            if first >= last or tree[node] < start:
+                continue
+            if node >= size:
+                hits.append(node - size)
+            else:
+                middle = (first + stop) // 2
+                nodes.append((2 * node, first, middle))
+                nodes.append((2 * node + 1, middle, stop))
+        return [int(p) for p in np.unique(self._pixels[hits])]
 
-def pixels_affected_in_event(cs, event):
-    pixels_affected_list = []
+
+def get_cosig_index(cs, store=None, key="cosig_index"):
+    """Return the CosigIndex of the coincident signals. With the data
+    store of the loop, the index is built once per TOD and kept in the
+    store under key, so all the routines querying the cosig dict of the
+    TOD share it
+    :param cs: {pixel: CutVector} or CosigIndex
+    :param store: DataStore
+    :param key: string"""
+    if isinstance(cs, CosigIndex):
+        return cs
+    if store is None:
+        return CosigIndex(cs)
+    return store.get_derived(key, cs, CosigIndex)
+
+
+def pixels_affected(cs, v, store=None):
+    """Pixels with a cut at time v
+    cs can be a cosig dict or a CosigIndex, see get_cosig_index for store"""
+    return get_cosig_index(cs, store).query(v, v)
+
+
+def pixels_affected_in_event(cs, event, store=None):
+    """Pixels with a cut between the start (included) and the end
+    (excluded) of an event, cs can be a cosig dict or a CosigIndex, see
+    get_cosig_index for store"""
     start_time = event[0]
     end_time = event[1]
-    for t in range(start_time, end_time):
-        pixels_affected_list.extend(pixels_affected(cs,t))
+    if end_time <= start_time:
+        return []
+    return get_cosig_index(cs, store).query(start_time, end_time - 1)
+
+
+def get_peak_pixels(cosig_data, peak, store=None):
+    """Pixels of a peak of FindEvents or FindClusters, as ints: the pixels
+    of the cluster for FindClusters, whose simultaneous clusters share the
+    same time range, otherwise the pixels with a cosig during the peak
+    @par:
+        cosig_data: dict - output of FindEvents or FindClusters
+        peak:       [start_time, end_time, duration, n_pixels(, pixels)]
+        store:      DataStore, see get_cosig_index"""
+    if len(peak) > 4:
+        return [int(p) for p in peak[4]]
+    peak_pixels = cosig_data.get('peak_pixels')
+    if peak_pixels and peak[0] in peak_pixels:
+        return [int(p) for p in peak_pixels[peak[0]]]
+    return pixels_affected_in_event(cosig_data['coincident_signals'], peak, store)
 
-    return list(set(pixels_affected_list))
 
+def get_event_ids(tod_id, peaks):
+    """Return the id of each peak, <tod_id>.<start_time>, followed by
+    .1, .2, ... for the peaks starting at the same time as an earlier
+    one, such as simultaneous clusters"""
+    ids, seen = [], {}
+    for peak in peaks:
+        event_id = "%d.%d" % (tod_id, peak[0])
+        n = seen.get(event_id, 0)
+        seen[event_id] = n + 1
+        ids.append(event_id if n == 0 else "%s.%d" % (event_id, n))
+    return ids
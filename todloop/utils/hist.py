@@ -13,6 +13,16 @@ class Hist1D(object):
         hist, edges = np.histogram([value], bins=self.nbins, range=(self.xlow, self.xhigh))
         self.hist += hist*weight
 
+    def empty(self):
+        """Return a histogram with the same binning and no counts"""
+        return Hist1D(self.xlow, self.xhigh, self.nbins)
+
+    def merge(self, other):
+        """Add the counts of another histogram with the same binning"""
+        if (self.xlow, self.xhigh, self.nbins) != (other.xlow, other.xhigh, other.nbins):
+            raise ValueError("Cannot merge histograms with different binning")
+        self.hist += other.hist
+
     @property
     def data(self):
         return self.bins, self.hist
@@ -0,0 +1,141 @@
+"""Set operations on intervals stored as (n, 2) arrays of [start, end)
+sample indexes, the layout of moby2 CutsVector. The operations work on
+the interval boundaries only, so they cost O(n log n) in the number of
+intervals instead of O(nsamps) for boolean masks, and give the same
+result as the masks: adjacent intervals are merged and empty ones
+dropped."""
+import numpy as np
+
+
+def empty():
+    """Return an empty set of intervals"""
+    return np.zeros((0, 2), dtype=int)
+
+
+def normalize(intervals):
+    """Sort the intervals and merge the ones overlapping or touching"""
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    intervals = intervals[intervals[:, 1] > intervals[:, 0]]  # drop empty intervals
+    if len(intervals) == 0:
+        return empty()
+    intervals = intervals[np.argsort(intervals[:, 0], kind='mergesort')]
+    ends = np.maximum.accumulate(intervals[:, 1])
+    first = np.ones(len(intervals), dtype=bool)  # first interval of each merged group
+    first[1:] = intervals[1:, 0] > ends[:-1]
+    last = np.append(np.nonzero(first)[0][1:] - 1, len(intervals) - 1)
+    return np.vstack([intervals[first, 0], ends[last]]).T
+
+
+def coverage(interval_sets, min_count=1):
+    """Return the samples covered by at least min_count of the sets of
+    intervals, by sweeping over the sorted boundaries of all sets
+    @par:
+        interval_sets: [(n, 2) array]
+        min_count:     int - 1 for the union, len(interval_sets) for
+                       the intersection"""
+    interval_sets = [normalize(intervals) for intervals in interval_sets]
+    starts = np.concatenate([intervals[:, 0] for intervals in interval_sets])
+    ends = np.concatenate([intervals[:, 1] for intervals in interval_sets])
+    if len(starts) < min_count:
+        return empty()
+    positions = np.concatenate([starts, ends])
+    steps = np.concatenate([np.ones(len(starts), dtype=int), -np.ones(len(ends), dtype=int)])
+    order = np.lexsort((-steps, positions))  # starts before ends at the same sample
+    positions = positions[order]
+    inside = np.cumsum(steps[order]) >= min_count
+    before = np.append(False, inside[:-1])
+    result = np.vstack([positions[inside & ~before], positions[~inside & before]]).T
+    return result[result[:, 1] > result[:, 0]]
+
+
+def coverage_grouped(starts, ends, groups, min_count=1):
+    """Coverage of many groups of intervals at once: for each group,
+    return the samples covered by at least min_count of its intervals.
+    The intervals of a single source in a group (a detector) must not
+    overlap, otherwise they are counted twice.
+    @par:
+        starts:    int array - start of each interval
+        ends:      int array - end of each interval
+        groups:    int array - group (>= 0) of each interval
+        min_count: int or int array with one value per group
+    @ret:
+        starts, ends, groups of the resulting intervals, sorted by
+        group then start"""
+    starts, ends, groups = [np.asarray(x, dtype=np.int64) for x in (starts, ends, groups)]
+    nonempty = ends > starts
+    starts, ends, groups = starts[nonempty], ends[nonempty], groups[nonempty]
+    if len(starts) == 0:
+        return starts, ends, groups
+    # shift each group to its own range of samples, so that a single
+    # sweep covers all groups without mixing them
+    offset = min(starts.min(), 0)
+    span = max(ends.max(), starts.max()) - offset + 2
+    positions = np.concatenate([starts, ends]) - offset + np.concatenate([groups, groups]) * span
+    steps = np.concatenate([np.ones(len(starts), dtype=int), -np.ones(len(ends), dtype=int)])
+    order = np.lexsort((-steps, positions))  # starts before ends at the same sample
+    positions = positions[order]
+    min_count = np.asarray(min_count)
+    if min_count.ndim > 0:  # one value per group
+        min_count = min_count[positions // span]
+    inside = np.cumsum(steps[order]) >= min_count
+    before = np.append(False, inside[:-1])
+    result_starts = positions[inside & ~before]
+    result_ends = positions[~inside & before]
+    keep = result_ends > result_starts
+    result_groups = result_starts[keep] // span
+    return (result_starts[keep] - result_groups * span + offset,
+            result_ends[keep] - result_groups * span + offset, result_groups)
+
+
+def union(a, b):
+    """Samples in a or b"""
+    return coverage([a, b], 1)
+
+
+def intersection(a, b):
+    """Samples in both a and b"""
+    return coverage([a, b], 2)
+
+
+def complement(intervals, nsamps):
+    """Samples in [0, nsamps) not in the intervals"""
+    intervals = clip(intervals, nsamps)
+    starts = np.append(0, intervals[:, 1])
+    ends = np.append(intervals[:, 0], nsamps)
+    result = np.vstack([starts, ends]).T
+    return result[result[:, 1] > result[:, 0]]
+
+
+def difference(a, b):
+    """Samples in a but not in b"""
+    a = normalize(a)
+    if len(a) == 0:
+        return a
+    return intersection(a, complement(b, a[-1, 1]))
+
+
+def clip(intervals, nsamps):
+    """Restrict the intervals to [0, nsamps)"""
+    intervals = np.clip(normalize(intervals), 0, nsamps)
+    return intervals[intervals[:, 1] > intervals[:, 0]]
+
+
+def dilate(intervals, buff, nsamps=None):
+    """Extend each interval by buff samples on both sides, merging the
+    intervals that then overlap, and restrict them to [0, nsamps)"""
+    intervals = normalize(intervals) + np.array([-buff, buff])
+    if nsamps is None:
+        nsamps = intervals[:, 1].max() if len(intervals) > 0 else 0
+    return clip(intervals, nsamps)
+
+
+def filter_length(intervals, min_length=None, max_length=None):
+    """Keep the intervals with min_length <= length <= max_length"""
+    intervals = normalize(intervals)
+    lengths = intervals[:, 1] - intervals[:, 0]
+    keep = np.ones(len(intervals), dtype=bool)
+    if min_length is not None:
+        keep &= lengths >= min_length
+    if max_length is not None:
+        keep &= lengths <= max_length
+    return intervals[keep]
@@ -1,49 +1,303 @@
-import matplotlib
-matplotlib.use("TKAgg")
+import os
+import argparse
 import numpy as np
-from matplotlib import pyplot as plt
-import moby2
+
+
+GEOMETRY_VERSION = 2  # increase when the content of the geometry files changes
+GEOMETRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../data/geometry/")
+
+_pixel_readers = {}  # {(season, array, mask): PixelReader}
+
+
+def get_pixel_reader(season='2016', array='AR3', mask=None):
+    """Return the PixelReader of an array, built once per process and
+    shared by all routines, since reading the array data is slow. The
+    PixelReader returned shouldn't be modified.
+    :param season: string
+    :param array: string
+    :param mask: array - detectors to use, 1 to keep"""
+    mask_key = None if mask is None else tuple(np.asarray(mask).ravel())
+    key = (season, array, mask_key)
+    if key not in _pixel_readers:
+        if os.path.isfile(get_geometry_path(season, array)):  # no need to load moby2
+            _pixel_readers[key] = PixelReader.from_cache(season, array, mask)
+        else:
+            _pixel_readers[key] = PixelReader(season=season, array=array, mask=mask)
+    return _pixel_readers[key]
+
+
+def get_geometry_path(season, array, cache_dir=None):
+    """Return the path of the geometry file of an array"""
+    return os.path.join(cache_dir or GEOMETRY_DIR, "%s_%s.npz" % (season, array.upper()))
+
+
+def build_geometry(season, array, cache_dir=None):
+    """Save the array data of an array from moby2 in a geometry file, to
+    be loaded with PixelReader.from_cache without moby2
+    :param season: string
+    :param array: string"""
+    import moby2
+    array_data = moby2.scripting.get_array_data({'season': season, 'array_name': array})
+    save_geometry(season, array, array_data, cache_dir)
+
+
+def save_geometry(season, array, array_data, cache_dir=None):
+    """Save the array data of an array in a geometry file, along with
+    its pixels and their adjacency, so that they aren't computed again
+    when loading it"""
+    if getattr(array_data, 'dtype', None) is None or array_data.dtype.names is None:
+        # a dict of columns, store it as a structured array
+        names = sorted(array_data.keys())
+        array_data = np.rec.fromarrays([np.asarray(array_data[name]) for name in names], names=names)
+    array_data = np.asarray(array_data).view(np.ndarray)
+    geometry = PixelReader(season=season, array=array, array_data=array_data.copy()).get_geometry()
+    path = get_geometry_path(season, array, cache_dir)
+    if not os.path.exists(os.path.dirname(path)):
+        print '[INFO] Path %s does not exist, creating ...' % os.path.dirname(path)
+        os.makedirs(os.path.dirname(path))
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, version=GEOMETRY_VERSION, season=season, array=array, array_data=array_data,
+                 **geometry)
+    os.rename(path + ".tmp", path)
+    print '[INFO] Geometry saved: %s' % path
+
+
+class SpatialIndex:
+    """A uniform grid over points of the focal plane: the points are
+    sorted by cell, so that the points near a position are found by
+    looking only at the few cells around it instead of all the points"""
+    def __init__(self, positions, cell_size=None):
+        """
+        :param positions: float array (n, 2)
+        :param cell_size: float - by default the average spacing of the
+                          points, so that each cell holds about one point
+        """
+        self._positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if len(self._positions) > 0:
+            self._origin = self._positions.min(axis=0)
+            extent = self._positions.max(axis=0) - self._origin
+        else:
+            self._origin = extent = np.zeros(2)
+        if cell_size is None:
+            area = max(extent[0] * extent[1], extent.max()**2 / max(len(self._positions), 1))
+            cell_size = np.sqrt(area / max(len(self._positions), 1))
+        self._cell_size = float(cell_size) or 1.0
+        self._shape = np.floor(extent / self._cell_size).astype(np.int64) + 1
+        cells = self.get_cells(self._positions)
+        keys = cells[:, 0] * self._shape[1] + cells[:, 1]
+        self._order = np.argsort(keys, kind='mergesort')  # points sorted by cell
+        self._keys = keys[self._order]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def get_cells(self, positions):
+        """Return the (ix, iy) cell of each position"""
+        return np.floor((np.asarray(positions, dtype=float).reshape(-1, 2) - self._origin) /
+                        self._cell_size).astype(np.int64)
+
+    def get_candidates(self, positions, reach):
+        """Return the points in the cells within reach cells of each
+        position, as (query, point) pairs sorted by query"""
+        cells = self.get_cells(positions)
+        queries, points = [], []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                ix, iy = cells[:, 0] + dx, cells[:, 1] + dy
+                valid = (ix >= 0) & (ix < self._shape[0]) & (iy >= 0) & (iy < self._shape[1])
+                keys = (ix * self._shape[1] + iy)[valid]
+                begin = np.searchsorted(self._keys, keys, 'left')
+                end = np.searchsorted(self._keys, keys, 'right')
+                counts = end - begin
+                # expand each [begin, end) range into the rows it covers
+                rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - begin, counts)
+                queries.append(np.repeat(np.nonzero(valid)[0], counts))
+                points.append(self._order[rows])
+        queries, points = np.concatenate(queries), np.concatenate(points)
+        order = np.lexsort((points, queries))
+        return queries[order], points[order]
+
+    def query_radius(self, positions, radius):
+        """Return the points closer than radius to a position
+        :param positions: (x, y) or float array (n, 2)
+        :param radius: float
+        :return: int array - indexes of the points, or a list of them with
+                 one per position for an array of positions"""
+        single = np.ndim(positions) == 1
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        reach = int(np.ceil(radius / self._cell_size))
+        queries, points = self.get_candidates(positions, reach)
+        distances = np.sum((self._positions[points] - positions[queries])**2, axis=1)
+        close = distances < radius**2
+        queries, points = queries[close], points[close]
+        if single:
+            return points
+        return np.split(points, np.searchsorted(queries, np.arange(1, len(positions))))
+
+    def query_knn(self, position, k):
+        """Return the k points closest to a position, closest first
+        :param position: (x, y)
+        :param k: int"""
+        k = min(k, len(self))
+        if k == 0:
+            return np.zeros(0, dtype=int)
+        position = np.asarray(position, dtype=float).reshape(1, 2)
+        reach = 1
+        while True:
+            # the points within reach cells include all the points closer
+            # than reach cells, so stop once k of them are that close
+            points = self.get_candidates(position, reach)[1]
+            distances = np.sqrt(np.sum((self._positions[points] - position)**2, axis=1))
+            order = np.argsort(distances, kind='mergesort')[:k]
+            if len(points) == len(self) or (len(order) == k and distances[order[-1]] <= reach * self._cell_size):
+                return points[order]
+            reach *= 2
+
+    def get_neighbours(self, radius):
+        """Return the points closer than radius to each point, itself
+        excluded, in CSR form: the neighbours of point i are
+        neighbours[offsets[i]:offsets[i+1]]
+        :return: offsets, neighbours"""
+        queries, points = self.get_candidates(self._positions, int(np.ceil(radius / self._cell_size)))
+        distances = np.sum((self._positions[points] - self._positions[queries])**2, axis=1)
+        keep = (distances < radius**2) & (points != queries)
+        queries, points = queries[keep], points[keep]
+        offsets = np.append(0, np.cumsum(np.bincount(queries, minlength=len(self))))
+        return offsets, points
 
 
 class PixelReader:
-    def __init__(self, season='2016', array='AR3', mask=None):
+    def __init__(self, season='2016', array='AR3', mask=None, array_data=None, geometry=None):
+        """
+        :param season: string
+        :param array: string
+        :param mask: array - detectors to use, 1 to keep
+        :param array_data: the array data, loaded from moby2 if not given
+        :param geometry: the pixels and adjacency saved by get_geometry,
+                         computed from the array data if not given
+        """
         self._array_info = {
             'season': season,
             'array_name': array
         }
         self._array_pos = None
         self._freqs = None
-        self._array_data = moby2.scripting.get_array_data(self._array_info)
-        self._pixel_dict = self.generate_pixel_dict()
+        if array_data is None:
+            import moby2  # only needed without a geometry file
+            array_data = moby2.scripting.get_array_data(self._array_info)
+        self._array_data = array_data
+        if geometry is None:
+            self._pixel_dict = self.generate_pixel_dict()
+        else:
+            self._pixel_dict = self.read_pixel_dict(geometry)
         self._mask = mask
         self.calibrate_array(season=self._array_info['season'])
-        self.get_adjacent_detectors = self.adjacent_detector_generator()
+        self.generate_lookup_tables()
+        self.generate_spatial_index(geometry)
+
+    @classmethod
+    def from_cache(cls, season='2016', array='AR3', mask=None, cache_dir=None):
+        """Create a PixelReader from the geometry file saved by
+        build_geometry, without loading moby2"""
+        path = get_geometry_path(season, array, cache_dir)
+        if not os.path.isfile(path):
+            raise IOError("No geometry file %s, build it with: python todloop/utils/pixels.py "
+                          "--season %s --arrays %s" % (path, season, array))
+        with np.load(path) as geometry:
+            if int(geometry['version']) != GEOMETRY_VERSION:
+                raise IOError("Geometry file %s has version %d instead of %d, rebuild it" %
+                              (path, int(geometry['version']), GEOMETRY_VERSION))
+            array_data = geometry['array_data']
+            geometry = dict((name, geometry[name]) for name in geometry.files
+                            if name not in ['version', 'season', 'array', 'array_data'])
+        return cls(season=season, array=array, mask=mask, array_data=array_data, geometry=geometry)
+
+    def get_geometry(self):
+        """Return the pixels, their detectors and their adjacency as
+        arrays to be saved in a geometry file, with the detectors of the
+        pixels[i] in f1[f1_offsets[i]:f1_offsets[i+1]] (same for f2), and
+        its adjacent pixels as in get_adjacency
+        :return: dict"""
+        pixels = np.array(sorted(int(p) for p in self._pixel_dict), dtype=int)
+        geometry = {'pixels': pixels}
+        for freq in ['f1', 'f2']:
+            dets = [self._pixel_dict[str(p)][freq] for p in pixels]
+            geometry[freq] = np.array([det for d in dets for det in d], dtype=int)
+            geometry[freq + '_offsets'] = np.append(0, np.cumsum([len(d) for d in dets])).astype(int)
+        geometry['adjacent_offsets'] = self._adjacent_offsets
+        geometry['adjacent'] = self._adjacent_pixels
+        return geometry
+
+    def read_pixel_dict(self, geometry):
+        """Rebuild the pixel dictionary from the arrays of get_geometry"""
+        self._array_pos = np.vstack([self._array_data['array_x'], self._array_data['array_y']]).T
+        self._freqs = np.sort(np.unique(self._array_data['nom_freq']))[1:]
+        pixel_dict = {}
+        for i, pixel_id in enumerate(geometry['pixels']):
+            pixel_dict[str(pixel_id)] = dict(
+                (freq, [int(det) for det in geometry[freq][geometry[freq + '_offsets'][i]:
+                                                           geometry[freq + '_offsets'][i+1]]])
+                for freq in ['f1', 'f2'])
+        return pixel_dict
 
     def generate_pixel_dict(self):
         """ Generate pixel dictionary that tells which detectors correspond
         to which pixel and frequencies """
         self._array_pos = np.vstack([self._array_data['array_x'], self._array_data['array_y']]).T
         self._freqs = np.sort(np.unique(self._array_data['nom_freq']))[1:]  # gather freqs (exclude 0)
+        nom_freq = np.asarray(self._array_data['nom_freq'])
+        det_type = np.asarray(self._array_data['det_type'])
         pixel_dict = {}  # initialize empty pixel_dict
 
-        for det_id in self._array_data['det_uid']:
-            if np.all(self._array_pos[det_id, :] == [0, 0]):  # not physical
-                continue
-            if self._array_data['det_type'][det_id] != 'tes':  # remove non-tes
-                continue
-            dets = np.where(np.all(self._array_pos == self._array_pos[det_id, :], axis=1))[0]
+        # group the detectors at the same position, in increasing order
+        _, position = np.unique(self._array_pos, axis=0, return_inverse=True)
+        order = np.argsort(position, kind='mergesort')
+        groups = np.split(order, np.nonzero(np.diff(position[order]))[0] + 1)
+
+        det_uid = np.asarray(self._array_data['det_uid'])
+        physical = ~np.all(self._array_pos[det_uid] == 0, axis=1)  # not at [0, 0]
+        tes = det_type[det_uid] == 'tes'  # remove non-tes
+        for group in np.unique(position[det_uid[physical & tes]]):
+            dets = groups[group]
             # make a dictionary of frequencies: f1: lower freq, f2: higher freq
             pol_dict = {
-                'f1': [i for i in dets if self._array_data['nom_freq'][i] == self._freqs[0] and
-                       self._array_data['det_type'][det_id] == 'tes'],
-                'f2': [i for i in dets if self._array_data['nom_freq'][i] == self._freqs[1] and
-                       self._array_data['det_type'][det_id] == 'tes']
+                'f1': [i for i in dets if nom_freq[i] == self._freqs[0]],
+                'f2': [i for i in dets if nom_freq[i] == self._freqs[1]]
             }
             pixel_id = dets[0]  # index pixel by the smallest det_uid
             pixel_dict[str(pixel_id)] = pol_dict
-            
+
         return pixel_dict
 
+    def generate_lookup_tables(self):
+        """Generate arrays to look up the detectors of all pixels at once
+        (taking the mask into account):
+            _pixels: int array - pixel ids, in increasing order
+            _pixel_dets: int array (npix, 2, 2) - f1A, f1B, f2A, f2B
+                         detectors of each pixel, -1 if missing
+            _pixel_ndets: int array (npix, 2) - number of f1, f2 detectors,
+                          which can be more than 2
+            _det_pixels: int array (ndet) - pixel of each detector, -1 if
+                         not part of a pixel"""
+        self._pixels = np.array(sorted(self.get_pixels()), dtype=int)
+        self._pixel_dets = -np.ones((len(self._pixels), 2, 2), dtype=int)
+        self._pixel_ndets = np.zeros((len(self._pixels), 2), dtype=int)
+        self._det_pixels = -np.ones(len(self._array_pos), dtype=int)
+        for i, p in enumerate(self._pixels):
+            for band, dets in enumerate([self.get_f1(p), self.get_f2(p)]):
+                self._pixel_ndets[i, band] = len(dets)
+                self._pixel_dets[i, band, :min(len(dets), 2)] = dets[:2]
+                self._det_pixels[dets] = p
+
+    def get_pixel_table(self):
+        """Return the detectors of all pixels, see generate_lookup_tables
+        :return: pixels, pixel_dets, pixel_ndets"""
+        return self._pixels, self._pixel_dets, self._pixel_ndets
+
+    def get_det_pixels(self):
+        """Return the pixel of each detector, -1 if not part of a pixel"""
+        return self._det_pixels
+
     def calibrate_array(self, season):
         """Calibrate the array_data based on season since different
         seasons have different array_data units"""
@@ -52,29 +306,38 @@ class PixelReader:
             self._array_data['array_y'] /= 10000.0
 
         
-    def adjacent_detector_generator(self):
-        """
-        Generate a get_adjacent_pixels function
-        Return a function to get adjacent detectors
-
-        return: [int] function(int det)
-        """
-        # Find the adjacent detectors
-        adj_dets = [None] * len(self._array_data['array_x'])  # Generate an empty list to store adjacent detector lists
-        ar = self._array_pos
-
-        for i in range(len(self._array_data)):
-            dis = np.dot((ar - ar[i, :])**2, [[1], [1]])
-            _mask = ((dis < 0.6) & (dis > 0)).T & ((ar[:, 0] != 0) | (ar[:, 1] != 0))
-            mask = _mask.flatten()
-            indexes = np.where(mask is True)
-            adj_dets[i] = list(list(indexes)[0])  # Normalize the np array output to list
+    def generate_spatial_index(self, geometry=None):
+        """Index the positions of the pixels and find the adjacent pixels
+        of each one: the pixels at a squared distance below 0.6 in the
+        calibrated positions, other than itself (unless given in the
+        geometry). Radius queries keep using the positions of the array
+        data as loaded, before calibrate_array"""
+        raw_pos = self._array_pos  # set before the calibration
+        self._array_pos = np.vstack([self._array_data['array_x'], self._array_data['array_y']]).T  # calibrated
+        self._spatial_index = SpatialIndex(self._array_pos[self._pixels])
+        if np.array_equal(raw_pos, self._array_pos):
+            self._raw_pos, self._raw_index = self._array_pos, self._spatial_index
+        else:
+            self._raw_pos, self._raw_index = raw_pos, SpatialIndex(raw_pos[self._pixels])
+        self._adjacency_radius = np.sqrt(0.6)
+        if geometry is not None:
+            self._adjacent_offsets = np.asarray(geometry['adjacent_offsets'], dtype=int)
+            self._adjacent_pixels = np.asarray(geometry['adjacent'], dtype=int)
+            return
+        self._adjacent_offsets, adjacent = self._spatial_index.get_neighbours(self._adjacency_radius)
+        self._adjacent_pixels = self._pixels[adjacent]
 
-        # Generate a function to access the data to make sure above procedures run once only
-        def get_adjacent_detectors(detector):
-            return adj_dets[detector]
+    def get_adjacency(self):
+        """Return the adjacent pixels of all pixels in CSR form: the
+        adjacent pixels of pixels[i] are adjacent[offsets[i]:offsets[i+1]]
+        :return: pixels, offsets, adjacent"""
+        return self._pixels, self._adjacent_offsets, self._adjacent_pixels
 
-        return get_adjacent_detectors
+    def get_adjacent_detectors(self, detector):
+        """Return the detectors of the pixels adjacent to the pixel of a
+        detector"""
+        adjacent = self.get_adjacent_pixels(self._det_pixels[detector])
+        return [det for p in adjacent for det in self.get_f1(p) + self.get_f2(p)]
 
     def get_pixels(self):
         return [int(key) for key in self._pixel_dict]
@@ -98,16 +361,33 @@ class PixelReader:
             return self._pixel_dict[str(pixel)]['f1']
 
     def get_adjacent_pixels(self, pixel):
-        all_adj_det = self.get_adjacent_detectors(pixel)
-        return [int(det) for det in all_adj_det if str(det) in self._pixel_dict]
+        """Return the pixels adjacent to a pixel"""
+        row = np.searchsorted(self._pixels, pixel)
+        if row >= len(self._pixels) or self._pixels[row] != pixel:  # not a pixel
+            return []
+        begin, end = self._adjacent_offsets[row], self._adjacent_offsets[row+1]
+        return [int(p) for p in self._adjacent_pixels[begin:end]]
 
-    
     def get_pixels_within_radius(self, pixel, radius):
-        ar = self._array_pos
-        dist = np.sqrt(np.sum((ar - ar[pixel, :])**2, axis=1))
-        return [det for det in np.arange(1056)[dist < radius] if str(det) in self._pixel_dict]
-        
+        """Return the pixels closer than radius to a pixel (or detector),
+        including itself
+        :param pixel: int or [int] - for a list, return one list per pixel
+        :param radius: float - in the units of the array data from moby2,
+                       not calibrated (10^4 times the calibrated positions
+                       for 2017)"""
+        if np.ndim(pixel) > 0:
+            rows = self._raw_index.query_radius(self._raw_pos[pixel], radius)
+            return [[int(p) for p in self._pixels[r]] for r in rows]
+        rows = self._raw_index.query_radius(self._raw_pos[pixel], radius)
+        return [int(p) for p in self._pixels[rows]]
+
+    def get_nearest_pixels(self, pixel, k):
+        """Return the k pixels closest to a pixel (or detector), closest
+        first, including itself if it's a pixel"""
+        return [int(p) for p in self._pixels[self._spatial_index.query_knn(self._array_pos[pixel], k)]]
+
     def plot(self, pixels=None):
+        from matplotlib import pyplot as plt
         plt.plot(self._array_data['array_x'], self._array_data['array_y'], 'r.')
         if pixels:
             plt.plot(self._array_data['array_x'][pixels], self._array_data['array_y'][pixels], 'b.')
@@ -139,7 +419,7 @@ class PixelReader:
         """Return col of pixel(s)
         :param: int or [int]
         :return: int or [int]"""
-        return self._array_data['row'][pixel]
+        return self._array_data['col'][pixel]
 
     def get_row_col_array(self):
         """Return row and col of all pixels (array)
@@ -153,3 +433,12 @@ class PixelReader:
         """Get the xy of the entire array for plotting"""
         return self._array_data['array_x'], self._array_data['array_y']
 
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save the geometry of arrays to be used without moby2")
+    parser.add_argument("--season", default="2016")
+    parser.add_argument("--arrays", nargs="+", default=["AR3"])
+    parser.add_argument("--cache_dir", default=None)
+    args = parser.parse_args()
+    for array_name in args.arrays:
+        build_geometry(args.season, array_name, args.cache_dir)
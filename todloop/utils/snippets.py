@@ -0,0 +1,243 @@
+"""Extract the timeseries of the four detectors of pixels around events.
+The snippets of all windows are gathered at once with a single fancy
+index into the TOD, so the cost scales with the length of the windows
+and not with the length of the TOD, and the TOD data is left untouched
+(the baseline is removed from the snippets, not from the detector rows).
+
+The snippets of all the events of a TOD can be saved once with
+save_snippets and read back as a SnippetStore, which can be used in
+place of tod_data by the routines looking at events, without loading
+the TOD again."""
+import os
+import numpy as np
+
+
+SNIPPETS_VERSION = 1  # increase when the content of the snippet files changes
+
+
+def extract_snippets(tod_data, pr, windows, buffer=10, required=(0, 1, 2, 3)):
+    """Return the f1A, f1B, f2A, f2B timeseries of pixels in windows of
+    samples, each with the mean over its window removed
+    @par:
+        tod_data: TOD with data (ndet, nsamps)
+        pr:       PixelReader of the array
+        windows:  [(pixel, start, end)] or [(pixel, start, end, buffer)]
+        buffer:   int - samples added on both sides of windows without
+                  their own buffer
+        required: [int] - detectors that pixels must have among f1A,
+                  f1B, f2A, f2B (0 to 3), the others are nan if missing
+    @ret:
+        snippets: float array (nwindows, 4, max_len) - samples past the
+                  length of a window are nan
+        starts:   int array - first sample of each snippet
+        lengths:  int array - number of samples of each snippet, windows
+                  are restricted to the TOD
+    Raises KeyError for a window on a pixel that isn't in pr, and
+    ValueError for a pixel missing one of the required detectors (e.g.
+    masked), like reading the detectors of the pixel one by one"""
+    windows = np.array([tuple(window[:3]) + (window[3] if len(window) > 3 else buffer,)
+                        for window in windows], dtype=np.int64).reshape(-1, 4)
+    data = tod_data.data
+    nsamps = data.shape[1]
+    buffers = windows[:, 3]
+    starts = np.clip(windows[:, 1] - buffers, 0, nsamps)
+    ends = np.clip(windows[:, 2] + buffers, 0, nsamps)
+    lengths = np.maximum(ends - starts, 0)
+    dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+    snippets = np.empty((len(windows), 4, lengths.max() if len(windows) > 0 else 0), dtype=dtype)
+    if snippets.size == 0:
+        return snippets, starts, lengths
+
+    # detectors of each window
+    pixels, pixel_dets, _ = pr.get_pixel_table()
+    rows = np.clip(np.searchsorted(pixels, windows[:, 0]), 0, len(pixels) - 1)
+    not_pixel = pixels[rows] != windows[:, 0]
+    if np.any(not_pixel):
+        raise KeyError("Pixel %d is not in the array" % windows[not_pixel, 0][0])
+    dets = pixel_dets[rows].reshape(-1, 4)
+    missing = np.any(dets[:, list(required)] < 0, axis=1)
+    if np.any(missing):
+        raise ValueError("Pixel %d is missing detectors" % windows[missing, 0][0])
+    absent = dets < 0  # detectors not required
+    dets = np.maximum(dets, 0)
+
+    # gather all samples at once: sample j of window i is starts[i] + j
+    offsets = np.arange(snippets.shape[2])
+    samples = np.minimum(starts[:, None] + offsets, nsamps - 1)
+    if data.dtype == dtype and data.flags.c_contiguous:
+        index = dets[:, :, None] * nsamps + samples[:, None, :]
+        np.take(data, index, out=snippets)  # no intermediate copy
+    else:
+        snippets[:] = data[dets[:, :, None], samples[:, None, :]]
+    valid = np.repeat((offsets < lengths[:, None])[:, None, :], 4, axis=1)
+
+    # remove the baseline of each window
+    snippets[~valid] = 0
+    baseline = snippets.sum(axis=2, dtype=np.float64) / np.maximum(lengths, 1)[:, None]
+    snippets -= baseline[:, :, None].astype(dtype)
+    snippets[~valid] = np.nan
+    snippets[absent] = np.nan
+    return snippets, starts, lengths
+
+
+def get_timeseries(tod_data, pr, pixel, s_time, e_time, buffer=10, required=(0, 1, 2, 3)):
+    """Return the time (from the start of the TOD) and the four
+    detectors of a pixel from s_time - buffer to e_time + buffer, with
+    their mean removed. tod_data can be a SnippetStore. The detectors
+    not in required (see extract_snippets) are nan if missing
+    :return: time, d1, d2, d3, d4"""
+    if isinstance(tod_data, SnippetStore):
+        return tod_data.get_timeseries(pixel, s_time, e_time, buffer)
+    snippets, starts, lengths = extract_snippets(tod_data, pr, [(pixel, s_time, e_time, buffer)],
+                                                 required=required)
+    start, length = starts[0], lengths[0]
+    time = tod_data.ctime[start:start+length] - tod_data.ctime[0]
+    d1, d2, d3, d4 = snippets[0, :, :length]
+    return time, d1, d2, d3, d4
+
+
+def save_snippets(path, tod_data, pr, events, buffer=20):
+    """Save the calibrated timeseries of the pixels of events
+    @par:
+        path:     string - path of the .npz file
+        tod_data: TOD with data, ctime, alt and az
+        pr:       PixelReader of the array
+        events:   [(event_id, start, end, pixels)]
+        buffer:   int - samples kept on both sides of each event, the
+                  largest buffer that can be asked to the SnippetStore"""
+    windows, pixel_counts = [], []
+    for event_id, start, end, pixels in events:
+        windows.extend((pixel, start, end, buffer) for pixel in pixels)
+        pixel_counts.append(len(pixels))
+    snippets, starts, lengths = extract_snippets(tod_data, pr, windows)
+
+    # the windows of the pixels of an event are the same
+    event_offsets = np.append(0, np.cumsum(pixel_counts)).astype(np.int64)
+    event_starts = np.array([starts[i] if n else 0 for i, n in zip(event_offsets[:-1], pixel_counts)], dtype=np.int64)
+    event_lengths = np.array([lengths[i] if n else 0 for i, n in zip(event_offsets[:-1], pixel_counts)], dtype=np.int64)
+    sample_offsets = np.append(0, np.cumsum(event_lengths)).astype(np.int64)
+    samples = np.concatenate([np.arange(start, start + length) for start, length in
+                              zip(event_starts, event_lengths)] + [np.zeros(0, dtype=np.int64)])
+    # one chunk (npix, 4, length) per event, without the padding
+    data = np.concatenate([snippets[begin:end, :, :length].ravel() for begin, end, length in
+                           zip(event_offsets[:-1], event_offsets[1:], event_lengths)] +
+                          [np.zeros(0, dtype=np.float32)]).astype(np.float32)
+    data_offsets = np.append(0, np.cumsum(np.array(pixel_counts) * 4 * event_lengths)).astype(np.int64)
+
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, version=SNIPPETS_VERSION, buffer=buffer,
+                            event_ids=np.array([str(event[0]) for event in events]),
+                            event_starts=event_starts, event_lengths=event_lengths,
+                            event_offsets=event_offsets,
+                            pixels=np.array([p for event in events for p in event[3]], dtype=np.int64),
+                            sample_offsets=sample_offsets, ctime0=tod_data.ctime[0],
+                            ctime=tod_data.ctime[samples], alt=tod_data.alt[samples], az=tod_data.az[samples],
+                            data_offsets=data_offsets, data=data)
+    os.rename(path + ".tmp", path)
+    print '[INFO] Snippets saved: %s' % path
+
+
+class SnippetStore:
+    """The timeseries of the pixels of the events of a TOD saved by
+    save_snippets. It can be given to the routines in place of tod_data:
+    get_timeseries reads the snippets, and ctime, alt and az can be
+    indexed by the samples within the events"""
+    def __init__(self, path):
+        """
+        :param path: string - path of the .npz file
+        """
+        with np.load(path) as snippets:
+            if int(snippets['version']) != SNIPPETS_VERSION:
+                raise IOError("Snippet file %s has version %d instead of %d, rebuild it" %
+                              (path, int(snippets['version']), SNIPPETS_VERSION))
+            self._buffer = int(snippets['buffer'])
+            self._event_ids = snippets['event_ids']
+            self._event_starts = snippets['event_starts']
+            self._event_lengths = snippets['event_lengths']
+            self._event_offsets = snippets['event_offsets']
+            self._pixels = snippets['pixels']
+            self._sample_offsets = snippets['sample_offsets']
+            self._data_offsets = snippets['data_offsets']
+            self._data = snippets['data']
+            self._ctime0 = snippets['ctime0']
+            self._ctime = snippets['ctime']
+            windows = self._event_starts, self._event_lengths, self._sample_offsets
+            self.ctime = EventSamples(self._ctime, *windows, first=self._ctime0)
+            self.alt = EventSamples(snippets['alt'], *windows)
+            self.az = EventSamples(snippets['az'], *windows)
+        self._rows = dict((str(event_id), row) for row, event_id in enumerate(self._event_ids))
+        # event of each pixel, to find the events of a pixel
+        self._pixel_events = np.repeat(np.arange(len(self._event_ids)), np.diff(self._event_offsets))
+
+    def __len__(self):
+        return len(self._event_ids)
+
+    def get_buffer(self):
+        return self._buffer
+
+    def get_event_ids(self):
+        return [str(event_id) for event_id in self._event_ids]
+
+    def get_window(self, row):
+        """Return the first sample and the number of samples of an event
+        (by position in the store), buffer included"""
+        return self._event_starts[row], self._event_lengths[row]
+
+    def get_event(self, event_id):
+        """Return the snippets of an event
+        :param event_id: string
+        :return: pixels, time (from the start of the TOD), snippets
+                 float array (npix, 4, length)"""
+        row = self._rows[str(event_id)]
+        pixels = self._pixels[self._event_offsets[row]:self._event_offsets[row+1]]
+        begin, end = self._sample_offsets[row], self._sample_offsets[row+1]
+        time = self._ctime[begin:end] - self._ctime0
+        snippets = self._data[self._data_offsets[row]:self._data_offsets[row+1]]
+        return pixels, time, snippets.reshape(len(pixels), 4, end - begin)
+
+    def get_timeseries(self, pixel, s_time, e_time, buffer=10):
+        """Same as get_timeseries on the TOD, from the event of the pixel
+        covering the most of s_time - buffer to e_time + buffer. Samples
+        further than the buffer of the store from the event are missing,
+        like samples outside the TOD.
+        :return: time, d1, d2, d3, d4"""
+        rows = self._pixel_events[self._pixels == pixel]
+        if len(rows) == 0:
+            raise KeyError("Pixel %d is in no event" % pixel)
+        starts, lengths = self._event_starts[rows], self._event_lengths[rows]
+        begin = np.maximum(starts, s_time - buffer)
+        end = np.minimum(starts + lengths, e_time + buffer)
+        best = np.argmax(end - begin)
+        begin, end = begin[best], max(end[best], begin[best])  # empty if no overlap
+        pixels, time, snippets = self.get_event(self._event_ids[rows[best]])
+        window = slice(begin - starts[best], end - starts[best])
+        d1, d2, d3, d4 = snippets[np.nonzero(pixels == pixel)[0][0], :, window]
+        baseline = np.mean(np.vstack([d1, d2, d3, d4]), axis=1) if end > begin else np.zeros(4)
+        return time[window], d1 - baseline[0], d2 - baseline[1], d3 - baseline[2], d4 - baseline[3]
+
+
+class EventSamples:
+    """A timestream (ctime, alt, az) of which only the samples within the
+    events of a SnippetStore are kept, indexed by sample like the full
+    timestream"""
+    def __init__(self, values, starts, lengths, offsets, first=None):
+        """
+        :param values: array - samples kept, event after event
+        :param starts: int array - first sample of each event
+        :param lengths: int array - number of samples of each event
+        :param offsets: int array - position of each event in values
+        :param first: value of the first sample of the TOD, if kept
+        """
+        self._values = values
+        self._starts = starts
+        self._lengths = lengths
+        self._offsets = offsets
+        self._first = first
+
+    def __getitem__(self, sample):
+        if sample == 0 and self._first is not None:
+            return self._first
+        rows = np.nonzero((self._starts <= sample) & (sample < self._starts + self._lengths))[0]
+        if len(rows) == 0:
+            raise IndexError("Sample %d is not within an event" % sample)
+        return self._values[self._offsets[rows[0]] + sample - self._starts[rows[0]]]
@@ -6,7 +6,7 @@ import pandas as pd
 from scipy.interpolate import interp1d
 from todloop.base import Routine
 from todloop.utils.pixels import PixelReader
-from todloop.utils.cuts import pixels_affected_in_event
+from todloop.utils.cuts import get_peak_pixels, get_event_ids
 
 class CosigToEvent(Routine):
     def __init__(self, input_key="cosig", output_key="events"):
@@ -23,18 +23,17 @@ class CosigToEvent(Routine):
     def execute(self):
         # Retrieve cut data
         cuts = self.get_store().get(self._input_key)
-        cosig = cuts['coincident_signals']
         peaks = cuts['peaks']
         events = []
-        for peak in peaks:
-            event_id = "%d.%d" % (self.get_id(), peak[0])
+        for event_id, peak in zip(get_event_ids(self.get_id(), peaks), peaks):
+            pixels = get_peak_pixels(cuts, peak, self.get_store())  # only the cluster's pixels with FindClusters
             event = {
                 'id': event_id,
                 'start': peak[0],  # start index
                 'end': peak[1],  # end index
                 'duration': peak[2],
                 'number_of_pixels': peak[3],
-                'pixels_affected': pixels_affected_in_event(cosig, peak),
+                'pixels_affected': pixels,
                 'tag': self._tag
             }
             events.append(event)